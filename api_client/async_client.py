@@ -0,0 +1,176 @@
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+from api_client.gdrive_client import (
+    CHANGES_FIELDS,
+    GET_FIELDS,
+    LIST_FIELDS,
+    RATE_LIMIT_REASONS,
+    RETRYABLE_STATUSES,
+    PageTokenExpired,
+    RetryableAPIError,
+    listing_query,
+)
+from api_client.rate_limit import QuotaStats, RetryPolicy, parse_retry_after
+
+# Base URL of the Drive v3 REST API
+DRIVE_API = "https://www.googleapis.com/drive/v3"
+logger = logging.getLogger(__name__)
+
+# Raised for non-retryable HTTP errors from the async client
+class DriveHTTPError(Exception):
+    def __init__(self, status: int, body: bytes):
+        super().__init__(f"Drive API returned {status}")
+        self.status = status
+        self.body = body
+
+class AiohttpTransport:
+    # Default transport for AsyncGDriveClient, sending authorized requests with aiohttp
+    # A transport is any coroutine function (method, url, params) -> (status, headers, body)
+    # with lower-case header names; tests plug in a local fake instead
+
+    def __init__(self, credentials):
+        try:
+            import aiohttp
+        except ImportError as e:
+            raise ImportError("AiohttpTransport needs aiohttp: pip install aiohttp") from e
+        self._aiohttp = aiohttp
+        self.credentials = credentials
+        self._session = None
+
+    async def __call__(self, method: str, url: str, params: Dict):
+        if self._session is None:
+            self._session = self._aiohttp.ClientSession()
+        # Token refresh is a blocking call, keep it off the event loop
+        if not self.credentials.valid:
+            from google.auth.transport.requests import Request
+            await asyncio.to_thread(self.credentials.refresh, Request())
+        headers = {"Authorization": f"Bearer {self.credentials.token}"}
+        async with self._session.request(method, url, params=params, headers=headers) as resp:
+            body = await resp.read()
+            return resp.status, {k.lower(): v for k, v in resp.headers.items()}, body
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+class AsyncGDriveClient:
+    # Non-blocking Drive client: many requests in flight on one event loop
+    # max_concurrency bounds in-flight requests; rate_limiter is a TokenBucket
+    # (shareable with GDriveClient) and retry_policy matches the sync client
+
+    def __init__(self, transport, max_concurrency: int = 50, rate_limiter=None, retry_policy=None):
+        self.transport = transport
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.quota = QuotaStats()
+        self._semaphore = None
+
+    # Sends one GET with rate limiting, bounded concurrency and retries
+    # Returns the decoded JSON body
+    async def _request(self, endpoint: str, path: str, params: Dict) -> Dict:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        params = {k: v for k, v in params.items() if v is not None}
+
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                delay = self.rate_limiter.reserve()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.quota.record(endpoint, "requests")
+            async with self._semaphore:
+                status, headers, body = await self.transport("GET", f"{DRIVE_API}/{path}", params)
+
+            if 200 <= status < 300:
+                return json.loads(body) if body else {}
+
+            throttled = status == 429 or (
+                status == 403 and any(reason in (body or b"") for reason in RATE_LIMIT_REASONS)
+            )
+            if not throttled and status not in RETRYABLE_STATUSES:
+                raise DriveHTTPError(status, body)
+            self.quota.record(endpoint, "throttled" if throttled else "server_errors")
+
+            if attempt >= self.retry_policy.max_retries:
+                self.quota.record(endpoint, "failures")
+                raise RetryableAPIError("Retryable API error")
+
+            delay = self.retry_policy.delay(attempt, parse_retry_after(headers.get("retry-after")))
+            logger.warning(
+                "%s returned %s, retrying in %.1fs (retry %d/%d)",
+                endpoint, status, delay, attempt + 1, self.retry_policy.max_retries,
+            )
+            self.quota.record(endpoint, "retries")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    # Query parameters scoping a call to a shared drive, like GDriveClient._drive_params
+    @staticmethod
+    def _drive_params(drive_id, **params) -> Dict:
+        if not drive_id:
+            return {}
+        return {"driveId": drive_id, "supportsAllDrives": "true", **params}
+
+    # Lists one page of files; same contract as GDriveClient.list_files
+    async def list_files(self, page_size=100, page_token=None, query=None, drive_id=None) -> Tuple[List, Optional[str]]:
+        results = await self._request("files.list", "files", {
+            "pageSize": page_size,
+            "pageToken": page_token,
+            "q": listing_query(query),
+            "fields": LIST_FIELDS,
+            **self._drive_params(drive_id, corpora="drive", includeItemsFromAllDrives="true"),
+        })
+        return results.get("files", []), results.get("nextPageToken")
+
+    # Returns the token marking "now" in the changes feed
+    async def get_start_page_token(self, drive_id=None) -> str:
+        results = await self._request(
+            "changes.getStartPageToken", "changes/startPageToken", self._drive_params(drive_id)
+        )
+        return results["startPageToken"]
+
+    # Lists one page of the changes feed; same contract as GDriveClient.list_changes
+    async def list_changes(self, page_token, page_size=100, drive_id=None):
+        try:
+            results = await self._request("changes.list", "changes", {
+                "pageToken": page_token,
+                "pageSize": page_size,
+                "includeRemoved": "true",
+                "fields": CHANGES_FIELDS,
+                **self._drive_params(drive_id, includeItemsFromAllDrives="true"),
+            })
+        except DriveHTTPError as e:
+            if e.status in (404, 410) or (e.status == 400 and b"pageToken" in (e.body or b"")):
+                raise PageTokenExpired("Changes page token is no longer valid") from e
+            raise
+        return (
+            results.get("changes", []),
+            results.get("nextPageToken"),
+            results.get("newStartPageToken"),
+        )
+
+    # Fetches many files by ID as concurrent gets, bounded by max_concurrency
+    # Returns (files, missing_ids) like GDriveClient.get_files_batch, including
+    # files refused per file (400, or 403 other than rate limits, which are retried)
+    async def get_files(self, file_ids, drive_id=None) -> Tuple[List[Dict], List[str]]:
+        file_ids = list(dict.fromkeys(file_ids))
+        params = {"fields": GET_FIELDS, "supportsAllDrives": "true" if drive_id else None}
+
+        async def get(file_id):
+            try:
+                return await self._request("files.get", f"files/{file_id}", params)
+            except DriveHTTPError as e:
+                if e.status in (400, 403, 404):
+                    if e.status != 404:
+                        logger.warning("files.get %s failed with %d, treating the file as missing", file_id, e.status)
+                    return None
+                raise
+
+        results = await asyncio.gather(*(get(file_id) for file_id in file_ids))
+        files = [result for result in results if result is not None]
+        missing = [file_id for file_id, result in zip(file_ids, results) if result is None]
+        return files, missing
@@ -1,47 +1,302 @@
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-import time
+from api_client.rate_limit import QuotaStats, RetryPolicy, parse_retry_after, shared_bucket
+import logging
+import os
+import threading
+
+# The Google client libraries (googleapiclient, google_auth_oauthlib) take a few
+# hundred milliseconds to import, so they are imported inside the methods that
+# use them: commands that never call Drive don't pay for them
 
 # Providing read-only access to metadata
 SCOPES = ['https://www.googleapis.com/auth/drive.metadata.readonly']
+# Status codes retried with backoff (403 only when it carries a rate limit reason)
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = (b'rateLimitExceeded', b'userRateLimitExceeded')
+# Most calls the Drive API accepts in one batch HTTP request
+BATCH_LIMIT = 100
+# Metadata fields requested for each file
+FILE_FIELDS = "id, name, mimeType, modifiedTime, parents, size"
+LIST_FIELDS = f"nextPageToken, files({FILE_FIELDS}, trashed)"
+CHANGES_FIELDS = f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}, trashed))"
+GET_FIELDS = f"{FILE_FIELDS}, trashed"
+logger = logging.getLogger(__name__)
+
+# Drive search expression (q=) of a listing: trashed files are left out, as the
+# changes feed and batched gets treat them as removed; query narrows it further
+def listing_query(query=None):
+    return f"({query}) and trashed = false" if query else "trashed = false"
+
+# Raised for rate limit and server errors that are worth retrying
+class RetryableAPIError(RuntimeError):
+    pass
+
+# Raised when a changes page token is no longer accepted by the API
+# Callers should fall back to a full listing and take a fresh start token
+class PageTokenExpired(Exception):
+    pass
+
+# Raised when token_file holds no usable credentials and the client may not
+# open the browser consent flow (a runner serving jobs in the background)
+class AuthorizationRequired(RuntimeError):
+    pass
 
 class GDriveClient:
     # Handles authentication and error handling
 
-    def __init__(self, service=None, credentials_file='client_credentials.json', token_file='token.json'):
+    def __init__(
+        self,
+        service=None,
+        credentials_file='client_credentials.json',
+        token_file='token.json',
+        rate_limiter=None,
+        retry_policy=None,
+        interactive=True,
+    ):
         # OAuth client credentials + tokens
         self.credentials_file = credentials_file
         self.token_file = token_file
         self.creds = None
+        # Whether authenticate() may fall back to the browser consent flow
+        self.interactive = interactive
         # Drive API for testing, only authenticated if the service isn't injected
         self.service = service
+        # Per-thread API clients, since the underlying HTTP connection isn't thread safe
+        self._local = threading.local()
+        # Requests wait on a token bucket shared by every client using the same
+        # credential; injected services are unlimited unless a limiter is given
+        if rate_limiter is None and service is None:
+            rate_limiter = shared_bucket(f"{credentials_file}:{token_file}")
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Per-endpoint request, throttle and retry counts
+        self.quota = QuotaStats()
 
         if self.service is None:
             self.authenticate()
 
     # OAuth 2.0 authentication and initializes Google Drive API client 
+    # Uses the account's saved token from token_file, refreshed when expired;
+    # only without a usable token does it run the consent flow (if interactive)
+    # and save the new token to token_file for later runs
     def authenticate(self):
-        flow = InstalledAppFlow.from_client_secrets_file(self.credentials_file, SCOPES)
-        self.creds = flow.run_local_server(port=0)
+        from google.auth.exceptions import RefreshError
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials
+        from googleapiclient.discovery import build
+
+        creds = None
+        if os.path.exists(self.token_file):
+            creds = Credentials.from_authorized_user_file(self.token_file, SCOPES)
+        if creds is not None and not creds.valid and creds.expired and creds.refresh_token:
+            try:
+                creds.refresh(Request())
+                self._save_token(creds)
+            except RefreshError:
+                logger.warning("Could not refresh the token in %s", self.token_file, exc_info=True)
+                creds = None
+
+        if creds is None or not creds.valid:
+            if not self.interactive:
+                raise AuthorizationRequired(
+                    f"No valid token in {self.token_file}; authorize the account from the command line "
+                    f"first (python -m sync_engine.cli login --token-file {self.token_file})"
+                )
+            from google_auth_oauthlib.flow import InstalledAppFlow
+
+            flow = InstalledAppFlow.from_client_secrets_file(self.credentials_file, SCOPES)
+            creds = flow.run_local_server(port=0)
+            self._save_token(creds)
+
+        self.creds = creds
         # Builds v3 API client
         self.service = build('drive', 'v3', credentials=self.creds)
+        self._local.service = self.service
 
-    def list_files(self, page_size=100, page_token=None):
+    # Writes the credentials to token_file, readable by the owner only
+    def _save_token(self, creds):
+        fd = os.open(self.token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(creds.to_json())
+
+    # Returns the Drive API client for the calling thread
+    # Injected services are shared as-is, authenticated ones get one client per thread
+    def _service(self):
+        if self.creds is None:
+            return self.service
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            from googleapiclient.discovery import build
+            service = build('drive', 'v3', credentials=self.creds)
+            self._local.service = service
+        return service
+
+    # Executes an API request under the rate limiter
+    # Retries rate limit and server errors with jittered exponential backoff,
+    # honoring Retry-After; raises RetryableAPIError once retries run out
+    # cost is the number of quota units the request uses (one per call in a batch)
+    def _execute(self, endpoint, request, cost=1):
+        from googleapiclient.errors import HttpError
+
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(cost)
+            self.quota.record(endpoint, 'requests', cost)
+            try:
+                return request.execute()
+            except HttpError as e:
+                throttled = self._is_throttled(e)
+                if not throttled and e.resp.status not in RETRYABLE_STATUSES:
+                    raise
+                self.quota.record(endpoint, 'throttled' if throttled else 'server_errors')
+
+                if attempt >= self.retry_policy.max_retries:
+                    self.quota.record(endpoint, 'failures')
+                    raise RetryableAPIError("Retryable API error") from e
+
+                delay = self.retry_policy.delay(attempt, parse_retry_after(e.resp.get('retry-after')))
+                logger.warning(
+                    "%s returned %s, retrying in %.1fs (retry %d/%d)",
+                    endpoint, e.resp.status, delay, attempt + 1, self.retry_policy.max_retries,
+                )
+                self.quota.record(endpoint, 'retries')
+                self.retry_policy.sleep(delay)
+                attempt += 1
+
+    # Checks whether an HTTP error is a rate limit response
+    @staticmethod
+    def _is_throttled(error):
+        status = error.resp.status
+        return status == 429 or (
+            status == 403 and any(reason in (error.content or b'') for reason in RATE_LIMIT_REASONS)
+        )
+
+    def list_files(self, page_size=100, page_token=None, query=None, drive_id=None):
         # Lists files on next token
+        # query is an optional Drive search expression (q=) restricting the listing
+        # Trashed files are never listed (listing_query)
+        # drive_id lists a shared drive instead of the user's own files
+        from googleapiclient.errors import HttpError
+
         try:
-            results = self.service.files().list(
+            results = self._execute('files.list', self._service().files().list(
                 pageSize=page_size,
                 pageToken=page_token,
-                fields="nextPageToken, files(id, name, mimeType, modifiedTime)"
-            ).execute()
+                q=listing_query(query),
+                fields=LIST_FIELDS,
+                **self._drive_params(drive_id, corpora='drive', includeItemsFromAllDrives=True)
+            ))
             return results.get('files', []), results.get('nextPageToken', None)
-        except HttpError as e:
-            # Handles retryable errors (rate limit or server failures)
-            if e.resp.status in (429, 500, 503):
-                time.sleep(2)
-                raise RuntimeError("Retryable API error") from e
+        except HttpError:
             # Handles non-retryable errors with raised exception
             print("Nonretryable error!")
-            raise
\ No newline at end of file
+            raise
+
+    # Request parameters scoping a call to a shared drive, plus any endpoint-specific
+    # ones; empty for the user's own files
+    @staticmethod
+    def _drive_params(drive_id, **params):
+        if not drive_id:
+            return {}
+        return {'driveId': drive_id, 'supportsAllDrives': True, **params}
+
+    # Returns the token marking "now" in the changes feed (of a shared drive, with drive_id)
+    def get_start_page_token(self, drive_id=None):
+        result = self._execute('changes.getStartPageToken', self._service().changes().getStartPageToken(
+            **self._drive_params(drive_id)
+        ))
+        return result['startPageToken']
+
+    # Lists one page of the changes feed, including removals
+    # Returns changes, the next page token, and the new start token on the last page
+    def list_changes(self, page_token, page_size=100, drive_id=None):
+        from googleapiclient.errors import HttpError
+
+        try:
+            results = self._execute('changes.list', self._service().changes().list(
+                pageToken=page_token,
+                pageSize=page_size,
+                includeRemoved=True,
+                fields=CHANGES_FIELDS,
+                **self._drive_params(drive_id, includeItemsFromAllDrives=True)
+            ))
+            return (
+                results.get('changes', []),
+                results.get('nextPageToken', None),
+                results.get('newStartPageToken', None),
+            )
+        except HttpError as e:
+            # Handles expired or invalid change tokens
+            if e.resp.status in (404, 410) or (e.resp.status == 400 and b'pageToken' in (e.content or b'')):
+                raise PageTokenExpired("Changes page token is no longer valid") from e
+            logger.error("Non-retryable error listing changes: %s", e)
+            raise
+
+    # Fetches metadata for many files by ID, packing up to batch_size
+    # files().get calls into each multipart batch HTTP request
+    # Calls throttled inside a batch are retried in a smaller follow-up batch
+    # Returns (files, missing_ids); missing IDs are files the API reports as not found,
+    # or refuses per file (400 invalid ID, 403 no access), so one such file
+    # doesn't fail the others
+    # Files in a shared drive are only found with drive_id set
+    def get_files_batch(self, file_ids, batch_size=BATCH_LIMIT, drive_id=None):
+        from googleapiclient.errors import HttpError
+
+        file_ids = list(dict.fromkeys(file_ids))
+        batch_size = max(1, min(batch_size, BATCH_LIMIT))
+        files = []
+        missing = []
+
+        for start in range(0, len(file_ids), batch_size):
+            pending = file_ids[start:start + batch_size]
+            attempt = 0
+            while pending:
+                retry = []
+                errors = []
+
+                # Sorts each call's result; request IDs are the file IDs
+                def callback(request_id, response, exception):
+                    if exception is None:
+                        files.append(response)
+                    elif isinstance(exception, HttpError) and (
+                        self._is_throttled(exception) or exception.resp.status in RETRYABLE_STATUSES
+                    ):
+                        retry.append(request_id)
+                    elif isinstance(exception, HttpError) and exception.resp.status == 404:
+                        missing.append(request_id)
+                    elif isinstance(exception, HttpError) and exception.resp.status in (400, 403):
+                        logger.warning(
+                            "files.get %s failed with %d, treating the file as missing",
+                            request_id,
+                            exception.resp.status,
+                        )
+                        missing.append(request_id)
+                    else:
+                        errors.append(exception)
+
+                service = self._service()
+                batch = service.new_batch_http_request(callback=callback)
+                for file_id in pending:
+                    batch.add(
+                        service.files().get(
+                            fileId=file_id,
+                            fields=GET_FIELDS,
+                            **({'supportsAllDrives': True} if drive_id else {})
+                        ),
+                        request_id=file_id,
+                    )
+                self._execute('files.get (batch)', batch, cost=len(pending))
+
+                if errors:
+                    raise errors[0]
+                if retry:
+                    self.quota.record('files.get (batch)', 'throttled', len(retry))
+                    if attempt >= self.retry_policy.max_retries:
+                        self.quota.record('files.get (batch)', 'failures', len(retry))
+                        raise RetryableAPIError("Retryable API error in batch")
+                    self.quota.record('files.get (batch)', 'retries', len(retry))
+                    self.retry_policy.sleep(self.retry_policy.delay(attempt))
+                    attempt += 1
+                pending = retry
+
+        return files, missing
@@ -0,0 +1,113 @@
+import random
+import threading
+import time
+from collections import defaultdict
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# Default Drive budget per credential: 10 requests/second with bursts of 20
+DEFAULT_RATE = 10.0
+DEFAULT_BURST = 20.0
+
+class TokenBucket:
+    # Thread-safe token bucket limiting request rate
+    # Tokens refill continuously at rate per second up to capacity
+    # Reservations may go into debt, so concurrent callers queue up fairly
+
+    def __init__(self, rate: float = DEFAULT_RATE, capacity: Optional[float] = None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    # Takes tokens and returns how many seconds the caller must wait before using them
+    # Lets async callers wait without blocking a thread
+    def reserve(self, tokens: float = 1.0) -> float:
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    # Blocks until tokens are available
+    def acquire(self, tokens: float = 1.0):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            self.sleep(delay)
+
+# One bucket per credential, shared by every client and thread using it
+_shared_buckets: Dict[str, TokenBucket] = {}
+_shared_lock = threading.Lock()
+
+# Returns the process-wide bucket for key, creating it on first use
+def shared_bucket(key: str, rate: float = DEFAULT_RATE, capacity: float = DEFAULT_BURST) -> TokenBucket:
+    with _shared_lock:
+        bucket = _shared_buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, capacity)
+            _shared_buckets[key] = bucket
+        return bucket
+
+class RetryPolicy:
+    # Exponential backoff with full jitter for retryable API errors
+    # Never waits less than the server's Retry-After
+
+    def __init__(
+        self,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 64.0,
+        sleep=time.sleep,
+        jitter=random.random,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.jitter = jitter
+
+    # Seconds to wait before retry number attempt (starting at 0)
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        backoff = min(self.max_delay, self.base_delay * (2 ** attempt)) * self.jitter()
+        if retry_after is not None:
+            return max(retry_after, backoff)
+        return backoff
+
+# Parses a Retry-After header (seconds or HTTP date) into seconds
+def parse_retry_after(value) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+class QuotaStats:
+    # Per-endpoint request accounting (requests, throttled, server_errors, retries, failures)
+
+    def __init__(self):
+        self._counts = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, counter: str, amount: int = 1):
+        with self._lock:
+            self._counts[endpoint][counter] += amount
+
+    # Returns a plain copy of the counters, keyed by endpoint
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {endpoint: dict(counts) for endpoint, counts in self._counts.items()}
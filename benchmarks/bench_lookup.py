@@ -0,0 +1,79 @@
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+from persistence.file_cache import FileCache
+from persistence.store import SQLiteStore
+
+# Benchmarks single-file lookups in lookups per second
+# Compares SQLiteStore.get_file against FileCache for a mix of known IDs
+# (skewed, so a hot set repeats) and unknown IDs
+# Run from the root directory: python -m benchmarks.bench_lookup
+
+
+# Builds a mirror of files synthetic files in pages of 10000
+def make_store(path: Path, files: int) -> SQLiteStore:
+    store = SQLiteStore(path)
+    for start in range(0, files, 10000):
+        store.insert_update_files([
+            {"id": f"file-{i:09d}", "name": f"File {i}", "mimeType": "text/plain", "modifiedTime": "2024-01-01T00:00:00.000Z"}
+            for i in range(start, min(start + 10000, files))
+        ])
+    return store
+
+
+# Lookup IDs: miss_rate of them unknown, the rest drawn with a Pareto skew
+def make_ids(files: int, lookups: int, miss_rate: float, seed: int = 1):
+    rng = random.Random(seed)
+    ids = []
+    for _ in range(lookups):
+        if rng.random() < miss_rate:
+            ids.append(f"unknown-{rng.randrange(10 ** 9):09d}")
+        else:
+            ids.append(f"file-{min(int(rng.paretovariate(1.2)) - 1, files - 1):09d}")
+    return ids
+
+
+# Looks up every ID one call at a time and returns lookups per second
+def run(get_file, ids) -> float:
+    started = time.perf_counter()
+    for file_id in ids:
+        get_file(file_id)
+    return len(ids) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=200000)
+    parser.add_argument("--lookups", type=int, default=200000)
+    parser.add_argument("--miss-rate", type=float, default=0.3)
+    parser.add_argument("--capacity", type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = make_store(Path(tmp) / "bench.db", args.files)
+        ids = make_ids(args.files, args.lookups, args.miss_rate)
+
+        direct = run(store.get_file, ids)
+        started = time.perf_counter()
+        cache = FileCache(store, capacity=args.capacity)
+        startup = time.perf_counter() - started
+        cached = run(cache.get_file, ids)
+        stats = cache.stats()
+        store.close()
+
+    print(f"files={args.files} lookups={args.lookups} miss_rate={args.miss_rate} capacity={args.capacity}")
+    print(f"store.get_file:        {direct:10.0f} lookups/s")
+    print(f"FileCache.get_file:    {cached:10.0f} lookups/s")
+    print(f"speedup:               {cached / direct:10.2f}x")
+    print(f"cache startup:         {startup * 1000:10.1f} ms (Bloom filter of {args.files} files)")
+    print(
+        f"hit rate:              {stats['hit_rate']:10.1%} "
+        f"(hits={stats['hits']} bloom_negatives={stats['bloom_negatives']} "
+        f"misses={stats['misses']} bloom_false_positives={stats['bloom_false_positives']})"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+# Startup benchmarks for the CLI, each run in a fresh interpreter
+# Reports the median wall time of importing sync_engine.cli and of a full
+# `status` call, and whether the Google client stack was imported on the way
+# Run from the root directory: python -m benchmarks.bench_startup --runs 20
+
+ROOT = Path(__file__).resolve().parent.parent
+# Modules that should only load once a job talks to Drive
+GOOGLE_MODULES = ("googleapiclient", "google_auth_oauthlib", "google.oauth2")
+
+IMPORT_SCRIPT = (
+    "import sys, time\n"
+    "started = time.perf_counter()\n"
+    "import sync_engine.cli\n"
+    "elapsed = time.perf_counter() - started\n"
+    f"print(elapsed, *[name for name in {GOOGLE_MODULES!r} if name in sys.modules])\n"
+)
+
+
+def run(command: List[str], cwd: str) -> float:
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+    started = time.perf_counter()
+    subprocess.run(command, cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+# Time spent inside `import sync_engine.cli`, measured by the child itself
+def bench_import(runs: int, cwd: str) -> Dict:
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+    seconds = []
+    loaded = set()
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT], cwd=cwd, env=env, check=True, capture_output=True, text=True,
+        ).stdout.split()
+        seconds.append(float(output[0]))
+        loaded.update(output[1:])
+    return {"median_ms": round(statistics.median(seconds) * 1000, 1), "google_modules_loaded": sorted(loaded)}
+
+
+# Whole-process wall time of `python -m sync_engine.cli status`
+# The first call creates the database; only the runs after it are timed
+def bench_status(runs: int, cwd: str) -> Dict:
+    command = [sys.executable, "-m", "sync_engine.cli", "status"]
+    run(command, cwd)
+    seconds = [run(command, cwd) for _ in range(runs)]
+    return {"median_ms": round(statistics.median(seconds) * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    # The CLI keeps its database in the working directory
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"import: {json.dumps(bench_import(args.runs, tmp))}")
+        print(f"status: {json.dumps(bench_status(args.runs, tmp))}")
+
+
+if __name__ == "__main__":
+    main()
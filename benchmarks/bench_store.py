@@ -0,0 +1,79 @@
+import argparse
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from persistence.store import SQLiteStore
+
+# Benchmarks SQLiteStore page writes (files + checkpoint) in pages per second
+# Compares the old connect-per-call store against the persistent tuned connection
+# Run from the root directory: python -m benchmarks.bench_store
+
+
+# Reproduces the previous behaviour: new connection, default journal, commit + close per call
+class ConnectPerCallStore(SQLiteStore):
+    def _connection(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def _conn(self):
+        conn = self._connection()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+# Builds one synthetic page of Drive file metadata
+def make_page(page_index: int, page_size: int):
+    start = page_index * page_size
+    return [
+        {
+            "id": f"file-{i:09d}",
+            "name": f"File {i}",
+            "mimeType": "text/plain",
+            "modifiedTime": "2024-01-01T00:00:00.000Z",
+        }
+        for i in range(start, start + page_size)
+    ]
+
+
+# Writes pages the way MetadataSyncEngine does and returns pages per second
+def run(store: SQLiteStore, pages: int, page_size: int) -> float:
+    payloads = [make_page(i, page_size) for i in range(pages)]
+    started = time.perf_counter()
+    for i, files in enumerate(payloads):
+        store.insert_update_files(files)
+        store.set_checkpoint("bench_page_token", str(i + 1))
+    elapsed = time.perf_counter() - started
+    return pages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--synchronous", default="NORMAL")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before = run(ConnectPerCallStore(Path(tmp) / "before.db"), args.pages, args.page_size)
+        tuned = SQLiteStore(Path(tmp) / "after.db", synchronous=args.synchronous)
+        after = run(tuned, args.pages, args.page_size)
+        tuned.close()
+
+    print(f"pages={args.pages} page_size={args.page_size}")
+    print(f"connect-per-call:      {before:10.1f} pages/s")
+    print(f"persistent ({args.synchronous:<6}):   {after:10.1f} pages/s")
+    print(f"speedup:               {after / before:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import argparse
+import json
+import resource
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+from api_client.gdrive_client import GDriveClient
+from api_client.rate_limit import RetryPolicy
+from benchmarks.fake_drive import FakeDriveService
+from persistence.store import SQLiteStore
+from sync_engine.metadata_sync import MetadataSyncEngine
+from sync_engine.run_jobs import JobRunner
+
+# End-to-end benchmarks against the local fake Drive service
+# Reports files/sec, p50/p99 page latency, commits/sec and peak RSS for
+# MetadataSyncEngine (full and incremental) and JobRunner
+# Run from the root directory: python -m benchmarks.bench_sync --files 100000
+# --save-baseline base.json stores the results; --baseline base.json compares against them
+
+# Metrics where a larger value is better; the rest are better when smaller
+HIGHER_IS_BETTER = ("files_per_sec", "commits_per_sec", "jobs_per_sec")
+
+
+# GDriveClient that records the wall time of every listing page
+class TimedClient(GDriveClient):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.page_seconds: List[float] = []
+        self._timing_lock = threading.Lock()
+
+    def _timed(self, call, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            with self._timing_lock:
+                self.page_seconds.append(time.perf_counter() - started)
+
+    def list_files(self, *args, **kwargs):
+        return self._timed(super().list_files, *args, **kwargs)
+
+    def list_changes(self, *args, **kwargs):
+        return self._timed(super().list_changes, *args, **kwargs)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# Peak resident set size of this process so far, in MB
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def report(files: int, elapsed: float, store: SQLiteStore, commits_before: int, clients) -> Dict:
+    pages = [seconds for client in clients for seconds in client.page_seconds]
+    quota = {}
+    for client in clients:
+        for endpoint, counts in client.quota.snapshot().items():
+            for name, count in counts.items():
+                quota[name] = quota.get(name, 0) + count
+    return {
+        "files": files,
+        "seconds": round(elapsed, 3),
+        "files_per_sec": round(files / elapsed, 1),
+        "p50_page_ms": round(percentile(pages, 0.50) * 1000, 2),
+        "p99_page_ms": round(percentile(pages, 0.99) * 1000, 2),
+        "commits_per_sec": round((store.commits - commits_before) / elapsed, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "retries": quota.get("retries", 0),
+    }
+
+
+def make_service(args) -> FakeDriveService:
+    return FakeDriveService(
+        file_count=args.files,
+        latency=args.latency_ms / 1000,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+
+
+def make_client(service: FakeDriveService, args) -> TimedClient:
+    return TimedClient(service=service, retry_policy=RetryPolicy(base_delay=args.retry_delay))
+
+
+# Full listing with MetadataSyncEngine
+def bench_full_sync(args, db_dir: Path) -> Dict:
+    store = SQLiteStore(db_dir / "full.db")
+    client = make_client(make_service(args), args)
+    engine = MetadataSyncEngine(client, store, page_size=args.page_size, commit_pages=args.commit_pages, prefetch=args.prefetch)
+    started = time.perf_counter()
+    engine.sync()
+    result = report(store.get_file_count(), time.perf_counter() - started, store, 0, [client])
+    store.close()
+    return result
+
+
+# Changes feed after a full sync, with a share of the drive modified, deleted and added
+def bench_incremental(args, db_dir: Path) -> Dict:
+    store = SQLiteStore(db_dir / "incremental.db")
+    service = make_service(args)
+    engine = MetadataSyncEngine(make_client(service, args), store, page_size=args.page_size, commit_pages=args.commit_pages)
+    engine.sync_incremental()
+
+    changed = max(1, int(args.files * args.churn))
+    service.mutate(modify=changed, delete=changed // 4, add=changed // 4)
+    client = make_client(service, args)
+    engine = MetadataSyncEngine(client, store, page_size=args.page_size, commit_pages=args.commit_pages)
+    commits_before = store.commits
+    started = time.perf_counter()
+    engine.sync_incremental()
+    total = changed + 2 * (changed // 4)
+    result = report(total, time.perf_counter() - started, store, commits_before, [client])
+    store.close()
+    return result
+
+
+# JobRunner draining a queue of metadata_sync jobs, one fake drive listing each
+# Each job syncs its own target, so workers run them side by side
+def bench_job_runner(args, db_dir: Path) -> Dict:
+    store = SQLiteStore(db_dir / "jobs.db")
+    clients = []
+
+    def client_factory():
+        client = make_client(make_service(args), args)
+        clients.append(client)
+        return client
+
+    for index in range(args.jobs):
+        store.create_job("metadata_sync", target=f"drive-{index}")
+    runner = JobRunner(store, workers=args.workers, client_factory=client_factory)
+    started = time.perf_counter()
+    runner.run()
+    elapsed = time.perf_counter() - started
+    result = report(args.files * args.jobs, elapsed, store, 0, clients)
+    result["jobs_per_sec"] = round(args.jobs / elapsed, 2)
+    store.close()
+    return result
+
+
+SCENARIOS = {
+    "full_sync": bench_full_sync,
+    "incremental": bench_incremental,
+    "job_runner": bench_job_runner,
+}
+
+
+# Prints each metric against the baseline; returns the metrics worse than max_regression
+def compare(results: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    regressions = []
+    for scenario, metrics in results.items():
+        for name, value in metrics.items():
+            before = baseline.get(scenario, {}).get(name)
+            if not before or name in ("files", "seconds", "retries"):
+                continue
+            change = (value - before) / before
+            worse = -change if name in HIGHER_IS_BETTER else change
+            flag = "  REGRESSION" if worse > max_regression else ""
+            print(f"{scenario:<12} {name:<16} {before:>12} -> {value:>12} ({change:+.1%}){flag}")
+            if flag:
+                regressions.append(f"{scenario}.{name}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append")
+    parser.add_argument("--files", type=int, default=50000)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--commit-pages", type=int, default=1)
+    parser.add_argument("--prefetch", type=int, default=0)
+    # Fake server behaviour
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-delay", type=float, default=0.001)
+    parser.add_argument("--churn", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    # JobRunner scenario
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2)
+    # Baselines
+    parser.add_argument("--save-baseline")
+    parser.add_argument("--baseline")
+    parser.add_argument("--max-regression", type=float, default=0.10)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.scenario or list(SCENARIOS):
+            results[name] = SCENARIOS[name](args, Path(tmp))
+            print(f"{name}: {json.dumps(results[name])}")
+
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(results, indent=2))
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"Regressed beyond {args.max_regression:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import json
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+# Local stand-in for the Drive v3 API, for benchmarks and tests
+# FakeDriveService plugs into GDriveClient(service=...) and mimics the
+# googleapiclient resource objects it uses; as_transport() serves AsyncGDriveClient
+# Files are synthesized from their index, so millions of files cost no memory;
+# only modified, added and deleted files are stored
+# Queries (q=) are ignored: every listing returns the whole drive
+# Shared drive parameters are ignored too: one service is one drive
+
+MIME_TYPES = (
+    "application/vnd.google-apps.document",
+    "application/vnd.google-apps.spreadsheet",
+    "application/vnd.google-apps.folder",
+    "application/pdf",
+    "image/png",
+    "text/plain",
+)
+
+
+class FakeDriveService:
+    # file_count synthetic files; latency is seconds per request (or a callable
+    # returning it); error_rate is the chance a request fails with one of error_statuses
+
+    def __init__(
+        self,
+        file_count: int = 10000,
+        latency: Union[float, Callable[[], float]] = 0.0,
+        error_rate: float = 0.0,
+        error_statuses=(429, 503),
+        retry_after: Optional[str] = "0",
+        seed: int = 0,
+    ):
+        self.file_count = file_count
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # Dataset changes on top of the synthetic files
+        self._next_index = file_count
+        self._overrides: Dict[int, Dict] = {}
+        self._deleted = set()
+        # Changes feed: (file index, removed) in change order
+        self._change_log: List = []
+        # Requests served and errors injected, by endpoint
+        self.requests: Dict[str, int] = {}
+        self.injected_errors = 0
+
+    # Synthetic metadata for file index i
+    @staticmethod
+    def file_id(i: int) -> str:
+        return f"f{i:010d}"
+
+    def _file(self, i: int) -> Dict:
+        override = self._overrides.get(i)
+        if override is not None:
+            return dict(override)
+        mime_type = MIME_TYPES[i % len(MIME_TYPES)]
+        file = {
+            "id": self.file_id(i),
+            "name": f"file-{i}",
+            "mimeType": mime_type,
+            "modifiedTime": f"2020-01-01T00:00:{i % 60:02d}.000Z",
+            "parents": [self._parent_id(i)],
+        }
+        if not mime_type.startswith("application/vnd.google-apps."):
+            file["size"] = str(i * 37 % 100000)
+        return file
+
+    # Every sixth file is a folder; folder k holds the files of folders 10k..10k+9
+    # Folder 2 sits directly in My Drive
+    def _parent_id(self, i: int) -> str:
+        parent = (i // len(MIME_TYPES)) // 10 * len(MIME_TYPES) + 2
+        return "root" if parent == i else self.file_id(parent)
+
+    # IDs of every file currently in the fake drive
+    def live_ids(self) -> List[str]:
+        with self._lock:
+            return [self.file_id(i) for i in range(self._next_index) if i not in self._deleted]
+
+    # Changes the dataset: renames, deletes and adds files, recording each in the changes feed
+    def mutate(self, modify: int = 0, delete: int = 0, add: int = 0):
+        with self._lock:
+            live = [i for i in range(self._next_index) if i not in self._deleted]
+            chosen = self._random.sample(live, min(len(live), modify + delete))
+            for i in chosen[:modify]:
+                file = self._file(i)
+                file["name"] = f"{file['name']}-v{len(self._change_log)}"
+                file["modifiedTime"] = "2030-01-01T00:00:00.000Z"
+                self._overrides[i] = file
+                self._change_log.append((i, False))
+            for i in chosen[modify:]:
+                self._deleted.add(i)
+                self._change_log.append((i, True))
+            for _ in range(add):
+                i = self._next_index
+                self._next_index += 1
+                self._change_log.append((i, False))
+
+    # Applies latency and fault injection, then produces the response
+    def _serve(self, endpoint: str, respond: Callable[[], Dict]) -> Dict:
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            time.sleep(latency)
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            fail = self.error_rate and self._random.random() < self.error_rate
+            if fail:
+                self.injected_errors += 1
+                status = self._random.choice(self.error_statuses)
+            else:
+                return respond()
+        headers = {"status": status}
+        if self.retry_after is not None:
+            headers["retry-after"] = self.retry_after
+        raise HttpError(httplib2.Response(headers), b"{}")
+
+    def _list(self, pageSize=100, pageToken=None, q=None, **kwargs) -> Dict:
+        start = int(pageToken) if pageToken else 0
+        end = min(start + pageSize, self._next_index)
+        files = [self._file(i) for i in range(start, end) if i not in self._deleted]
+        result = {"files": files}
+        if end < self._next_index:
+            result["nextPageToken"] = str(end)
+        return result
+
+    def _changes(self, pageToken, pageSize=100, **kwargs) -> Dict:
+        start = int(pageToken)
+        end = min(start + pageSize, len(self._change_log))
+        changes = []
+        for i, removed in self._change_log[start:end]:
+            change = {"fileId": self.file_id(i), "removed": removed}
+            if not removed:
+                change["file"] = self._file(i)
+            changes.append(change)
+        result = {"changes": changes}
+        if end < len(self._change_log):
+            result["nextPageToken"] = str(end)
+        else:
+            result["newStartPageToken"] = str(end)
+        return result
+
+    def _get(self, fileId, **kwargs) -> Dict:
+        i = int(fileId[1:]) if fileId.startswith("f") and fileId[1:].isdigit() else -1
+        if i < 0 or i >= self._next_index or i in self._deleted:
+            raise HttpError(httplib2.Response({"status": 404}), b"{}")
+        return self._file(i)
+
+    # googleapiclient-style resources
+    def files(self):
+        return _Resource(self, {"list": ("files.list", self._list), "get": ("files.get", self._get)})
+
+    def changes(self):
+        return _Resource(self, {
+            "list": ("changes.list", self._changes),
+            "getStartPageToken": (
+                "changes.getStartPageToken",
+                lambda **kwargs: {"startPageToken": str(len(self._change_log))},
+            ),
+        })
+
+    def new_batch_http_request(self, callback):
+        return _Batch(self, callback)
+
+    # Coroutine transport for AsyncGDriveClient, serving the same dataset
+    def as_transport(self):
+        import asyncio
+
+        routes = {
+            "files": ("files.list", self._list),
+            "changes": ("changes.list", self._changes),
+            "changes/startPageToken": (
+                "changes.getStartPageToken",
+                lambda **kwargs: {"startPageToken": str(len(self._change_log))},
+            ),
+        }
+
+        async def transport(method, url, params):
+            path = url.split("/drive/v3/", 1)[1]
+            if path in routes:
+                endpoint, handler = routes[path]
+                call = lambda: handler(**params)
+            else:
+                endpoint = "files.get"
+                call = lambda: self._get(path.split("/", 1)[1], **params)
+            try:
+                body = await asyncio.to_thread(self._serve, endpoint, call)
+            except HttpError as e:
+                return e.resp.status, {k: v for k, v in e.resp.items() if k != "status"}, e.content
+            return 200, {}, json.dumps(body).encode()
+
+        return transport
+
+
+class _Request:
+    def __init__(self, service: FakeDriveService, endpoint: str, respond: Callable[[], Dict]):
+        self.service = service
+        self.endpoint = endpoint
+        self.respond = respond
+
+    def execute(self):
+        return self.service._serve(self.endpoint, self.respond)
+
+
+class _Resource:
+    def __init__(self, service: FakeDriveService, methods: Dict):
+        self._service = service
+        self._methods = methods
+
+    def __getattr__(self, name):
+        endpoint, handler = self._methods[name]
+        return lambda **kwargs: _Request(self._service, endpoint, lambda: handler(**kwargs))
+
+
+class _Batch:
+    # Multipart batch: one round trip, one callback per call
+    def __init__(self, service: FakeDriveService, callback):
+        self.service = service
+        self.callback = callback
+        self.calls = []
+
+    def add(self, request: _Request, request_id: str):
+        self.calls.append((request_id, request))
+
+    def execute(self):
+        def respond():
+            return None
+
+        self.service._serve("batch", respond)
+        for request_id, request in self.calls:
+            try:
+                self.callback(request_id, request.respond(), None)
+            except HttpError as e:
+                self.callback(request_id, None, e)
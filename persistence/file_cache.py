@@ -0,0 +1,201 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+from persistence.store import DEFAULT_TARGET, SQLiteStore
+
+# In-process read-through cache over SQLiteStore.get_file/get_files
+# An LRU holds recent lookups (misses too) and a Bloom filter of every
+# mirrored file answers lookups of unknown IDs without a query. Both follow
+# the file_changes log: once the store commits, changed files are invalidated
+# and added to the filter before the next lookup. Commits through this store
+# (any thread) are seen right away; other processes' through PRAGMA
+# data_version, polled at most every max_staleness seconds
+
+# Bloom filter with k bit positions per item derived from the item's hash()
+# (double hashing over its two 32-bit halves); no false negatives, about
+# false_positive_rate false positives while it holds at most capacity items
+# hash() of str is salted per process, which is fine for a filter that only
+# lives in memory, and much cheaper than a cryptographic digest
+class BloomFilter:
+    def __init__(self, capacity: int, false_positive_rate: float = 0.01):
+        self.capacity = max(1, capacity)
+        self.bits = max(64, int(-self.capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / self.capacity * math.log(2)))
+        self.items = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, item):
+        value = hash(item) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = value & 0xFFFFFFFF, (value >> 32) | 1
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hashes)]
+
+    def add(self, item):
+        array = self._array
+        for position in self._positions(item):
+            array[position >> 3] |= 1 << (position & 7)
+        self.items += 1
+
+    def __contains__(self, item) -> bool:
+        array = self._array
+        for position in self._positions(item):
+            if not array[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+# LRU cache of file lookups, keyed by (target, id); a cached None is a known miss
+# capacity bounds the entries kept; max_staleness bounds how long another
+# process's writes can go unseen (0 polls data_version on every lookup)
+# The filter is sized for twice the files at startup and rebuilt once inserts
+# fill it, which also drops deleted files from it
+class FileCache:
+    def __init__(
+        self,
+        store: SQLiteStore,
+        capacity: int = 100_000,
+        false_positive_rate: float = 0.01,
+        max_staleness: float = 0.1,
+    ):
+        self.store = store
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.max_staleness = max_staleness
+        self._entries: "OrderedDict[tuple, Optional[object]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # One thread at a time reads the change log
+        self._catch_up_lock = threading.Lock()
+        # data_version is per connection, so each thread remembers the one it saw
+        self._local = threading.local()
+        self._seq = 0
+        self._commits = -1
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.bloom_negatives = 0
+        self.bloom_false_positives = 0
+        self.invalidations = 0
+        self._rebuild()
+
+    # Loads every live file into a new filter and empties the LRU
+    # The filter is sized from the live file count and filled straight from the
+    # key iterator, so the keys are never all held in memory at once
+    # The log position is read first: changes that land during the scan are
+    # replayed by the next catch-up, which is harmless
+    def _rebuild(self):
+        seq = self.store.get_change_seq()
+        bloom = BloomFilter(max(2 * self.store.get_file_count(), 1024), self.false_positive_rate)
+        for key in self.store.iter_file_keys():
+            bloom.add(key)
+        with self._lock:
+            self._bloom = bloom
+            self._seq = seq
+            self._entries.clear()
+
+    # Applies file changes logged since the last catch-up, if anything was committed
+    def _catch_up(self):
+        commits = self.store.commits
+        if commits == self._commits:
+            # Nothing committed here: polls for other processes' commits
+            now = time.monotonic()
+            if now - self._checked_at < self.max_staleness:
+                return
+            self._checked_at = now
+            version = self.store.data_version()
+            if getattr(self._local, "version", None) == version:
+                return
+            self._local.version = version
+
+        with self._catch_up_lock:
+            self._commits = commits
+            while True:
+                changes = self.store.get_changes(since=self._seq, limit=1000)
+                if not changes:
+                    break
+                with self._lock:
+                    for change in changes:
+                        key = (change["target"], change["file_id"])
+                        if self._entries.pop(key, False) is not False:
+                            self.invalidations += 1
+                        # Updated files are in the filter already; re-adding
+                        # them would only run up its count toward a rebuild
+                        if change["op"] == "insert":
+                            self._bloom.add(key)
+                    self._seq = changes[-1]["seq"]
+            if self._bloom.items > self._bloom.capacity:
+                self._rebuild()
+
+    # Stores a lookup result, evicting the least recently used entries past capacity
+    def _put(self, key: tuple, row):
+        self._entries[key] = row
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    # Returns a live file's LOOKUP_COLUMNS row, or None if it isn't mirrored
+    def get_file(self, file_id: str, target: str = DEFAULT_TARGET):
+        self._catch_up()
+        key = (target, file_id)
+        with self._lock:
+            row = self._entries.get(key, False)
+            if row is not False:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return row
+            if key not in self._bloom:
+                self.bloom_negatives += 1
+                return None
+        return self._load([file_id], target).get(file_id)
+
+    # Returns {id: row} of the live files among file_ids; IDs the LRU holds or
+    # the filter rules out are answered in memory, the rest in one query
+    def get_files(self, file_ids: Iterable[str], target: str = DEFAULT_TARGET) -> Dict[str, object]:
+        self._catch_up()
+        found = {}
+        missing = []
+        with self._lock:
+            for file_id in file_ids:
+                key = (target, file_id)
+                row = self._entries.get(key, False)
+                if row is not False:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    if row is not None:
+                        found[file_id] = row
+                elif key in self._bloom:
+                    missing.append(file_id)
+                else:
+                    self.bloom_negatives += 1
+        if missing:
+            found.update(self._load(missing, target))
+        return found
+
+    # Reads files the cache doesn't hold and caches the results, misses included
+    # Rows read while a catch-up ran may already be stale; they are returned
+    # but not cached
+    def _load(self, file_ids, target: str) -> Dict[str, object]:
+        seq = self._seq
+        rows = self.store.get_files(file_ids, target)
+        with self._lock:
+            self.misses += len(file_ids)
+            # Also counts deleted files: the filter keeps them until its next rebuild
+            self.bloom_false_positives += len(file_ids) - len(rows)
+            if self._seq == seq:
+                for file_id in file_ids:
+                    self._put((target, file_id), rows.get(file_id))
+        return rows
+
+    # Lookup counters; hit_rate counts lookups answered without a query
+    def stats(self) -> Dict[str, float]:
+        answered = self.hits + self.bloom_negatives
+        total = answered + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bloom_negatives": self.bloom_negatives,
+            "bloom_false_positives": self.bloom_false_positives,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            "hit_rate": answered / total if total else 0.0,
+        }
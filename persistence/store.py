@@ -1,90 +1,1257 @@
+import json
+import math
+import os
 import sqlite3
+import threading
+import weakref
 from contextlib import contextmanager
-from typing import Iterable, Dict, Optional
+from typing import Iterable, Iterator, Dict, List, Optional, Tuple
+
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+# sync_state key holding the latest sync generation; upserts stamp rows with it
+GENERATION_KEY = "files_generation"
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+# Schema version stored in PRAGMA user_version; bump it with each new _migrate_vN
+SCHEMA_VERSION = 6
+# Keyset columns of each iter_files order; both are unique per row
+ITER_ORDERS = {"id": ("target", "id"), "modified_time": ("modified_time", "id", "target")}
+# files columns carried by snapshots, in snapshot row order
+SNAPSHOT_COLUMNS = (
+    "target", "id", "name", "mime_type", "modified_time", "sync_generation", "deleted_at", "parent_id", "size", "path",
+)
+# files columns returned by get_file/get_files: everything the change log
+# tracks, so a cached copy stays valid until the file's next logged change
+LOOKUP_COLUMNS = ("target", "id", "name", "mime_type", "modified_time", "parent_id", "size")
+# Sync target of files and jobs that don't name one: the authenticated user's drive
+# Other targets (a shared drive, another account) are mirrored side by side
+DEFAULT_TARGET = ""
+
+# Referent whose finalizer closes a thread's connection when the thread exits
+class _ConnectionOwner:
+    pass
 
 # Class providing an interface for interacting with SQLite
 # Manages files, jobs, and sync status
 class SQLiteStore:
-    def __init__(self, db_path: str = "sync.db"):
+    def __init__(
+        self,
+        db_path: str = "sync.db",
+        synchronous: str = "NORMAL",
+        cache_size: int = -65536,
+        mmap_size: int = 268435456,
+        busy_timeout: float = 30.0,
+        cached_statements: int = 256,
+    ):
         # Defines path to SQLite database file + initializes tables
         self.db_path = db_path
+
+        # Connection tuning, applied to every per-thread connection
+        # NORMAL is durable in WAL mode except for the last commits on power loss
+        # Negative cache_size is in KiB (default 64 MiB), mmap_size is in bytes
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Error: Unknown synchronous mode {synchronous}")
+        self.synchronous = synchronous.upper()
+        self.cache_size = int(cache_size)
+        self.mmap_size = int(mmap_size)
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+
+        # One long-lived connection per thread, tracked so close() can release them
+        # A thread's connection is closed when the thread exits (see _connection)
+        self._local = threading.local()
+        self._connections = set()
+        self._lock = threading.Lock()
+        # Number of write transactions committed through _conn(), across all threads
+        self.commits = 0
         self._init_db()
 
+    # Returns this thread's connection, opening and tuning it on first use
+    # Connections are reopened after a fork since SQLite handles can't cross processes
+    # Note: ":memory:" databases are private to each thread's connection
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        # check_same_thread is off only so close() can release other threads' connections
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+        )
+        # Returns rows as dictionary objects
+        conn.row_factory = sqlite3.Row
+        # New databases return freed pages to the OS through incremental vacuum
+        # Only takes effect before the first table (and WAL) exists, a no-op after
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size={self.cache_size}")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        self._local.depth = 0
+        # Thread-local values are dropped when their thread exits, which runs the
+        # finalizer: short-lived threads (job heartbeats, shard workers) don't
+        # leave their connections open for the life of the process
+        self._local.owner = _ConnectionOwner()
+        weakref.finalize(self._local.owner, self._release, conn, os.getpid())
+        with self._lock:
+            self._connections.add(conn)
+        return conn
+
+    # Closes the connection of a thread that exited, unless close() already did
+    # Connections inherited through a fork belong to the parent and are left alone
+    def _release(self, conn: sqlite3.Connection, pid: int):
+        with self._lock:
+            if conn not in self._connections:
+                return
+            self._connections.discard(conn)
+        if os.getpid() == pid:
+            conn.close()
+
     @contextmanager
     # Context manager for SQLite connections
-    # Commits on success, rolls back on exceptions, closes connection after
+    # Commits on success, rolls back on exceptions, keeps the connection open for reuse
+    # Nested blocks on the same thread join the outermost transaction
     def _conn(self):
-        conn = sqlite3.connect(self.db_path)
-        # Returns rows as dictionary objects
-        conn.row_factory = sqlite3.Row
+        conn = self._connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        self._local.depth = 1
         try:
             yield conn
+            # Only count blocks that actually wrote something
+            wrote = conn.in_transaction
             conn.commit()
-        except Exception:
+            if wrote:
+                with self._lock:
+                    self.commits += 1
+        except BaseException:
+            # Also covers KeyboardInterrupt so no open transaction outlives the block
             conn.rollback()
             raise
         finally:
+            self._local.depth = 0
+
+    # Groups several store calls into one transaction that commits once at the end
+    # Rolls everything back if the block raises
+    @contextmanager
+    def transaction(self):
+        with self._conn() as conn:
+            yield conn
+
+    # Returns a counter that changes whenever another connection commits
+    # Cheap to poll: it doesn't read any table
+    def data_version(self) -> int:
+        return self._connection().execute("PRAGMA data_version").fetchone()[0]
+
+    # Closes every connection opened by this store
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for conn in connections:
             conn.close()
+        self._local = threading.local()
 
-    # Initializes database tables for files, sync state, and jobs
+    # Creates or migrates the schema, once per database file
+    # The schema version lives in PRAGMA user_version, so opening an up-to-date
+    # database is a single header read rather than a round of DDL
     def _init_db(self):
+        if self._connection().execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
         with self._conn() as conn:
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS files (
-                    id TEXT PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    mime_type TEXT NOT NULL,
-                    modified_time TEXT NOT NULL
+            # Takes the write lock up front so concurrent processes migrate one at a time
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < 1:
+                self._migrate_v1(conn)
+            if version < 2:
+                self._migrate_v2(conn)
+            if version < 3:
+                self._migrate_v3(conn)
+            if version < 4:
+                self._migrate_v4(conn)
+            if version < 5:
+                self._migrate_v5(conn)
+            if version < 6:
+                self._migrate_v6(conn)
+            # Rebuilding a table drops its triggers, so they are recreated
+            # against the current schema after any migration
+            self._create_triggers(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    # Version 1: the full schema
+    # Also brings databases from before versioning (user_version 0) up to date:
+    # every statement tolerates existing tables, and missing columns are added
+    def _migrate_v1(self, conn):
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                mime_type TEXT NOT NULL,
+                modified_time TEXT NOT NULL,
+                sync_generation INTEGER NOT NULL DEFAULT 0,
+                deleted_at TEXT,
+                parent_id TEXT,
+                size INTEGER,
+                path TEXT
+            )
+            """
+        )
+        self._add_missing_columns(conn, "files", {
+            "sync_generation": "INTEGER NOT NULL DEFAULT 0",
+            "deleted_at": "TEXT",
+            "parent_id": "TEXT",
+            "size": "INTEGER",
+            "path": "TEXT",
+        })
+
+        # Finds live rows a full sync didn't see without scanning the table
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_files_live_generation
+            ON files (sync_generation) WHERE deleted_at IS NULL
+            """
+        )
+
+        # Filter and sort indexes for search_files, covering live rows only
+        # Both end in (modified_time, id), the keyset pagination order
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_files_live_mime_type
+            ON files (mime_type, modified_time, id) WHERE deleted_at IS NULL
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_files_live_modified_time
+            ON files (modified_time, id) WHERE deleted_at IS NULL
+            """
+        )
+        self._create_search_index(conn)
+
+        # Folder hierarchy: children by parent, and cached full paths so a
+        # path lookup is one seek and a subtree is one range scan
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_files_live_parent
+            ON files (parent_id) WHERE deleted_at IS NULL
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_files_live_path
+            ON files (path, id) WHERE deleted_at IS NULL
+            """
+        )
+
+        # Append-only log of every real insert, update and delete on files
+        # seq is monotonically increasing and serves as the consumer cursor
+        # Filled by the triggers from _create_triggers
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS file_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_id TEXT NOT NULL,
+                op TEXT NOT NULL,
+                name TEXT,
+                mime_type TEXT,
+                modified_time TEXT,
+                changed_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+
+        # Stores checkpoints for sync state
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sync_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+            """
+        )
+
+        # Stores jobs and tasks
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                type TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                last_error TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                lease_owner TEXT,
+                lease_expires_at TEXT,
+                payload TEXT
+            )
+            """
+        )
+
+        # Adds columns introduced after a database was first created
+        self._add_missing_columns(conn, "jobs", {
+            "lease_owner": "TEXT",
+            "lease_expires_at": "TEXT",
+            "payload": "TEXT",
+        })
+
+        # Queue index: claims, pending listings and lease reclaims seek by status
+        # in claim order, and attempts are checked without reading the row
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_jobs_queue
+            ON jobs (status, created_at, id, attempts, max_attempts)
+            """
+        )
+        # Newest-first job listings (CLI status)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at)")
+
+        # Finished jobs moved out of the queue by compact_jobs, one compact row each
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job_history (
+                id INTEGER PRIMARY KEY,
+                type TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                last_error TEXT,
+                created_at TEXT,
+                finished_at TEXT
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_job_history_finished ON job_history (finished_at)")
+
+        # One row per job execution with its stage timers and counters (JSON)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id INTEGER NOT NULL,
+                job_type TEXT NOT NULL,
+                owner TEXT,
+                status TEXT NOT NULL,
+                duration_seconds REAL NOT NULL,
+                metrics TEXT,
+                finished_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_job_runs_job_id ON job_runs (job_id)")
+
+    # Version 2: sync targets
+    # Files are keyed by (target, id), so several drives or accounts are mirrored
+    # side by side; SQLite can't change a primary key in place, so the table is
+    # rebuilt. Rowids are carried over, which keeps the name index valid
+    # Existing files, change log rows and jobs belong to DEFAULT_TARGET
+    def _migrate_v2(self, conn):
+        conn.execute(
+            """
+            CREATE TABLE files_v2 (
+                target TEXT NOT NULL DEFAULT '',
+                id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                mime_type TEXT NOT NULL,
+                modified_time TEXT NOT NULL,
+                sync_generation INTEGER NOT NULL DEFAULT 0,
+                deleted_at TEXT,
+                parent_id TEXT,
+                size INTEGER,
+                path TEXT,
+                PRIMARY KEY (target, id)
+            )
+            """
+        )
+        conn.execute(
+            """
+            INSERT INTO files_v2 (
+                rowid, id, name, mime_type, modified_time, sync_generation, deleted_at, parent_id, size, path
+            )
+            SELECT rowid, id, name, mime_type, modified_time, sync_generation, deleted_at, parent_id, size, path
+            FROM files
+            """
+        )
+        # Takes the old table's indexes and triggers with it
+        conn.execute("DROP TABLE files")
+        conn.execute("ALTER TABLE files_v2 RENAME TO files")
+
+        # Sweeps, parent lookups and path ranges run within one target
+        conn.execute(
+            """
+            CREATE INDEX idx_files_live_generation
+            ON files (target, sync_generation) WHERE deleted_at IS NULL
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX idx_files_live_parent
+            ON files (target, parent_id) WHERE deleted_at IS NULL
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX idx_files_live_path
+            ON files (target, path, id) WHERE deleted_at IS NULL
+            """
+        )
+        # Search spans targets; target ends the keyset since an ID is only
+        # unique within one
+        conn.execute(
+            """
+            CREATE INDEX idx_files_live_mime_type
+            ON files (mime_type, modified_time, id, target) WHERE deleted_at IS NULL
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX idx_files_live_modified_time
+            ON files (modified_time, id, target) WHERE deleted_at IS NULL
+            """
+        )
+
+        self._add_missing_columns(conn, "file_changes", {"target": "TEXT NOT NULL DEFAULT ''"})
+        self._add_missing_columns(conn, "jobs", {"target": "TEXT NOT NULL DEFAULT ''"})
+        self._add_missing_columns(conn, "job_history", {"target": "TEXT NOT NULL DEFAULT ''"})
+        # Running jobs per target, counted by claim_job's concurrency limit
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_jobs_running_target
+            ON jobs (target) WHERE status = 'RUNNING'
+            """
+        )
+
+    # Version 3: job deduplication
+    # dedupe_key marks jobs that do the same work; at most one of them should be
+    # pending. Jobs already queued get the key create_job derives, so duplicates
+    # queued before the upgrade coalesce on the next claim
+    def _migrate_v3(self, conn):
+        self._add_missing_columns(conn, "jobs", {"dedupe_key": "TEXT", "coalesced_into": "INTEGER"})
+        conn.execute(
+            """
+            UPDATE jobs SET dedupe_key = type || '|' || target || '|' || COALESCE(payload, '')
+            WHERE status = 'PENDING' AND dedupe_key IS NULL
+            """
+        )
+        # Pending jobs by key, for create_job's lookup and claim_job's coalescing
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_jobs_pending_dedupe
+            ON jobs (dedupe_key) WHERE status = 'PENDING'
+            """
+        )
+
+    # Version 4: job priorities, delayed jobs and recurring schedules
+    # Jobs run highest priority first once run_after (UTC, datetime('now')
+    # format) has passed; jobs already queued are due when they were created
+    def _migrate_v4(self, conn):
+        self._add_missing_columns(conn, "jobs", {"priority": "INTEGER NOT NULL DEFAULT 0", "run_after": "TEXT"})
+        conn.execute("UPDATE jobs SET run_after = COALESCE(created_at, datetime('now')) WHERE run_after IS NULL")
+        # Due pending jobs: claims and pending listings seek by status and
+        # run_after and sort the (few) due jobs by priority
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_jobs_due
+            ON jobs (status, run_after, priority)
+            """
+        )
+        # It replaces the v1 queue index, whose created_at order no query uses
+        # any more; lease reclaims and compaction seek by its status prefix
+        conn.execute("DROP INDEX IF EXISTS idx_jobs_queue")
+
+        # Recurring jobs, queued by the runner when next_run_at passes
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schedules (
+                name TEXT PRIMARY KEY,
+                job_type TEXT NOT NULL,
+                target TEXT NOT NULL DEFAULT '',
+                payload TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                interval_seconds INTEGER NOT NULL,
+                next_run_at TEXT NOT NULL,
+                last_job_id INTEGER
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_schedules_next_run ON schedules (next_run_at)")
+
+    # Version 5: cumulative job run metrics
+    # One running total per job type, metric and label (stage, event or status),
+    # added to by record_job_run; unlike job_runs it is never purged, so the
+    # exported counters only go up. Starts from the runs recorded so far
+    def _migrate_v5(self, conn):
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job_metric_totals (
+                job_type TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                label TEXT NOT NULL DEFAULT '',
+                value REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (job_type, metric, label)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO job_metric_totals (job_type, metric, label, value)
+            SELECT job_type, 'job_runs', status, COUNT(*) FROM job_runs GROUP BY job_type, status
+            UNION ALL
+            SELECT job_type, 'job_duration_seconds', '', SUM(duration_seconds) FROM job_runs GROUP BY job_type
+            UNION ALL
+            SELECT r.job_type, 'stage_seconds', t.key, SUM(json_extract(t.value, '$.seconds'))
+            FROM job_runs r, json_each(r.metrics, '$.timers') t GROUP BY r.job_type, t.key
+            UNION ALL
+            SELECT r.job_type, 'stage_calls', t.key, SUM(json_extract(t.value, '$.calls'))
+            FROM job_runs r, json_each(r.metrics, '$.timers') t GROUP BY r.job_type, t.key
+            UNION ALL
+            SELECT r.job_type, 'events', c.key, SUM(c.value)
+            FROM job_runs r, json_each(r.metrics, '$.counters') c GROUP BY r.job_type, c.key
+            """
+        )
+
+    # Version 6: files seen by a full sync pass
+    # A pass records the IDs it lists here instead of restamping every unchanged
+    # row with its generation; the sweep spares the rows found here, then clears
+    # the pass's rows. Keyed by generation first, so one pass's rows are a range
+    def _migrate_v6(self, conn):
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files_seen (
+                generation INTEGER NOT NULL,
+                target TEXT NOT NULL,
+                id TEXT NOT NULL,
+                PRIMARY KEY (generation, target, id)
+            ) WITHOUT ROWID
+            """
+        )
+
+    # Triggers on files, dropped and recreated by every migration
+    # The change log triggers feed file_changes, so every write path is logged the
+    # same way. Updates are only logged when file content changed; setting
+    # deleted_at logs a delete and clearing it logs an insert. Generation stamps
+    # aren't logged. Rows are rarely removed outright, so deletes are dropped
+    # from the name index by a trigger as well
+    @staticmethod
+    def _create_triggers(conn):
+        triggers = ("files_log_insert", "files_log_update", "files_log_tombstone", "files_log_delete", "files_fts_delete")
+        for trigger in triggers:
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        conn.execute(
+            """
+            CREATE TRIGGER files_log_insert AFTER INSERT ON files
+            WHEN NEW.deleted_at IS NULL
+            BEGIN
+                INSERT INTO file_changes (target, file_id, op, name, mime_type, modified_time)
+                VALUES (NEW.target, NEW.id, 'insert', NEW.name, NEW.mime_type, NEW.modified_time);
+            END
+            """
+        )
+        conn.execute(
+            """
+            CREATE TRIGGER files_log_update AFTER UPDATE ON files
+            WHEN NEW.deleted_at IS NULL AND (
+                OLD.deleted_at IS NOT NULL
+                OR OLD.name IS NOT NEW.name
+                OR OLD.mime_type IS NOT NEW.mime_type
+                OR OLD.modified_time IS NOT NEW.modified_time
+                OR OLD.parent_id IS NOT NEW.parent_id
+                OR OLD.size IS NOT NEW.size
+            )
+            BEGIN
+                INSERT INTO file_changes (target, file_id, op, name, mime_type, modified_time)
+                VALUES (
+                    NEW.target,
+                    NEW.id,
+                    CASE WHEN OLD.deleted_at IS NOT NULL THEN 'insert' ELSE 'update' END,
+                    NEW.name,
+                    NEW.mime_type,
+                    NEW.modified_time
+                );
+            END
+            """
+        )
+        conn.execute(
+            """
+            CREATE TRIGGER files_log_tombstone AFTER UPDATE OF deleted_at ON files
+            WHEN OLD.deleted_at IS NULL AND NEW.deleted_at IS NOT NULL
+            BEGIN
+                INSERT INTO file_changes (target, file_id, op) VALUES (NEW.target, NEW.id, 'delete');
+            END
+            """
+        )
+        conn.execute(
+            """
+            CREATE TRIGGER files_log_delete AFTER DELETE ON files
+            WHEN OLD.deleted_at IS NULL
+            BEGIN
+                INSERT INTO file_changes (target, file_id, op) VALUES (OLD.target, OLD.id, 'delete');
+            END
+            """
+        )
+        conn.execute(
+            """
+            CREATE TRIGGER files_fts_delete AFTER DELETE ON files
+            BEGIN
+                DELETE FROM files_fts WHERE rowid = OLD.rowid;
+            END
+            """
+        )
+
+    # Full-text index on file names, keyed by files.rowid
+    # insert_update_files refreshes it in one statement per call: FTS5 flushes
+    # its pending terms at every statement, so per-row triggers would write
+    # a segment per row. Tombstoned rows stay indexed; search_files filters them
+    @staticmethod
+    def _create_search_index(conn):
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files_fts'"
+        ).fetchone()
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(name, prefix='2 3')")
+        # Databases created before the index existed get it built from their rows
+        if not exists:
+            conn.execute("INSERT INTO files_fts (rowid, name) SELECT rowid, name FROM files")
+
+    # Re-indexes the names of files inserted or updated after change log seq since
+    # Reading since outside the write transaction can only re-index extra rows
+    @staticmethod
+    def _index_names(conn, since: int):
+        changed = """
+            SELECT rowid FROM files WHERE (target, id) IN (
+                SELECT target, file_id FROM file_changes WHERE seq > ? AND op != 'delete'
+            )
+        """
+        conn.execute(f"DELETE FROM files_fts WHERE rowid IN ({changed})", (since,))
+        conn.execute(
+            f"INSERT INTO files_fts (rowid, name) SELECT rowid, name FROM files WHERE rowid IN ({changed})",
+            (since,),
+        )
+
+    # Rebuilds the name index from the files table
+    # Needed if files rowids change, e.g. after a full VACUUM
+    def rebuild_search_index(self):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM files_fts")
+            conn.execute("INSERT INTO files_fts (rowid, name) SELECT rowid, name FROM files")
+
+    # Adds any of the given columns that an existing table lacks
+    @staticmethod
+    def _add_missing_columns(conn, table: str, columns: Dict[str, str]):
+        existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for name, definition in columns.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+    # Insert or update file metadata in files table.
+    # Written rows are stamped with the current sync generation and revived if tombstoned
+    # Rows whose content is unchanged are skipped, so re-syncs don't rewrite pages;
+    # a full sync pass names its pass_generation instead, and every listed ID is
+    # recorded in files_seen for that pass's sweep (a narrow insert, not a row rewrite)
+    # Keeps the name search index and cached paths in step
+    # Returns the number of rows actually inserted or updated
+    def insert_update_files(
+        self,
+        files: Iterable[Dict],
+        target: str = DEFAULT_TARGET,
+        pass_generation: Optional[int] = None,
+    ) -> int:
+        if pass_generation is not None:
+            files = list(files)
+        with self._conn() as conn:
+            if pass_generation is not None:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO files_seen (generation, target, id) VALUES (?, ?, ?)",
+                    ((pass_generation, target, file["id"]) for file in files),
                 )
+            since = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM file_changes").fetchone()[0]
+            written = conn.executemany(
+                f"""
+                INSERT INTO files (target, id, name, mime_type, modified_time, parent_id, size, path, sync_generation)
+                VALUES (
+                    :target, :id, :name, :mimeType, :modifiedTime, :parent_id, :size,
+                    COALESCE(
+                        (SELECT path FROM files WHERE target = :target AND id = :parent_id), ''
+                    ) || '/' || :name,
+                    COALESCE(
+                        (SELECT CAST(value AS INTEGER) FROM sync_state WHERE key = '{GENERATION_KEY}'),
+                        0
+                    )
+                )
+                ON CONFLICT(target, id) DO UPDATE SET
+                    name=excluded.name,
+                    mime_type=excluded.mime_type,
+                    modified_time=excluded.modified_time,
+                    parent_id=excluded.parent_id,
+                    size=excluded.size,
+                    path=excluded.path,
+                    sync_generation=excluded.sync_generation,
+                    deleted_at=NULL
+                WHERE name IS NOT excluded.name
+                    OR mime_type IS NOT excluded.mime_type
+                    OR modified_time IS NOT excluded.modified_time
+                    OR parent_id IS NOT excluded.parent_id
+                    OR size IS NOT excluded.size
+                    OR deleted_at IS NOT NULL
+                """,
+                (self._file_row(file, target) for file in files),
+            ).rowcount
+            # Content changes were logged by the triggers, new names and moves are among them
+            if written:
+                self._index_names(conn, since)
+                self._update_paths(conn, since)
+            return written
+
+    # Drive file resource -> insert parameters
+    # Drive gives a file one parent (parents is a list for historical reasons)
+    # and size as a string, only for files with stored content
+    @staticmethod
+    def _file_row(file: Dict, target: str) -> Dict:
+        parents = file.get("parents")
+        size = file.get("size")
+        return {
+            "target": target,
+            "id": file["id"],
+            "name": file["name"],
+            "mimeType": file["mimeType"],
+            "modifiedTime": file["modifiedTime"],
+            "parent_id": parents[0] if parents else None,
+            "size": int(size) if size is not None else None,
+        }
+
+    # A path is the parent's path plus "/" and the name; files whose parent
+    # isn't mirrored (the drive's root, or a parent not synced yet) sit at the top
+    # Parents and children are always looked up within the file's own target
+    # The upsert computes each row's path from its parent as it stands; this
+    # repairs what that misses for files changed after change log seq since:
+    # rows whose parent came later in the batch, and the subtrees of folders
+    # that were renamed or moved (their children's paths no longer match)
+    # A subtree can be reached from several changed ancestors; the deepest
+    # walk, from the topmost one, wins (SQLite takes bare columns from the MAX() row)
+    @staticmethod
+    def _update_paths(conn, since: int):
+        conn.execute(
+            """
+            WITH RECURSIVE
+            changed(target, id, new_path) AS (
+                SELECT f.target, f.id, COALESCE(p.path, '') || '/' || f.name
+                FROM files f LEFT JOIN files p ON p.target = f.target AND p.id = f.parent_id
+                WHERE (f.target, f.id) IN (
+                    SELECT target, file_id FROM file_changes WHERE seq > ? AND op != 'delete'
+                )
+                AND (
+                    (COALESCE(p.path, '') || '/' || f.name) IS NOT f.path
+                    OR EXISTS (
+                        SELECT 1 FROM files c
+                        WHERE c.target = f.target AND c.parent_id = f.id AND c.deleted_at IS NULL
+                        AND c.path IS NOT f.path || '/' || c.name
+                    )
+                )
+            ),
+            tree(target, id, path, depth) AS (
+                SELECT target, id, new_path, 0 FROM changed
+                UNION ALL
+                SELECT c.target, c.id, tree.path || '/' || c.name, tree.depth + 1
+                FROM tree JOIN files c
+                ON c.target = tree.target AND c.parent_id = tree.id AND c.deleted_at IS NULL
+                WHERE tree.depth < 256
+            ),
+            resolved(target, id, path, depth) AS (
+                SELECT target, id, path, MAX(depth) FROM tree GROUP BY target, id
+            )
+            UPDATE files SET path = resolved.path
+            FROM resolved
+            WHERE files.target = resolved.target AND files.id = resolved.id
+            AND files.path IS NOT resolved.path
+            """,
+            (since,),
+        )
+
+    # Upserts a page of files and advances its checkpoint in a single transaction
+    # The checkpoint can never point past rows that were not committed with it
+    # pass_generation is that of the full sync pass the page belongs to, if any
+    # Returns the number of rows that changed
+    def write_page(
+        self,
+        files: Iterable[Dict],
+        checkpoint_key: str,
+        page_token: Optional[str],
+        target: str = DEFAULT_TARGET,
+        pass_generation: Optional[int] = None,
+    ) -> int:
+        changed = 0
+        with self._conn():
+            if files:
+                changed = self.insert_update_files(files, target, pass_generation)
+            self.set_checkpoint(checkpoint_key, page_token)
+        return changed
+
+    # Marks files as deleted by ID (tombstones them)
+    def delete_files(self, file_ids: Iterable[str], target: str = DEFAULT_TARGET):
+        with self._conn() as conn:
+            conn.executemany(
                 """
+                UPDATE files SET deleted_at = CURRENT_TIMESTAMP
+                WHERE target = ? AND id = ? AND deleted_at IS NULL
+                """,
+                ((target, file_id) for file_id in file_ids),
             )
 
-            # Stores checkpoints for sync state
-            conn.execute(
+    # Starts or resumes a full sync pass and returns its generation
+    # A new pass bumps the global generation; a resumed pass keeps the one
+    # recorded under pass_key, so rows stamped before a crash still count
+    # Generations are shared by all targets: rows are stamped with the latest
+    # one, which is never below the generation of a pass still running
+    # Returns None for a resumed pass that never recorded a generation (started
+    # by an older version): its earlier pages weren't tracked, so it must not sweep
+    # A new pass drops what an abandoned one under pass_key left in files_seen
+    def begin_generation(self, pass_key: str, resume: bool) -> Optional[int]:
+        with self._conn() as conn:
+            recorded = self.get_checkpoint(pass_key)
+            if resume:
+                return int(recorded) if recorded is not None else None
+            if recorded is not None:
+                conn.execute("DELETE FROM files_seen WHERE generation = ?", (int(recorded),))
+            generation = int(self.get_checkpoint(GENERATION_KEY) or 0) + 1
+            self.set_checkpoint(GENERATION_KEY, str(generation))
+            self.set_checkpoint(pass_key, str(generation))
+            return generation
+
+    # Tombstones a target's live rows the pass didn't see: stamped before
+    # generation (not written since it began) and missing from its files_seen
+    # The rows to sweep are found in one read on the live-generation index, then
+    # tombstoned and the pass's files_seen rows cleared in bounded batches, each
+    # its own short transaction
+    # Returns the number of rows marked deleted
+    def sweep_generation(self, generation: int, target: str = DEFAULT_TARGET, batch_size: int = 10000) -> int:
+        with self._conn() as conn:
+            cur = conn.execute(
                 """
-                CREATE TABLE IF NOT EXISTS sync_state (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
+                SELECT rowid FROM files
+                WHERE target = ? AND deleted_at IS NULL AND sync_generation < ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM files_seen
+                    WHERE generation = ? AND files_seen.target = files.target AND files_seen.id = files.id
                 )
-                """
+                """,
+                (target, generation, generation),
             )
+            cur.row_factory = None
+            rowids = [row[0] for row in cur]
 
-            # Stores jobs and tasks
-            conn.execute(
+        total = 0
+        for start in range(0, len(rowids), batch_size):
+            with self._conn() as conn:
+                total += conn.execute(
+                    """
+                    UPDATE files SET deleted_at = CURRENT_TIMESTAMP
+                    WHERE rowid IN (SELECT value FROM json_each(?))
+                    AND deleted_at IS NULL AND sync_generation < ?
+                    """,
+                    (json.dumps(rowids[start:start + batch_size]), generation),
+                ).rowcount
+
+        while True:
+            with self._conn() as conn:
+                cleared = conn.execute(
+                    """
+                    DELETE FROM files_seen
+                    WHERE generation = ? AND (target, id) IN (
+                        SELECT target, id FROM files_seen WHERE generation = ? AND target = ? LIMIT ?
+                    )
+                    """,
+                    (generation, generation, target, batch_size),
+                ).rowcount
+            if cleared < batch_size:
+                return total
+
+    # Upserts some files and removes others in a single transaction
+    # Returns the number of upserted rows that changed
+    def apply_file_updates(
+        self,
+        upserts: Iterable[Dict],
+        removed_ids: Iterable[str],
+        target: str = DEFAULT_TARGET,
+    ) -> int:
+        changed = 0
+        with self._conn():
+            if upserts:
+                changed = self.insert_update_files(upserts, target)
+            if removed_ids:
+                self.delete_files(removed_ids, target)
+        return changed
+
+    # Applies one page of the changes feed and advances its token in a single transaction
+    # Returns the number of upserted rows that changed
+    def apply_changes(
+        self,
+        upserts: Iterable[Dict],
+        removed_ids: Iterable[str],
+        checkpoint_key: str,
+        page_token: Optional[str],
+        target: str = DEFAULT_TARGET,
+    ) -> int:
+        with self._conn():
+            changed = self.apply_file_updates(upserts, removed_ids, target)
+            self.set_checkpoint(checkpoint_key, page_token)
+        return changed
+
+    # Searches live files, newest modification first
+    # name matches every word as a prefix ("quar rep" finds "Quarterly Report");
+    # mime_type is exact; modified_after is inclusive and modified_before exclusive
+    # Searches every target unless target is given
+    # Pages with a keyset cursor: pass the returned cursor to get the next page
+    # Returns (rows, next_cursor), next_cursor is None on the last page
+    def search_files(
+        self,
+        name: Optional[str] = None,
+        mime_type: Optional[str] = None,
+        modified_after: Optional[str] = None,
+        modified_before: Optional[str] = None,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        target: Optional[str] = None,
+    ) -> Tuple[List[sqlite3.Row], Optional[str]]:
+        clauses = ["deleted_at IS NULL"]
+        params = []
+        # With a name, the full-text matches drive the query: the matches are
+        # collected once as a rowid set and "+" keeps the planner off the filter
+        # indexes, which would re-check every indexed row against the set
+        column = "{}"
+        if name and name.split():
+            column = "+{}"
+            clauses.append("rowid IN (SELECT rowid FROM files_fts WHERE files_fts MATCH ?)")
+            params.append(self._name_query(name))
+        if mime_type:
+            clauses.append(f"{column.format('mime_type')} = ?")
+            params.append(mime_type)
+        if modified_after:
+            clauses.append(f"{column.format('modified_time')} >= ?")
+            params.append(modified_after)
+        if modified_before:
+            clauses.append(f"{column.format('modified_time')} < ?")
+            params.append(modified_before)
+        # Always a filter: the target-led indexes don't give the result order
+        if target is not None:
+            clauses.append("+target = ?")
+            params.append(target)
+        if cursor:
+            last_modified, _, rest = cursor.partition("|")
+            last_id, _, last_target = rest.partition("|")
+            clauses.append(f"({column.format('modified_time')}, id, target) < (?, ?, ?)")
+            params.extend([last_modified, last_id, last_target])
+
+        with self._conn() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT target, id, name, mime_type, modified_time
+                FROM files
+                WHERE {" AND ".join(clauses)}
+                ORDER BY modified_time DESC, id DESC, target DESC
+                LIMIT ?
+                """,
+                params + [limit + 1],
+            ).fetchall()
+
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, f"{rows[-1]['modified_time']}|{rows[-1]['id']}|{rows[-1]['target']}"
+
+    # Turns free text into an FTS5 query of quoted prefix terms, so user input
+    # can't inject FTS syntax
+    @staticmethod
+    def _name_query(text: str) -> str:
+        terms = text.split()
+        return " ".join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+    # Returns a live file's LOOKUP_COLUMNS, or None if it isn't mirrored (or was deleted)
+    def get_file(self, file_id: str, target: str = DEFAULT_TARGET):
+        with self._conn() as conn:
+            return conn.execute(
+                f"SELECT {', '.join(LOOKUP_COLUMNS)} FROM files WHERE target = ? AND id = ? AND deleted_at IS NULL",
+                (target, file_id),
+            ).fetchone()
+
+    # Returns {id: row} of the live files among file_ids, in one primary key
+    # lookup per ID; IDs go in as one JSON array, so any number fits one query
+    def get_files(self, file_ids: Iterable[str], target: str = DEFAULT_TARGET) -> Dict[str, sqlite3.Row]:
+        with self._conn() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT {', '.join(LOOKUP_COLUMNS)} FROM files
+                WHERE target = ? AND id IN (SELECT value FROM json_each(?)) AND deleted_at IS NULL
+                """,
+                (target, json.dumps(list(file_ids))),
+            )
+            return {row["id"]: row for row in rows}
+
+    # Returns the ID of the live file at a path such as "/Projects/2024/plan.pdf"
+    # Drive allows duplicate names in a folder; the most recently modified wins
+    # Each target has its own tree, rooted at "/"
+    def resolve_path(self, path: str, target: str = DEFAULT_TARGET) -> Optional[str]:
+        path = "/" + path.strip("/")
+        with self._conn() as conn:
+            row = conn.execute(
                 """
-                CREATE TABLE IF NOT EXISTS jobs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    type TEXT NOT NULL,
-                    status TEXT NOT NULL,
-                    attempts INTEGER NOT NULL DEFAULT 0,
-                    max_attempts INTEGER NOT NULL,
-                    last_error TEXT,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
+                SELECT id FROM files
+                WHERE target = ? AND path = ? AND deleted_at IS NULL
+                ORDER BY modified_time DESC, id
+                LIMIT 1
+                """,
+                (target, path),
+            ).fetchone()
+        return row["id"] if row else None
+
+    # Path range holding everything below a folder: "/a/b/" up to "/a/b0"
+    # ("0" sorts right after "/"), so a subtree is one index range scan
+    def _subtree_range(self, conn, folder_id: str, target: str) -> Optional[Tuple[str, str]]:
+        row = conn.execute(
+            "SELECT path FROM files WHERE target = ? AND id = ? AND deleted_at IS NULL",
+            (target, folder_id),
+        ).fetchone()
+        if row is None or row["path"] is None:
+            return None
+        return row["path"] + "/", row["path"] + "0"
+
+    # Lists live files below a folder at any depth, ordered by path
+    # Pages with a keyset cursor like search_files; returns (rows, next_cursor)
+    def list_subtree(
+        self,
+        folder_id: str,
+        limit: int = 1000,
+        cursor: Optional[str] = None,
+        target: str = DEFAULT_TARGET,
+    ) -> Tuple[List[sqlite3.Row], Optional[str]]:
+        with self._conn() as conn:
+            bounds = self._subtree_range(conn, folder_id, target)
+            if bounds is None:
+                return [], None
+            clauses = ["target = ?", "path >= ?", "path < ?", "deleted_at IS NULL"]
+            params = [target, *bounds]
+            if cursor:
+                last_path, _, last_id = cursor.rpartition("|")
+                clauses.append("(path, id) > (?, ?)")
+                params.extend([last_path, last_id])
+            rows = conn.execute(
+                f"""
+                SELECT id, name, mime_type, modified_time, parent_id, size, path
+                FROM files
+                WHERE {" AND ".join(clauses)}
+                ORDER BY path, id
+                LIMIT ?
+                """,
+                params + [limit + 1],
+            ).fetchall()
+
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, f"{rows[-1]['path']}|{rows[-1]['id']}"
+
+    # Totals for everything below a folder: {"files": count, "folders": count, "bytes": sum}
+    # Google Docs and other files without stored content count as 0 bytes
+    def folder_size(self, folder_id: str, target: str = DEFAULT_TARGET) -> Dict[str, int]:
+        with self._conn() as conn:
+            bounds = self._subtree_range(conn, folder_id, target)
+            if bounds is None:
+                return {"files": 0, "folders": 0, "bytes": 0}
+            row = conn.execute(
+                f"""
+                SELECT
+                    COUNT(*) FILTER (WHERE mime_type != '{FOLDER_MIME_TYPE}') AS files,
+                    COUNT(*) FILTER (WHERE mime_type = '{FOLDER_MIME_TYPE}') AS folders,
+                    COALESCE(SUM(size), 0) AS bytes
+                FROM files
+                WHERE target = ? AND path >= ? AND path < ? AND deleted_at IS NULL
+                """,
+                (target, *bounds),
+            ).fetchone()
+        return {"files": row["files"], "folders": row["folders"], "bytes": row["bytes"]}
+
+    # Streams live files in keyset-paginated batches of batch_size rows, so memory
+    # stays flat however large the table is and no read outlives its batch
+    # order_by "id" walks (target, id) on the primary key; "modified_time" walks
+    # (modified_time, id, target), oldest first, on the live modified-time index
+    # modified_since (inclusive) and target filter the rows; cursor resumes after
+    # the row it was taken from (see file_cursor)
+    def iter_files(
+        self,
+        order_by: str = "id",
+        batch_size: int = 1000,
+        modified_since: Optional[str] = None,
+        target: Optional[str] = None,
+        cursor: Optional[str] = None,
+    ) -> Iterator[sqlite3.Row]:
+        if order_by not in ITER_ORDERS:
+            raise ValueError(f"Error: Unknown file order {order_by}")
+        keys = ITER_ORDERS[order_by]
+        last = self._parse_file_cursor(cursor, order_by) if cursor else None
+
+        filters = ["deleted_at IS NULL"]
+        params = []
+        if modified_since:
+            filters.append("modified_time >= ?")
+            params.append(modified_since)
+        if target is not None:
+            filters.append("target = ?")
+            params.append(target)
+
+        while True:
+            clauses = list(filters)
+            if last is not None:
+                clauses.append(f"({', '.join(keys)}) > ({', '.join('?' for _ in keys)})")
+            with self._conn() as conn:
+                rows = conn.execute(
+                    f"""
+                    SELECT target, id, name, mime_type, modified_time, parent_id, size, path
+                    FROM files
+                    WHERE {" AND ".join(clauses)}
+                    ORDER BY {", ".join(keys)}
+                    LIMIT ?
+                    """,
+                    params + (list(last) if last is not None else []) + [batch_size],
+                ).fetchall()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last = [rows[-1][key] for key in keys]
+
+    # Cursor for resuming iter_files after row: "target|id" in id order,
+    # "modified_time|id|target" (as search_files) in modified_time order
+    @staticmethod
+    def file_cursor(row, order_by: str = "id") -> str:
+        return "|".join(str(row[key]) for key in ITER_ORDERS[order_by])
+
+    # Inverse of file_cursor; IDs never contain "|", a target might
+    @staticmethod
+    def _parse_file_cursor(cursor: str, order_by: str) -> Tuple[str, ...]:
+        if order_by == "id":
+            target, _, file_id = cursor.rpartition("|")
+            return target, file_id
+        modified_time, _, rest = cursor.partition("|")
+        file_id, _, target = rest.partition("|")
+        return modified_time, file_id, target
+
+    # Reads the mirror as of one moment, for snapshots
+    # Yields (state, rows): every sync_state entry as a dict, and a cursor over
+    # every files row (tombstones included) as SNAPSHOT_COLUMNS tuples
+    # Both come from one read transaction, so rows and checkpoints always match;
+    # consume rows inside the block. Writers are not blocked in WAL mode
+    @contextmanager
+    def snapshot(self):
+        with self._conn() as conn:
+            conn.execute("BEGIN")
+            try:
+                state = {row["key"]: row["value"] for row in conn.execute("SELECT key, value FROM sync_state")}
+                rows = conn.execute(f"SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM files")
+                rows.row_factory = None
+                yield state, rows
+            finally:
+                conn.rollback()
+
+    # Bulk loads files rows into an empty mirror and sets state (sync_state
+    # entries) in the same transaction; columns names the fields of each row
+    # Indexes and triggers on files are dropped for the load and recreated from
+    # their stored SQL afterwards, and the name index is built in one pass: much
+    # faster than maintaining them row by row. Nothing is logged to file_changes
+    # Nothing is kept if rows raises part way. Returns the number of rows loaded
+    def load_files(self, columns: Iterable[str], rows: Iterable, state: Dict[str, Optional[str]]) -> int:
+        columns = list(columns)
+        unknown = set(columns) - set(SNAPSHOT_COLUMNS)
+        if unknown:
+            raise ValueError(f"Error: Unknown file columns {sorted(unknown)}")
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM files LIMIT 1").fetchone():
+                raise ValueError("Error: Can only load files into an empty mirror")
+
+            deferred = conn.execute(
                 """
-            )
+                SELECT type, name, sql FROM sqlite_master
+                WHERE tbl_name = 'files' AND type IN ('index', 'trigger') AND sql IS NOT NULL
+                """
+            ).fetchall()
+            for entry in deferred:
+                conn.execute(f"DROP {entry['type'].upper()} {entry['name']}")
 
-    # Insert or update file metadata in files table.
-    def insert_update_files(self, files: Iterable[Dict]):
+            loaded = conn.executemany(
+                f"INSERT INTO files ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                rows,
+            ).rowcount
+
+            for entry in deferred:
+                conn.execute(entry["sql"])
+            conn.execute("DELETE FROM files_fts")
+            conn.execute("INSERT INTO files_fts (rowid, name) SELECT rowid, name FROM files")
+            for key, value in state.items():
+                self.set_checkpoint(key, value)
+            return loaded
+
+    # Returns logged file changes with seq greater than since, oldest first
+    # Pass the last seq seen as since to read the next batch
+    def get_changes(self, since: int = 0, limit: int = 1000):
         with self._conn() as conn:
-            conn.executemany(
+            return conn.execute(
                 """
-                INSERT INTO files (id, name, mime_type, modified_time)
-                VALUES (:id, :name, :mimeType, :modifiedTime)
-                ON CONFLICT(id) DO UPDATE SET
-                    name=excluded.name,
-                    mime_type=excluded.mime_type,
-                    modified_time=excluded.modified_time
+                SELECT seq, target, file_id, op, name, mime_type, modified_time, changed_at
+                FROM file_changes
+                WHERE seq > ?
+                ORDER BY seq
+                LIMIT ?
                 """,
-                files,
-            )
+                (since, limit),
+            ).fetchall()
+
+    # Returns the seq of the newest file change log entry, 0 if there is none
+    def get_change_seq(self) -> int:
+        with self._conn() as conn:
+            return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM file_changes").fetchone()[0]
+
+    # Yields (target, id) of every live file, for building in-memory indexes
+    # Reads keyset batches on the primary key and yields outside the connection
+    # block, like iter_files, so writes made by the caller meanwhile commit as usual
+    def iter_file_keys(self, batch_size: int = 10000) -> Iterator[Tuple[str, str]]:
+        last = ("", "")
+        while True:
+            with self._conn() as conn:
+                cur = conn.execute(
+                    """
+                    SELECT target, id FROM files
+                    WHERE (target, id) > (?, ?) AND deleted_at IS NULL
+                    ORDER BY target, id
+                    LIMIT ?
+                    """,
+                    (*last, batch_size),
+                )
+                cur.row_factory = None
+                keys = cur.fetchall()
+            yield from keys
+            if len(keys) < batch_size:
+                return
+            last = keys[-1]
 
-    # Returns file counts in database
-    def get_file_count(self) -> int:
+    # Returns live (not deleted) file counts in database, or in one target
+    def get_file_count(self, target: Optional[str] = None) -> int:
         with self._conn() as conn:
-            cur = conn.execute("SELECT COUNT(*) FROM files")
+            if target is not None:
+                cur = conn.execute(
+                    "SELECT COUNT(*) FROM files WHERE target = ? AND deleted_at IS NULL", (target,)
+                )
+            else:
+                cur = conn.execute("SELECT COUNT(*) FROM files WHERE deleted_at IS NULL")
             return cur.fetchone()[0]
         
     # Returns value of checkpoint when given the key
@@ -116,28 +1283,73 @@ class SQLiteStore:
     
     # Creates new job entry on jobs table
     # Automatically sets status as pending
+    # payload holds job parameters and is stored as JSON
+    # target names the drive or account the job syncs
+    # Higher priority jobs are claimed first; delay_seconds holds the job back
+    # With a dedupe_key, a pending job with the same key is returned instead of
+    # queueing another (raised to this job's priority and run_after if sooner);
+    # job_dedupe_key derives one from the job's parameters
     # Returns job's ID
-    def create_job(self, job_type: str, max_attempts: int = 3) -> int:
+    def create_job(
+        self,
+        job_type: str,
+        max_attempts: int = 3,
+        payload: Optional[Dict] = None,
+        target: str = DEFAULT_TARGET,
+        dedupe_key: Optional[str] = None,
+        priority: int = 0,
+        delay_seconds: float = 0,
+    ) -> int:
+        run_after = f"+{int(delay_seconds)} seconds"
         with self._conn() as conn:
+            # One statement, so the check and the insert happen under the write lock
             cur = conn.execute(
                 """
-                INSERT INTO jobs (type, status, max_attempts)
-                VALUES (?, 'PENDING', ?)
+                INSERT INTO jobs (type, status, max_attempts, payload, target, dedupe_key, priority, run_after)
+                SELECT ?, 'PENDING', ?, ?, ?, ?5, ?, datetime('now', ?)
+                WHERE ?5 IS NULL OR NOT EXISTS (
+                    SELECT 1 FROM jobs WHERE status = 'PENDING' AND dedupe_key = ?5
+                )
                 """,
-                (job_type, max_attempts),
+                (job_type, max_attempts, self._encode_payload(payload), target, dedupe_key, priority, run_after),
             )
-            return cur.lastrowid
-        
-    # Retrieves pending jobs up to the defined limit
-    # Jobs ordered from oldest to latest
+            if cur.rowcount:
+                return cur.lastrowid
+            return conn.execute(
+                """
+                UPDATE jobs
+                SET priority = MAX(priority, ?),
+                    run_after = MIN(run_after, datetime('now', ?))
+                WHERE id = (
+                    SELECT id FROM jobs WHERE status = 'PENDING' AND dedupe_key = ? ORDER BY id LIMIT 1
+                )
+                RETURNING id
+                """,
+                (priority, run_after, dedupe_key),
+            ).fetchall()[0]["id"]
+
+    # Stored form of a job payload; keys are sorted so equal payloads store equal text
+    @staticmethod
+    def _encode_payload(payload: Optional[Dict]) -> Optional[str]:
+        return json.dumps(payload, sort_keys=True) if payload is not None else None
+
+    # Dedupe key of a job that is redundant with any pending job of the same
+    # type, target and payload
+    @staticmethod
+    def job_dedupe_key(job_type: str, payload: Optional[Dict] = None, target: str = DEFAULT_TARGET) -> str:
+        return f"{job_type}|{target}|{SQLiteStore._encode_payload(payload) or ''}"
+
+    # Retrieves due pending jobs up to the defined limit, in claim order:
+    # highest priority first, then oldest run_after
+    # Jobs delayed into the future (retry backoff) aren't due yet
     def fetch_pending_jobs(self, limit: int = 10):
         with self._conn() as conn:
             return conn.execute(
                 """
                 SELECT *
                 FROM jobs
-                WHERE status = 'PENDING' AND attempts < max_attempts
-                ORDER BY created_at
+                WHERE status = 'PENDING' AND run_after <= datetime('now') AND attempts < max_attempts
+                ORDER BY priority DESC, run_after, id
                 LIMIT ?
                 """,
                 (limit,),
@@ -164,3 +1376,322 @@ class SQLiteStore:
                 """,
                 (status, attempts, last_error, job_id),
             )
+
+    # Returns a job's decoded payload, or an empty dict if it has none
+    @staticmethod
+    def job_payload(job) -> Dict:
+        return json.loads(job["payload"]) if job["payload"] else {}
+
+    # Retrieves job by ID
+    def get_job(self, job_id: int):
+        with self._conn() as conn:
+            return conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    # Atomically claims the next due pending job for owner and leases it
+    # (highest priority first, then oldest run_after)
+    # Marks it RUNNING and counts the attempt in the same statement
+    # With target_limit, jobs whose target already has that many jobs running
+    # under a live lease are passed over, across every runner sharing the queue
+    # Other pending jobs with the claimed job's dedupe_key were all queued before
+    # this run starts, so they are settled as COALESCED (coalesced_into names
+    # the claimed job) in the same transaction
+    # Returns the claimed job, or None if nothing is pending (or claimable)
+    def claim_job(self, owner: str, lease_seconds: float, target_limit: Optional[int] = None):
+        limit_clause = ""
+        params = [owner, f"+{int(lease_seconds)} seconds"]
+        if target_limit is not None:
+            limit_clause = """
+                    AND (
+                        SELECT COUNT(*) FROM jobs running
+                        WHERE running.status = 'RUNNING' AND running.target = jobs.target
+                        AND running.lease_expires_at > datetime('now')
+                    ) < ?
+            """
+            params.append(target_limit)
+        with self._conn() as conn:
+            job = conn.execute(
+                f"""
+                UPDATE jobs
+                SET status = 'RUNNING',
+                    attempts = attempts + 1,
+                    lease_owner = ?,
+                    lease_expires_at = datetime('now', ?),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id
+                    FROM jobs
+                    WHERE status = 'PENDING' AND run_after <= datetime('now') AND attempts < max_attempts
+                    {limit_clause}
+                    ORDER BY priority DESC, run_after, id
+                    LIMIT 1
+                )
+                RETURNING *
+                """,
+                params,
+            ).fetchall()
+            if not job:
+                return None
+            job = job[0]
+            if job["dedupe_key"] is not None:
+                conn.execute(
+                    """
+                    UPDATE jobs
+                    SET status = 'COALESCED',
+                        coalesced_into = ?,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE status = 'PENDING' AND dedupe_key = ? AND id != ?
+                    """,
+                    (job["id"], job["dedupe_key"], job["id"]),
+                )
+            return job
+
+    # Extends the lease on a running job
+    # Returns False if owner no longer holds the job
+    def renew_lease(self, job_id: int, owner: str, lease_seconds: float) -> bool:
+        with self._conn() as conn:
+            return conn.execute(
+                """
+                UPDATE jobs
+                SET lease_expires_at = datetime('now', ?)
+                WHERE id = ? AND lease_owner = ? AND status = 'RUNNING'
+                """,
+                (f"+{int(lease_seconds)} seconds", job_id, owner),
+            ).rowcount == 1
+
+    # Records the outcome of a job and releases its lease
+    # retry_after_seconds puts the job back in the queue as PENDING, due after
+    # that delay, instead of setting status
+    # Returns False (and changes nothing) if owner no longer holds the job
+    def finish_job(
+        self,
+        job_id: int,
+        owner: str,
+        status: str,
+        last_error: Optional[str] = None,
+        retry_after_seconds: Optional[float] = None,
+    ) -> bool:
+        run_after = None
+        if retry_after_seconds is not None:
+            # run_after has whole seconds: rounding up keeps a short delay from becoming none
+            status, run_after = "PENDING", f"+{math.ceil(retry_after_seconds)} seconds"
+        with self._conn() as conn:
+            return conn.execute(
+                """
+                UPDATE jobs
+                SET status = ?,
+                    last_error = ?,
+                    lease_owner = NULL,
+                    lease_expires_at = NULL,
+                    run_after = COALESCE(datetime('now', ?), run_after),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND lease_owner = ? AND status = 'RUNNING'
+                """,
+                (status, last_error, run_after, job_id, owner),
+            ).rowcount == 1
+
+    # Returns RUNNING jobs whose lease expired (or that never had one) to the queue
+    # Jobs out of attempts are marked DEAD instead
+    # Jobs with a live lease belong to another runner and are left alone
+    def reclaim_expired_jobs(self) -> int:
+        with self._conn() as conn:
+            return conn.execute(
+                """
+                UPDATE jobs
+                SET status = CASE WHEN attempts < max_attempts THEN 'PENDING' ELSE 'DEAD' END,
+                    last_error = 'Lease expired',
+                    lease_owner = NULL,
+                    lease_expires_at = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'RUNNING'
+                AND (lease_expires_at IS NULL OR lease_expires_at <= datetime('now'))
+                """
+            ).rowcount
+
+    # Creates or replaces the recurring schedule name: a job_type job for
+    # target every interval_seconds, first due at first_run_at (UTC,
+    # "YYYY-MM-DD HH:MM:SS") or right away
+    def set_schedule(
+        self,
+        name: str,
+        job_type: str,
+        interval_seconds: int,
+        payload: Optional[Dict] = None,
+        target: str = DEFAULT_TARGET,
+        priority: int = 0,
+        first_run_at: Optional[str] = None,
+    ):
+        if interval_seconds < 1:
+            raise ValueError("Error: Schedule interval must be at least one second")
+        with self._conn() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO schedules (name, job_type, target, payload, priority, interval_seconds, next_run_at)
+                VALUES (?, ?, ?, ?, ?, ?, COALESCE(datetime(?), datetime('now')))
+                """,
+                (name, job_type, target, self._encode_payload(payload), priority, int(interval_seconds), first_run_at),
+            )
+
+    # Removes a schedule; its queued jobs stay queued
+    # Returns False if there was no such schedule
+    def delete_schedule(self, name: str) -> bool:
+        with self._conn() as conn:
+            return conn.execute("DELETE FROM schedules WHERE name = ?", (name,)).rowcount == 1
+
+    # Returns every schedule, soonest first
+    def get_schedules(self):
+        with self._conn() as conn:
+            return conn.execute("SELECT * FROM schedules ORDER BY next_run_at, name").fetchall()
+
+    # Queues a job for every schedule whose next_run_at has passed and moves
+    # next_run_at to its first slot after now, so missed runs (runner down)
+    # collapse into one job. Jobs are deduplicated like cli initiate's, so a run
+    # still pending from the last slot (or an identical manual job) is reused,
+    # and runners sharing the queue can all call this
+    # Returns the IDs of the jobs queued (or reused)
+    def enqueue_due_schedules(self) -> List[int]:
+        with self._conn() as conn:
+            # Checked with a read first: this runs on every runner poll
+            if not conn.execute("SELECT 1 FROM schedules WHERE next_run_at <= datetime('now') LIMIT 1").fetchone():
+                return []
+            due = conn.execute(
+                """
+                UPDATE schedules
+                SET next_run_at = datetime(
+                    next_run_at,
+                    '+' || (((strftime('%s', 'now') - strftime('%s', next_run_at)) / interval_seconds + 1)
+                        * interval_seconds) || ' seconds'
+                )
+                WHERE next_run_at <= datetime('now')
+                RETURNING name, job_type, target, payload, priority
+                """
+            ).fetchall()
+            job_ids = []
+            for schedule in due:
+                payload = json.loads(schedule["payload"]) if schedule["payload"] else None
+                job_id = self.create_job(
+                    schedule["job_type"],
+                    payload=payload,
+                    target=schedule["target"],
+                    dedupe_key=self.job_dedupe_key(schedule["job_type"], payload, schedule["target"]),
+                    priority=schedule["priority"],
+                )
+                conn.execute("UPDATE schedules SET last_job_id = ? WHERE name = ?", (job_id, schedule["name"]))
+                job_ids.append(job_id)
+            return job_ids
+
+    # Records one finished job execution and its metrics snapshot
+    def record_job_run(
+        self,
+        job_id: int,
+        job_type: str,
+        owner: Optional[str],
+        status: str,
+        duration_seconds: float,
+        metrics: Optional[Dict] = None,
+    ) -> int:
+        metrics = metrics or {}
+        totals = [("job_runs", status, 1), ("job_duration_seconds", "", duration_seconds)]
+        for stage, timer in metrics.get("timers", {}).items():
+            totals += [("stage_seconds", stage, timer["seconds"]), ("stage_calls", stage, timer["calls"])]
+        totals += [("events", name, value) for name, value in metrics.get("counters", {}).items()]
+        with self._conn() as conn:
+            cur = conn.execute(
+                """
+                INSERT INTO job_runs (job_id, job_type, owner, status, duration_seconds, metrics)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (job_id, job_type, owner, status, duration_seconds, json.dumps(metrics)),
+            )
+            # The run is added to the running totals in the same transaction
+            conn.executemany(
+                """
+                INSERT INTO job_metric_totals (job_type, metric, label, value)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (job_type, metric, label) DO UPDATE SET value = value + excluded.value
+                """,
+                ((job_type, metric, label, value) for metric, label, value in totals),
+            )
+            return cur.lastrowid
+
+    # Returns the cumulative job run metrics (job_type, metric, label, value)
+    def get_metric_totals(self):
+        with self._conn() as conn:
+            return conn.execute(
+                "SELECT job_type, metric, label, value FROM job_metric_totals ORDER BY metric, job_type, label"
+            ).fetchall()
+
+    # Returns recent job runs, newest first; metrics is a JSON string
+    def get_job_runs(self, limit: int = 25, job_id: Optional[int] = None):
+        with self._conn() as conn:
+            if job_id is not None:
+                return conn.execute(
+                    "SELECT * FROM job_runs WHERE job_id = ? ORDER BY id DESC LIMIT ?",
+                    (job_id, limit),
+                ).fetchall()
+            return conn.execute(
+                "SELECT * FROM job_runs ORDER BY id DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+    # Retention for finished (DONE, DEAD and COALESCED) jobs
+    # Moves them into job_history once they are older than keep_days or beyond the
+    # keep_rows most recent; history and job run metrics older than history_days
+    # are deleted (None keeps them). Then returns up to vacuum_pages freed pages
+    # to the OS when the database uses incremental vacuum
+    # Returns {"archived", "purged", "vacuumed_pages"}
+    def compact_jobs(
+        self,
+        keep_days: float = 7,
+        keep_rows: int = 1000,
+        history_days: Optional[float] = 90,
+        vacuum_pages: int = 1000,
+    ) -> Dict[str, int]:
+        finished = f"""
+            SELECT id FROM jobs
+            WHERE status IN ('DONE', 'DEAD', 'COALESCED')
+            AND (
+                updated_at < datetime('now', '-{float(keep_days)} days')
+                OR id NOT IN (
+                    SELECT id FROM jobs WHERE status IN ('DONE', 'DEAD', 'COALESCED')
+                    ORDER BY updated_at DESC, id DESC LIMIT {int(keep_rows)}
+                )
+            )
+        """
+        with self._conn() as conn:
+            archived = conn.execute(
+                f"""
+                INSERT OR REPLACE INTO job_history (id, type, target, status, attempts, last_error, created_at, finished_at)
+                SELECT id, type, target, status, attempts, last_error, created_at, updated_at
+                FROM jobs WHERE id IN ({finished})
+                """
+            ).rowcount
+            conn.execute(f"DELETE FROM jobs WHERE id IN ({finished})")
+
+            purged = 0
+            if history_days is not None:
+                cutoff = f"datetime('now', '-{float(history_days)} days')"
+                purged = conn.execute(f"DELETE FROM job_history WHERE finished_at < {cutoff}").rowcount
+                conn.execute(f"DELETE FROM job_runs WHERE finished_at < {cutoff}")
+
+        return {"archived": archived, "purged": purged, "vacuumed_pages": self.incremental_vacuum(vacuum_pages)}
+
+    # Returns up to pages free pages to the OS; a no-op unless auto_vacuum is INCREMENTAL
+    # Returns the number of pages freed
+    # Skipped inside a transaction, which executescript would commit
+    def incremental_vacuum(self, pages: int = 1000) -> int:
+        conn = self._connection()
+        if self._local.depth or conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        # executescript steps the pragma to completion; execute() frees one page
+        conn.executescript(f"PRAGMA incremental_vacuum({max(1, int(pages))})")
+        return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    # Switches an existing database to incremental vacuum with a full VACUUM
+    # Takes an exclusive lock and rewrites the whole file; VACUUM renumbers
+    # files rowids, so the name index is rebuilt afterwards
+    def enable_incremental_vacuum(self):
+        conn = self._connection()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        self.rebuild_search_index()
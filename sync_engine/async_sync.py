@@ -0,0 +1,172 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Optional
+from persistence.store import DEFAULT_TARGET, SQLiteStore
+from sync_engine.metadata_sync import CHECKPOINT_TOKEN, live_files, scoped_key
+from sync_engine.sharded_sync import SHARD_DONE, Shard, ShardedSyncEngine
+
+logger = logging.getLogger(__name__)
+
+class AsyncStoreWriter:
+    # Runs store calls on one dedicated thread so SQLite never blocks the event loop
+    # A single thread also serializes writes, avoiding lock contention between tasks
+
+    def __init__(self, store: SQLiteStore):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+
+    # Runs store.<method>(*args) on the writer thread and awaits the result
+    async def call(self, method: str, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(getattr(self.store, method), *args))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+class AsyncMetadataSyncEngine:
+    # asyncio variant of MetadataSyncEngine for an AsyncGDriveClient
+    # Listings, shards and ID batches run as tasks on one event loop; the client
+    # bounds in-flight requests and all SQLite work goes through one writer thread
+    # Uses the same checkpoint keys as the threaded engines, so either can resume the other
+
+    def __init__(
+        self,
+        client,
+        store: SQLiteStore,
+        page_size: int = 100,
+        writer: Optional[AsyncStoreWriter] = None,
+        target: str = DEFAULT_TARGET,
+        drive_id: Optional[str] = None,
+    ):
+        self.client = client
+        self.store = store
+        self.page_size = page_size
+        self.writer = writer or AsyncStoreWriter(store)
+        # Sync target and shared drive, as for MetadataSyncEngine
+        self.target = target
+        self.drive_id = drive_id
+
+    # Resumable listing of one page-token chain
+    # The next page is fetched while the current one is written
+    # checkpoint_key defaults to the target's CHECKPOINT_TOKEN
+    # pass_generation is that of the sharded pass a shard's listing belongs to
+    async def sync(
+        self,
+        checkpoint_key: Optional[str] = None,
+        query: Optional[str] = None,
+        pass_generation: Optional[int] = None,
+    ) -> None:
+        checkpoint_key = checkpoint_key or scoped_key(CHECKPOINT_TOKEN, self.target)
+        page_token = await self.writer.call("get_checkpoint", checkpoint_key)
+        if page_token:
+            logger.info("Resuming async sync %s from last checkpoint token!", checkpoint_key)
+
+        # A full listing (no query) records and sweeps its generation under the
+        # same key as MetadataSyncEngine.sync, so a pass resumed by either engine keeps it
+        generation = None
+        generation_key = f"{checkpoint_key}:generation"
+        if not query:
+            generation = await self.writer.call("begin_generation", generation_key, bool(page_token))
+            if generation is None:
+                logger.warning("Resumed listing has no recorded generation, skipping the sweep")
+        seen_generation = generation if generation is not None else pass_generation
+
+        pages_processed = 0
+        files_processed = 0
+        fetch = asyncio.ensure_future(self._list_page(page_token, query))
+        try:
+            while True:
+                files, next_page_token = await fetch
+                if next_page_token:
+                    fetch = asyncio.ensure_future(self._list_page(next_page_token, query))
+
+                # Checkpoint moves with the page's rows, in one transaction
+                await self.writer.call(
+                    "write_page", files, checkpoint_key, next_page_token, self.target, seen_generation
+                )
+                pages_processed += 1
+                files_processed += len(files)
+
+                if not next_page_token:
+                    break
+        finally:
+            # Drops the prefetched page if the write failed
+            if not fetch.done():
+                fetch.cancel()
+
+        deleted = 0
+        if generation is not None:
+            deleted = await self.writer.call("sweep_generation", generation, self.target)
+            await self.writer.call("clear_checkpoint", generation_key)
+
+        logger.info(
+            "Async sync %s complete (pages=%d, files=%d, deleted=%d)",
+            checkpoint_key,
+            pages_processed,
+            files_processed,
+            deleted,
+        )
+
+    async def _list_page(self, page_token: Optional[str], query: Optional[str]):
+        return live_files(await self.client.list_files(
+            page_size=self.page_size, page_token=page_token, query=query, drive_id=self.drive_id
+        ))
+
+    # Syncs shards concurrently, at most max_shards at a time
+    # Shard checkpoints, done markers and the pass generation match ShardedSyncEngine
+    async def sync_shards(self, shards: List[Shard], max_shards: int = 16) -> None:
+        limit = asyncio.Semaphore(max_shards)
+
+        # The pass is resumed if any shard finished or checkpointed before
+        keys = [
+            key
+            for shard in shards
+            for key in (ShardedSyncEngine.done_key(shard, self.target), ShardedSyncEngine.shard_key(shard, self.target))
+        ]
+        resume = any([await self.writer.call("get_checkpoint", key) for key in keys])
+        generation_key = ShardedSyncEngine.generation_key(self.target)
+        generation = await self.writer.call("begin_generation", generation_key, resume)
+
+        async def run(shard: Shard):
+            done_key = ShardedSyncEngine.done_key(shard, self.target)
+            if await self.writer.call("get_checkpoint", done_key) == SHARD_DONE:
+                return
+            async with limit:
+                await self.sync(ShardedSyncEngine.shard_key(shard, self.target), shard.query, generation)
+            await self.writer.call("set_checkpoint", done_key, SHARD_DONE)
+
+        results = await asyncio.gather(*(run(shard) for shard in shards), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise errors[0]
+
+        # Every shard finished: rows no shard saw are gone from Drive
+        deleted = 0
+        if generation is not None:
+            deleted = await self.writer.call("sweep_generation", generation, self.target)
+        else:
+            logger.warning("Resumed sharded pass has no recorded generation, skipping the sweep")
+
+        # The next sync starts a fresh pass
+        for shard in shards:
+            await self.writer.call("clear_checkpoint", ShardedSyncEngine.done_key(shard, self.target))
+        await self.writer.call("clear_checkpoint", generation_key)
+        logger.info("Async sharded sync complete (shards=%d, deleted=%d)", len(shards), deleted)
+
+    # Refreshes files by ID, with chunks fetched concurrently
+    # Found files are upserted; trashed or not-found files are removed
+    async def refresh(self, file_ids: List[str], chunk_size: int = 1000) -> None:
+        async def run(chunk):
+            files, missing = await self.client.get_files(chunk, drive_id=self.drive_id)
+            upserts = [file for file in files if not file.get("trashed")]
+            removed_ids = missing + [file["id"] for file in files if file.get("trashed")]
+            await self.writer.call("apply_file_updates", upserts, removed_ids, self.target)
+
+        chunks = [file_ids[i:i + chunk_size] for i in range(0, len(file_ids), chunk_size)]
+        await asyncio.gather(*(run(chunk) for chunk in chunks))
+        logger.info("Async refresh complete (ids=%d)", len(file_ids))
+
+    def close(self):
+        self.writer.close()
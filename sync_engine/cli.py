@@ -1,7 +1,12 @@
+import json
 import logging
 import argparse
-from persistence.store import SQLiteStore
-from sync_engine.run_jobs import JobRunner
+import sys
+from persistence.store import DEFAULT_TARGET, SQLiteStore
+from sync_engine.metrics import STAGES, write_export
+
+# The job runner (sync engines, Drive client) and the wakeup socket are imported
+# by the commands that use them, so read-only commands like status start fast
 
 logger = logging.getLogger(__name__)
 
@@ -16,15 +21,73 @@ def print_welcome():
     print("  status     Show recent jobs and their status")
     print("  retry      Reset FAILED or DEAD jobs to PENDING")
     print("  delete     Delete PENDING or RUNNING jobs")
+    print("  serve      Keep a runner alive and start jobs as soon as they're queued")
+    print("  changes    List file changes after a cursor (--since)")
+    print("  stats      Show per-stage timings and counters of recent job runs")
+    print("  search     Find synced files by name, type and modified date")
+    print("  compact    Archive finished jobs and reclaim free space")
+    print("  export     Stream the file mirror to NDJSON or CSV")
+    print("  snapshot   Write the file mirror and its changes tokens to a checksummed file")
+    print("  restore    Load a snapshot into a new database")
+    print("  schedule   Add, list or remove recurring jobs run by serve")
+    print("  login      Authorize a Drive account and save its token (--token-file)")
     print()
     print("Example usage:")
     print("  python -m sync_engine.cli initiate")
     print("  python -m sync_engine.cli status")
+    print("  python -m sync_engine.cli initiate --job-type incremental_sync --drive-id <shared drive ID>")
     print()
 
-def main():
-    print_welcome()
+# " target=<name>" for rows outside the default target, empty otherwise
+def target_label(target):
+    return f" target={target}" if target else ""
+
+# Payload and target of a new job (or schedule) from the job flags
+# Returns (payload or None, target); raises ValueError for missing file IDs
+def job_parameters(parsed_args):
+    payload = {}
+    if parsed_args.drive_id:
+        payload["drive_id"] = parsed_args.drive_id
+    if parsed_args.token_file:
+        payload["token_file"] = parsed_args.token_file
+    target = parsed_args.target or parsed_args.drive_id or DEFAULT_TARGET
+    if parsed_args.job_type == "refresh_files":
+        file_ids = [i.strip() for i in parsed_args.file_ids.split(",") if i.strip()]
+        if parsed_args.file_ids_file:
+            with open(parsed_args.file_ids_file) as f:
+                file_ids += [line.strip() for line in f if line.strip()]
+        if not file_ids:
+            raise ValueError("refresh_files needs --file-ids or --file-ids-file.")
+        payload["file_ids"] = file_ids
+    return payload or None, target
+
+# Seconds per duration unit suffix
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# Seconds in a duration like "90", "90s", "5m", "2h" or "1d"
+# Used as an argparse type, so bad values are reported as usage errors
+def parse_duration(value: str) -> int:
+    number = value.strip().lower()
+    unit = DURATION_UNITS.get(number[-1:])
+    if unit is not None:
+        number = number[:-1]
+    try:
+        return int(float(number) * (unit or 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration: {value!r}")
+
+# Next UTC occurrence of a "HH:MM" time of day, as "YYYY-MM-DD HH:MM:SS"
+def next_time_of_day(value: str) -> str:
+    from datetime import datetime, timedelta, timezone
+
+    hour, minute = (int(part) for part in value.split(":"))
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    at = now.replace(hour=hour, minute=minute, second=0)
+    if at <= now:
+        at += timedelta(days=1)
+    return at.strftime("%Y-%m-%d %H:%M:%S")
 
+def main():
     # Sets up logger.info for application entry
     logging.basicConfig(level=logging.INFO)
 
@@ -35,11 +98,84 @@ def main():
     # Status allows viewing in-progress jobs
     # Retry allows resetting failded jobs to pending
     # Delete allows deletion of pending or running jobs
-    parser.add_argument("command", nargs="?", choices=["initiate", "status", "retry", "delete"])
+    # Serve keeps a runner waiting for new jobs
+    # Changes reads the file change log after a cursor
+    # Stats shows where recent job runs spent their time
+    # Search queries the local file mirror
+    # Compact archives finished jobs into job_history
+    # Export streams the file mirror to a file or stdout
+    # Snapshot and restore carry the mirror and its checkpoints to a new node
+    # Schedule manages recurring jobs queued by serve
+    # Login runs the browser consent flow and saves the account's token
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["initiate", "status", "retry", "delete", "serve", "changes", "stats", "search", "compact", "export", "snapshot", "restore", "schedule", "login"],
+    )
     # Defines job type as an arg to accept initiate, status, and retry
     parser.add_argument("--job-type", default="metadata_sync")
+    # File IDs for refresh_files jobs, comma separated or one per line in a file
+    parser.add_argument("--file-ids", default="")
+    parser.add_argument("--file-ids-file")
+    # Sync target of a new job: --drive-id syncs a shared drive, --token-file
+    # another account; the target defaults to the drive ID, or the user's drive
+    # The token file holds the account's saved OAuth token; login (or initiate)
+    # creates it through the browser, as serve never prompts
+    parser.add_argument("--target")
+    parser.add_argument("--drive-id")
+    parser.add_argument("--token-file")
+    # Idempotency key of a new job: while a job with the same key is pending,
+    # initiate returns it instead of queueing another. Defaults to the job's
+    # type, target and parameters, so identical requests share one job
+    parser.add_argument("--dedupe-key")
+    # Higher priority jobs are claimed first; --delay holds a job back ("10m")
+    parser.add_argument("--priority", type=int, default=0)
+    parser.add_argument("--delay", type=parse_duration, default=0)
+    # Recurring job: --schedule names it, --every sets the interval ("5m", "1d"),
+    # --at a UTC time of day ("02:00") for the first run; --remove deletes it
+    parser.add_argument("--schedule")
+    parser.add_argument("--every", type=parse_duration)
+    parser.add_argument("--at")
+    parser.add_argument("--remove", action="store_true")
+    # Number of jobs the runner executes concurrently, and at most how many
+    # of them may share a target (0 for no limit)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--target-concurrency", type=int, default=1)
+    # Change log cursor and page size for changes
+    parser.add_argument("--since", type=int, default=0)
+    parser.add_argument("--limit", type=int, default=100)
+    # Metrics export file: Prometheus text format, or JSON for a .json path
+    # With stats it is written once; with initiate and serve after every job
+    parser.add_argument("--metrics-export")
+    # Search filters; --cursor continues from the previous page
+    parser.add_argument("--name")
+    parser.add_argument("--mime-type")
+    parser.add_argument("--modified-after")
+    parser.add_argument("--modified-before")
+    parser.add_argument("--cursor")
+    # Retention for compact: finished jobs kept in the queue, history kept (0 keeps forever)
+    parser.add_argument("--keep-days", type=float, default=7)
+    parser.add_argument("--keep-rows", type=int, default=1000)
+    parser.add_argument("--history-days", type=float, default=90)
+    # Rewrites an older database file so later compactions can return space
+    parser.add_argument("--full-vacuum", action="store_true")
+    # Export output ("-" for stdout), format and row order; gzip is implied by a .gz path
+    # --modified-since keeps files modified at or after a timestamp, --cursor
+    # continues after the last row of an earlier export
+    parser.add_argument("--output")
+    parser.add_argument("--format", choices=["ndjson", "csv"])
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--order-by", choices=["id", "modified_time"], default="id")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--modified-since")
+    # Snapshot file read by restore (snapshot writes to --output)
+    parser.add_argument("--input", default="snapshot.ndjson.gz")
     parsed_args = parser.parse_args()
 
+    # Standard output carries the export itself
+    if not (parsed_args.command == "export" and parsed_args.output == "-"):
+        print_welcome()
+
     if parsed_args.command is None:
     # Just displays menu
         return
@@ -55,7 +191,7 @@ def main():
         with store._conn() as conn:
             pending_jobs = conn.execute(
                 """
-                SELECT id, type
+                SELECT id, type, target
                 FROM jobs
                 WHERE status = 'PENDING'
                 ORDER BY created_at
@@ -63,16 +199,70 @@ def main():
             ).fetchall()
 
         if pending_jobs:
-            print("\nPending jobs (will run sequentially):")
+            print(f"\nPending jobs (will run on {parsed_args.workers} worker(s)):")
             for job in pending_jobs:
-                print(f"  Job {job['id']} ({job['type']})")
+                print(f"  Job {job['id']} ({job['type']}{target_label(job['target'])})")
         else:
             print("\nNo pending jobs.")
 
-        job_id = store.create_job(parsed_args.job_type)
-        print(f"Created job: {job_id}. Initiating runner now!")
+        try:
+            payload, target = job_parameters(parsed_args)
+        except ValueError as e:
+            print(e)
+            return
+        # The job may be handed to serve, which can't prompt, so another
+        # account is authorized (or its token refreshed) here first
+        if parsed_args.token_file:
+            from api_client.gdrive_client import GDriveClient
+
+            GDriveClient(token_file=parsed_args.token_file)
+        job_id = store.create_job(
+            parsed_args.job_type,
+            payload=payload,
+            target=target,
+            dedupe_key=parsed_args.dedupe_key or store.job_dedupe_key(parsed_args.job_type, payload, target),
+            priority=parsed_args.priority,
+            delay_seconds=parsed_args.delay,
+        )
+        # An identical pending job is reused rather than queued again
+        created = "Created job" if all(job["id"] != job_id for job in pending_jobs) else "Reusing pending job"
+
+        from sync_engine.notify import notify, socket_path
+        from sync_engine.run_jobs import JobRunner
+
+        # Hands the job to a serving runner if one is listening
+        if notify(socket_path(store.db_path)):
+            print(f"{created}: {job_id}. Handed to the running service.")
+            return
+
+        print(f"{created}: {job_id}. Initiating runner now!")
         print("\nStarting runner...")
-        JobRunner(store).run()
+        JobRunner(
+            store,
+            workers=parsed_args.workers,
+            metrics_export=parsed_args.metrics_export,
+            target_concurrency=parsed_args.target_concurrency or None,
+        ).run()
+
+    # Runs jobs as they arrive until interrupted
+    elif parsed_args.command == "serve":
+        from functools import partial
+        from api_client.gdrive_client import GDriveClient
+        from sync_engine.run_jobs import JobRunner
+
+        print("Serving jobs, press Ctrl+C to stop.")
+        try:
+            # Accounts without a saved token fail their jobs instead of
+            # waiting on a browser nobody is watching
+            JobRunner(
+                store,
+                client_factory=partial(GDriveClient, interactive=False),
+                workers=parsed_args.workers,
+                metrics_export=parsed_args.metrics_export,
+                target_concurrency=parsed_args.target_concurrency or None,
+            ).serve()
+        except KeyboardInterrupt:
+            print("\nStopped.")
 
     # Checks status of jobs
     elif parsed_args.command == "status":
@@ -80,7 +270,8 @@ def main():
         with store._conn() as conn:
             jobs = conn.execute(
                 """
-                SELECT id, type, status, attempts, max_attempts
+                SELECT id, type, target, status, attempts, max_attempts, coalesced_into, priority,
+                    CASE WHEN run_after > datetime('now') THEN run_after END AS waiting_until
                 FROM jobs
                 ORDER BY created_at DESC
                 LIMIT 25
@@ -94,9 +285,12 @@ def main():
         for job in jobs:
             print(
                 f"Job {job['id']} | "
-                f"type={job['type']} | "
-                f"status={job['status']} | "
+                f"type={job['type']}{target_label(job['target'])} | "
+                f"status={job['status']}"
+                f"{' into job ' + str(job['coalesced_into']) if job['coalesced_into'] else ''} | "
                 f"attempts={job['attempts']}/{job['max_attempts']}"
+                f"{' | priority=' + str(job['priority']) if job['priority'] else ''}"
+                f"{' | due ' + job['waiting_until'] + ' UTC' if job['waiting_until'] else ''}"
             )
 
     # Retrying failed jobs
@@ -106,7 +300,7 @@ def main():
         # Resets counter as 0
         with store._conn() as conn:
             conn.execute(
-                "UPDATE jobs SET status='PENDING' WHERE status IN ('FAILED', 'DEAD')"
+                "UPDATE jobs SET status='PENDING', run_after=datetime('now') WHERE status IN ('FAILED', 'DEAD')"
             )
         print("All failed/dead jobs reset to PENDING. Use initiate to retry these pending jobs!")
         logger.info("Resets failed and dead jobs")
@@ -121,6 +315,194 @@ def main():
         print(f"Deleted {deleted} pending and running job(s).")
         logger.info("Deleted pending and running jobs")
 
+    # Lists file changes after the given cursor
+    elif parsed_args.command == "changes":
+        changes = store.get_changes(since=parsed_args.since, limit=parsed_args.limit)
+        if not changes:
+            print(f"No changes after {parsed_args.since}.")
+            return
+
+        for change in changes:
+            print(
+                f"{change['seq']} | "
+                f"{change['op']} | "
+                f"id={change['file_id']}{target_label(change['target'])} | "
+                f"name={change['name']} | "
+                f"modified={change['modified_time']}"
+            )
+        print(f"Next cursor: --since {changes[-1]['seq']}")
+
+    # Shows stage timings and counters of recent job runs
+    elif parsed_args.command == "stats":
+        runs = store.get_job_runs(limit=parsed_args.limit)
+        if parsed_args.metrics_export:
+            write_export(parsed_args.metrics_export, store, limit=parsed_args.limit)
+            print(f"Wrote metrics to {parsed_args.metrics_export}")
+        if not runs:
+            print("No job runs recorded yet.")
+            return
+
+        totals = {}
+        for run in runs:
+            metrics = json.loads(run["metrics"] or "{}")
+            timers = metrics.get("timers", {})
+            counters = metrics.get("counters", {})
+            stages = " ".join(
+                f"{stage}={timers[stage]['seconds']:.2f}s" for stage in STAGES if stage in timers
+            )
+            print(
+                f"Run {run['id']} | "
+                f"job={run['job_id']} ({run['job_type']}) | "
+                f"status={run['status']} | "
+                f"{run['duration_seconds']:.2f}s | "
+                f"{stages or 'no stages'} | "
+                f"written={counters.get('rows_written', 0)} "
+                f"unchanged={counters.get('rows_unchanged', 0)} "
+                f"retries={counters.get('api_retries', 0)}"
+            )
+            for stage, timer in timers.items():
+                totals[stage] = totals.get(stage, 0.0) + timer["seconds"]
+
+        # Share of timed work per stage across the listed runs
+        timed = sum(totals.values())
+        if timed:
+            print(f"\nTime by stage over {len(runs)} run(s):")
+            for stage, seconds in sorted(totals.items(), key=lambda item: -item[1]):
+                print(f"  {stage:<11} {seconds:10.2f}s  {seconds / timed:6.1%}")
+
+    # Searches synced files, newest first, one page at a time
+    elif parsed_args.command == "search":
+        files, cursor = store.search_files(
+            name=parsed_args.name,
+            mime_type=parsed_args.mime_type,
+            modified_after=parsed_args.modified_after,
+            modified_before=parsed_args.modified_before,
+            limit=parsed_args.limit,
+            cursor=parsed_args.cursor,
+            target=parsed_args.target,
+        )
+        if not files:
+            print("No matching files.")
+            return
+
+        for file in files:
+            print(
+                f"{file['id']}{target_label(file['target'])} | "
+                f"{file['name']} | "
+                f"type={file['mime_type']} | "
+                f"modified={file['modified_time']}"
+            )
+        if cursor:
+            print(f"Next page: --cursor '{cursor}'")
+
+    # Moves finished jobs to job_history and returns free pages to the OS
+    elif parsed_args.command == "compact":
+        if parsed_args.full_vacuum:
+            print("Running full VACUUM, the database is locked until it finishes...")
+            store.enable_incremental_vacuum()
+        result = store.compact_jobs(
+            keep_days=parsed_args.keep_days,
+            keep_rows=parsed_args.keep_rows,
+            history_days=parsed_args.history_days or None,
+        )
+        print(
+            f"Archived {result['archived']} finished job(s), "
+            f"purged {result['purged']} history row(s), "
+            f"freed {result['vacuumed_pages']} page(s)."
+        )
+
+    # Streams live files in keyset order, in flat memory
+    elif parsed_args.command == "export":
+        from sync_engine.export import export_files
+
+        output = parsed_args.output or "files.ndjson"
+        export_format = parsed_args.format or ("csv" if ".csv" in output else "ndjson")
+        count, cursor = export_files(
+            store,
+            output,
+            format=export_format,
+            compress=parsed_args.gzip or output.endswith(".gz"),
+            order_by=parsed_args.order_by,
+            batch_size=parsed_args.batch_size,
+            modified_since=parsed_args.modified_since,
+            target=parsed_args.target,
+            cursor=parsed_args.cursor,
+        )
+        # Keeps stdout clean when the export goes there
+        report = sys.stderr if output == "-" else sys.stdout
+        print(f"Exported {count} file(s) to {output}.", file=report)
+        if cursor:
+            print(f"Continue with: --order-by {parsed_args.order_by} --cursor '{cursor}'", file=report)
+
+    # Writes the files table and changes tokens as of one moment
+    elif parsed_args.command == "snapshot":
+        from sync_engine.snapshot import write_snapshot
+
+        output = parsed_args.output or "snapshot.ndjson.gz"
+        header = write_snapshot(store, output)
+        print(f"Wrote {header['rows']} file row(s) and {len(header['state'])} checkpoint(s) to {output}.")
+
+    # Bootstraps this database from a snapshot instead of a full listing
+    elif parsed_args.command == "restore":
+        from sync_engine.snapshot import SnapshotError, load_snapshot, snapshot_targets
+
+        try:
+            header = load_snapshot(store, parsed_args.input)
+        except (SnapshotError, ValueError) as e:
+            print(e)
+            return
+        print(f"Loaded {header['rows']} file row(s) from {parsed_args.input} (taken {header['created_at']}).")
+        # Each target catches up from its changes token; the drive or account
+        # behind a target isn't recorded, so pass the same --drive-id/--token-file as before
+        print("Resume each target with an incremental sync:")
+        for target in snapshot_targets(header["state"]):
+            print(f"  python -m sync_engine.cli initiate --job-type incremental_sync{' --target ' + target if target else ''}")
+
+
+    # Recurring jobs, queued by serve when due
+    elif parsed_args.command == "schedule":
+        if parsed_args.schedule and parsed_args.remove:
+            removed = store.delete_schedule(parsed_args.schedule)
+            print(f"Removed schedule {parsed_args.schedule}." if removed else f"No schedule named {parsed_args.schedule}.")
+            return
+        if parsed_args.schedule and parsed_args.every is not None:
+            try:
+                payload, target = job_parameters(parsed_args)
+                store.set_schedule(
+                    parsed_args.schedule,
+                    parsed_args.job_type,
+                    parsed_args.every,
+                    payload=payload,
+                    target=target,
+                    priority=parsed_args.priority,
+                    first_run_at=next_time_of_day(parsed_args.at) if parsed_args.at else None,
+                )
+            except ValueError as e:
+                print(e)
+                return
+            print(f"Saved schedule {parsed_args.schedule}. Jobs are queued by a running `serve`.")
+
+        schedules = store.get_schedules()
+        if not schedules:
+            print("No schedules. Add one with --schedule NAME --every 5m --job-type incremental_sync.")
+        for schedule in schedules:
+            print(
+                f"{schedule['name']} | "
+                f"type={schedule['job_type']}{target_label(schedule['target'])} | "
+                f"every {schedule['interval_seconds']}s | "
+                f"next run {schedule['next_run_at']} UTC"
+                f"{' | priority=' + str(schedule['priority']) if schedule['priority'] else ''}"
+                f"{' | last job ' + str(schedule['last_job_id']) if schedule['last_job_id'] else ''}"
+            )
+
+    # Authorizes an account through the browser and saves its token for runners
+    elif parsed_args.command == "login":
+        from api_client.gdrive_client import GDriveClient
+
+        token_file = parsed_args.token_file or "token.json"
+        GDriveClient(token_file=token_file)
+        print(f"Authorized. Token saved to {token_file}.")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,91 @@
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+from typing import Optional, TextIO, Tuple
+from persistence.store import SQLiteStore
+
+# Bulk export of the file mirror for downstream ETL
+# Rows stream from SQLiteStore.iter_files straight to the output, so memory
+# stays flat for any table size
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_COLUMNS = ("target", "id", "name", "mime_type", "modified_time", "parent_id", "size", "path")
+# Rows handed to each write call
+WRITE_BATCH = 1000
+# Fastest gzip level: metadata text compresses almost as well as at level 9,
+# several times faster, so compression keeps up with the disk
+GZIP_LEVEL = 1
+# One shared encoder: json.dumps with options builds a new one per call
+_encode_json = json.JSONEncoder(ensure_ascii=False).encode
+
+# Opens the output as text: "-" is stdout, anything else a temporary file next
+# to path that is moved into place once the export completes
+# Returns (stream, temporary path or None)
+def _open_output(path: str, compress: bool) -> Tuple[TextIO, Optional[str]]:
+    if path == "-":
+        if not compress:
+            return sys.stdout, None
+        return io.TextIOWrapper(gzip.GzipFile(fileobj=sys.stdout.buffer, mode="wb", compresslevel=GZIP_LEVEL), newline=""), None
+    tmp_path = f"{path}.tmp"
+    if compress:
+        return io.TextIOWrapper(gzip.open(tmp_path, "wb", compresslevel=GZIP_LEVEL), encoding="utf-8", newline=""), tmp_path
+    return open(tmp_path, "w", encoding="utf-8", newline=""), tmp_path
+
+# Streams live files to path as NDJSON or CSV (with a header row), gzipped
+# when compress is set (by default, for a .gz path)
+# iter_options go to iter_files: order_by, batch_size, modified_since, target, cursor
+# Returns (rows written, cursor of the last row or None if nothing was written),
+# so the next export can continue with cursor=...
+def export_files(
+    store: SQLiteStore,
+    path: str,
+    format: str = "ndjson",
+    compress: Optional[bool] = None,
+    **iter_options,
+) -> Tuple[int, Optional[str]]:
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Error: Unknown export format {format}")
+    path = str(path)
+    if compress is None:
+        compress = path.endswith(".gz")
+
+    out, tmp_path = _open_output(path, compress)
+    count = 0
+    last = None
+    try:
+        if format == "csv":
+            write_rows = csv.writer(out).writerows
+            write_rows([EXPORT_COLUMNS])
+        else:
+            def write_rows(rows):
+                out.write("".join(_encode_json(dict(zip(EXPORT_COLUMNS, row))) + "\n" for row in rows))
+
+        batch = []
+        for row in store.iter_files(**iter_options):
+            batch.append(tuple(row))
+            if len(batch) >= WRITE_BATCH:
+                write_rows(batch)
+                count += len(batch)
+                last, batch = row, []
+        if batch:
+            write_rows(batch)
+            count += len(batch)
+            last = row
+    except BaseException:
+        # A failed export leaves no partial file behind
+        if tmp_path is not None:
+            out.close()
+            os.remove(tmp_path)
+        raise
+
+    if out is sys.stdout:
+        out.flush()
+    else:
+        out.close()
+    if tmp_path is not None:
+        os.replace(tmp_path, path)
+    cursor = SQLiteStore.file_cursor(last, iter_options.get("order_by", "id")) if last is not None else None
+    return count, cursor
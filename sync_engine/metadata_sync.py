@@ -1,28 +1,99 @@
-from typing import Optional
-from api_client.gdrive_client import GDriveClient
-from persistence.store import SQLiteStore
+from typing import Dict, Iterator, List, Optional, Tuple
+from api_client.gdrive_client import GDriveClient, PageTokenExpired, RetryableAPIError
+from persistence.store import DEFAULT_TARGET, SQLiteStore
+from sync_engine.metrics import SyncMetrics
+from sync_engine.page_sizing import AdaptivePageSize
 import logging
+import queue
+import threading
+import time
+
+# Raised inside a commit when the engine's cancel event is set; the commit
+# (rows and checkpoint) is rolled back and the sync stops
+class SyncCancelled(RuntimeError):
+    pass
 
 # Key used to store the last processed page token
 CHECKPOINT_TOKEN = "drive_metadata_page_token"
+# Key used to store the changes feed token incremental syncs resume from
+CHANGES_TOKEN = "drive_changes_page_token"
+# Start token taken before a full listing, promoted to CHANGES_TOKEN once it completes
+PENDING_CHANGES_TOKEN = "drive_changes_pending_token"
 logger = logging.getLogger(__name__)
 
+# Checkpoint key of a sync target: the default target keeps the plain keys,
+# others get theirs prefixed, so each target resumes independently
+def scoped_key(key: str, target: str = DEFAULT_TARGET) -> str:
+    return f"target:{target}:{key}" if target else key
+
+# Drops trashed files from a listed page, for clients that don't apply the
+# listing's trashed = false filter; unlisted files are tombstoned by the sweep
+def live_files(page: Tuple[List, Optional[str]]) -> Tuple[List, Optional[str]]:
+    files, next_page_token = page
+    if any(file.get("trashed") for file in files):
+        files = [file for file in files if not file.get("trashed")]
+    return files, next_page_token
+
 class MetadataSyncEngine:
     def __init__(
         self,
         client: GDriveClient,
         store: SQLiteStore,
-        page_size: int = 25,
+        page_size: int = 100,
+        commit_pages: int = 1,
+        commit_interval_ms: Optional[float] = None,
+        prefetch: int = 0,
+        checkpoint_key: Optional[str] = None,
+        query: Optional[str] = None,
+        adaptive_page_size: bool = False,
+        max_page_retries: int = 3,
+        metrics: Optional[SyncMetrics] = None,
+        target: str = DEFAULT_TARGET,
+        drive_id: Optional[str] = None,
+        cancel: Optional[threading.Event] = None,
+        pass_generation: Optional[int] = None,
     ):
         self.client = client
         self.store = store
+        # Sync target the rows and checkpoints belong to, and the shared drive
+        # it lists (None lists the client's own files)
+        self.target = target
+        self.drive_id = drive_id
         self.page_size = page_size
+        # Adaptive sizing starts at page_size and follows API latency and errors
+        # A throttled page is retried at the smaller size up to max_page_retries times
+        self.page_sizer = AdaptivePageSize(initial=page_size) if adaptive_page_size else None
+        self.max_page_retries = max_page_retries
+        # Group commit: pages share one transaction until commit_pages pages
+        # or commit_interval_ms milliseconds have gone by, whichever is first
+        # The defaults commit every page on its own
+        # Note: an open group holds the SQLite write lock while later pages are fetched
+        self.commit_pages = max(1, commit_pages)
+        self.commit_interval_ms = commit_interval_ms
+        # Pipelining: with prefetch > 0 a fetcher thread keeps up to that many
+        # pages queued ahead of the writer, so API and SQLite time overlap
+        self.prefetch = prefetch
+        # Checkpoint key and Drive query (q=) for this listing
+        # Sharded syncs run one engine per query, each with its own key
+        # The default keys are scoped to the target; a given key is used as is
+        self.checkpoint_key = checkpoint_key or scoped_key(CHECKPOINT_TOKEN, target)
+        self.changes_key = scoped_key(CHANGES_TOKEN, target)
+        self.pending_changes_key = scoped_key(PENDING_CHANGES_TOKEN, target)
+        self.query = query
+        # Generation of the sharded pass a shard's listing belongs to; the rows it
+        # lists are recorded as seen for that pass's sweep
+        self.pass_generation = pass_generation
+        # Stage timers and counters; pass one in to collect a whole job's numbers
+        self.metrics = metrics or SyncMetrics()
+        # Set by the job runner when the job's lease is lost: another runner may
+        # take the job over, so no more rows or checkpoints may be committed
+        self.cancel = cancel
 
     # Performs resumable metadata sync operation.
     # Can restart at any time.
     def sync(self) -> None:
         # Load last page token
-        page_token = self.store.get_checkpoint(CHECKPOINT_TOKEN)
+        page_token = self.store.get_checkpoint(self.checkpoint_key)
 
         if page_token:
             logger.info(
@@ -31,51 +102,319 @@ class MetadataSyncEngine:
         else:
             logger.info("No checkpoint found, starting from beginning")
 
+        # A full listing (no query) records the rows it sees under this pass's
+        # generation, then tombstones rows it neither saw nor wrote
+        generation = None
+        if not self.query:
+            generation = self.store.begin_generation(
+                f"{self.checkpoint_key}:generation", resume=bool(page_token)
+            )
+            if generation is None:
+                logger.warning("Resumed listing has no recorded generation, skipping the sweep")
+        seen_generation = generation if generation is not None else self.pass_generation
+
         pages_processed = 0
         files_processed = 0
+        commits = 0
+        done = False
+
+        # Fetch files and next page from Drive, serially or from the prefetch queue
+        if self.prefetch > 0:
+            pages = self._prefetch_pages(page_token)
+        else:
+            pages = self._fetch_pages(page_token)
+
+        try:
+            while not done:
+                # Pages and their checkpoint are committed together once per group
+                # A crash mid-group rolls back to the last committed checkpoint
+                with self.store.transaction():
+                    group_started = time.monotonic()
+                    group_pages = 0
+                    done = True
+
+                    for files, next_page_token in pages:
+                        if not files:
+                            logger.debug("No files returned for this page")
+
+                        # Save files and the checkpoint after them in one write
+                        with self.metrics.timer("write"):
+                            changed = (
+                                self.store.insert_update_files(files, self.target, seen_generation) if files else 0
+                            )
+                        with self.metrics.timer("checkpoint"):
+                            self.store.set_checkpoint(self.checkpoint_key, next_page_token)
+                        self._count_rows(len(files), changed)
+                        files_processed += len(files)
+
+                        logger.debug(
+                            "Checkpoint updated to token: %s",
+                            next_page_token[:10] if next_page_token else "END",
+                        )
+                        pages_processed += 1
+                        group_pages += 1
+
+                        logger.info(
+                            "Processed page %d (files so far: %d)",
+                            pages_processed,
+                            files_processed,
+                        )
+
+                        # Stop iterating if pages run out
+                        if not next_page_token:
+                            break
+
+                        if self._group_full(group_pages, group_started):
+                            done = False
+                            break
+
+                    self.check_cancelled()
+                    commit_started = time.perf_counter()
 
-        # Fetch files and next page from Drive
+                self.metrics.add_time("commit", time.perf_counter() - commit_started)
+                if group_pages:
+                    commits += 1
+                    logger.debug("Committed %d page(s) in one transaction", group_pages)
+        finally:
+            # Stops the fetcher thread when the writer ends early
+            pages.close()
+
+        deleted = 0
+        if generation is not None:
+            self.check_cancelled()
+            with self.metrics.timer("sweep"):
+                deleted = self.store.sweep_generation(generation, self.target)
+            self.metrics.count("rows_deleted", deleted)
+            self.store.clear_checkpoint(f"{self.checkpoint_key}:generation")
+
+        logger.info(
+            "Metadata sync complete (pages=%d, files=%d, commits=%d, deleted=%d)",
+            pages_processed,
+            files_processed,
+            commits,
+            deleted,
+        )
+
+    # Yields (files, next_page_token) pairs, fetching each page on demand
+    def _fetch_pages(self, page_token: Optional[str]) -> Iterator[Tuple[List, Optional[str]]]:
         while True:
             logger.debug("Fetching page (token length=%s)",
                          len(page_token) if page_token else "none")
 
-            files, next_page_token = self.client.list_files(page_token=page_token)
-            if files:
-                # Save files to local storage
-                self.store.insert_update_files(files)
-                files_processed += len(files)
-            else:
-                logger.debug("No files returned for this page")
+            files, next_page_token = self._list_page(page_token)
+            yield files, next_page_token
 
-            # Persist checkpoint after writing successfully
-            self.store.set_checkpoint(CHECKPOINT_TOKEN, next_page_token)
+            if not next_page_token:
+                return
 
-            logger.debug(
-                "Checkpoint updated to token: %s",
-                next_page_token[:10] if next_page_token else "END",
-            )
-            pages_processed += 1
+            # Move on to next page
+            page_token = next_page_token
 
-            logger.info(
-                "Processed page %d (files so far: %d)",
-                pages_processed,
-                files_processed,
-            )
+    # Fetches one page at the current page size, shrinking it on throttling
+    def _list_page(self, page_token: Optional[str]) -> Tuple[List, Optional[str]]:
+        kwargs = {"page_token": page_token}
+        if self.query:
+            kwargs["query"] = self.query
+        if self.drive_id:
+            kwargs["drive_id"] = self.drive_id
+
+        retries = 0
+        while True:
+            page_size = self.page_sizer.size if self.page_sizer else self.page_size
+            started = time.monotonic()
+            try:
+                with self.metrics.timer("fetch"):
+                    result = self.client.list_files(page_size=page_size, **kwargs)
+            except RetryableAPIError:
+                if self.page_sizer is None or retries >= self.max_page_retries:
+                    raise
+                retries += 1
+                self.metrics.count("page_retries")
+                self.page_sizer.record_error()
+                continue
+
+            if self.page_sizer:
+                self.page_sizer.record_success(time.monotonic() - started)
+            return live_files(result)
+
+    # Yields the same pages as _fetch_pages, fetched ahead by a background thread
+    # The queue is bounded, so the fetcher blocks when the writer falls behind
+    # Fetch errors are re-raised in the writer after the pages before them
+    def _prefetch_pages(self, page_token: Optional[str]) -> Iterator[Tuple[List, Optional[str]]]:
+        pending = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        # Puts an item unless the writer has stopped reading
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    pending.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def fetcher():
+            try:
+                for page in self._fetch_pages(page_token):
+                    if not put(("page", page)):
+                        return
+                put(("done", None))
+            except BaseException as e:
+                put(("error", e))
+
+        thread = threading.Thread(target=fetcher, name="metadata-sync-fetcher", daemon=True)
+        thread.start()
+        try:
+            while True:
+                kind, value = pending.get()
+                if kind == "page":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    return
+        finally:
+            stop.set()
+            thread.join()
+
+    # Counts one written page and how many of its rows were actually written
+    # Unchanged rows were skipped by the upsert, full syncs included: those
+    # record the rows they saw in files_seen rather than restamping them
+    def _count_rows(self, rows: int, written: int) -> None:
+        self.metrics.count("pages")
+        self.metrics.count("rows_seen", rows)
+        self.metrics.count("rows_written", written)
+        self.metrics.count("rows_unchanged", rows - written)
+
+    # drive_id keyword for client calls, omitted for the client's own files
+    # so clients without shared drive support keep working
+    def _drive_kwargs(self) -> Dict:
+        return {"drive_id": self.drive_id} if self.drive_id else {}
+
+    # Checks whether the current commit group has reached its page or time limit
+    def _group_full(self, group_pages: int, group_started: float) -> bool:
+        if group_pages >= self.commit_pages:
+            return True
+        if self.commit_interval_ms is None:
+            return False
+        return (time.monotonic() - group_started) * 1000 >= self.commit_interval_ms
+
+    # Performs an incremental sync from the Drive changes feed.
+    # Runs a full listing first when there is no usable changes token.
+    def sync_incremental(self) -> None:
+        page_token = self.store.get_checkpoint(self.changes_key)
+        if not page_token:
+            logger.info("No changes token found, running full sync first")
+            self._full_sync_with_changes_token()
+            return
+
+        try:
+            self._apply_changes(page_token)
+        except PageTokenExpired:
+            logger.warning("Changes token expired, falling back to full sync")
+            self.store.clear_checkpoint(self.changes_key)
+            self._full_sync_with_changes_token()
+
+    # Runs a full listing and records the changes token taken before it started
+    # Changes made while the listing runs are replayed by the next incremental sync
+    def _full_sync_with_changes_token(self) -> None:
+        start_token = self.store.get_checkpoint(self.pending_changes_key)
+        if not start_token:
+            start_token = self.client.get_start_page_token(**self._drive_kwargs())
+            self.store.set_checkpoint(self.pending_changes_key, start_token)
+
+        self.sync()
+
+        with self.store.transaction():
+            self.store.set_checkpoint(self.changes_key, start_token)
+            self.store.clear_checkpoint(self.pending_changes_key)
+
+    # Pages through the changes feed, applying each page with its token atomically
+    def _apply_changes(self, page_token: str) -> None:
+        pages_processed = 0
+        upserted = 0
+        removed = 0
+
+        while True:
+            with self.metrics.timer("fetch"):
+                changes, next_page_token, new_start_token = self.client.list_changes(
+                    page_token=page_token, page_size=self.page_size, **self._drive_kwargs()
+                )
+
+            # Keep only the last change per file within the page
+            latest = {}
+            for change in changes:
+                if change.get("fileId"):
+                    latest[change["fileId"]] = change
+
+            upserts = []
+            removed_ids = []
+            for file_id, change in latest.items():
+                file = change.get("file")
+                if change.get("removed") or not file or file.get("trashed"):
+                    removed_ids.append(file_id)
+                else:
+                    upserts.append(file)
+
+            # The last page carries the token the next incremental sync starts from
+            # Rows and token are committed together
+            with self.store.transaction():
+                with self.metrics.timer("write"):
+                    changed = self.store.apply_file_updates(upserts, removed_ids, self.target)
+                with self.metrics.timer("checkpoint"):
+                    self.store.set_checkpoint(self.changes_key, next_page_token or new_start_token)
+                self.check_cancelled()
+                commit_started = time.perf_counter()
+            self.metrics.add_time("commit", time.perf_counter() - commit_started)
+            self._count_rows(len(upserts), changed)
+            self.metrics.count("rows_deleted", len(removed_ids))
+            pages_processed += 1
+            upserted += len(upserts)
+            removed += len(removed_ids)
 
-            # Stop iterating if pages run out
             if not next_page_token:
                 break
-
-            # Move on to next page
             page_token = next_page_token
-        
+
         logger.info(
-            "Metadata sync complete (pages=%d, files=%d)",
+            "Incremental sync complete (pages=%d, upserted=%d, removed=%d)",
             pages_processed,
-            files_processed,
+            upserted,
+            removed,
         )
 
+    # Refreshes specific files by ID through batched get requests
+    # Found files are upserted; trashed or not-found files are removed
+    # Each chunk of IDs is written in one transaction
+    def refresh(self, file_ids: List[str], chunk_size: int = 1000) -> None:
+        refreshed = 0
+        removed = 0
+        for start in range(0, len(file_ids), chunk_size):
+            with self.metrics.timer("fetch"):
+                files, missing = self.client.get_files_batch(
+                    file_ids[start:start + chunk_size], **self._drive_kwargs()
+                )
+            upserts = [file for file in files if not file.get("trashed")]
+            removed_ids = missing + [file["id"] for file in files if file.get("trashed")]
+
+            self.check_cancelled()
+            with self.metrics.timer("write"):
+                changed = self.store.apply_file_updates(upserts, removed_ids, self.target)
+            self._count_rows(len(upserts), changed)
+            self.metrics.count("rows_deleted", len(removed_ids))
+            refreshed += len(upserts)
+            removed += len(removed_ids)
+
+        logger.info("Refresh complete (refreshed=%d, removed=%d)", refreshed, removed)
+
+    # Raises SyncCancelled once the cancel event is set
+    # Called inside each commit, so the cancelled commit is rolled back
+    def check_cancelled(self) -> None:
+        if self.cancel is not None and self.cancel.is_set():
+            raise SyncCancelled("Sync cancelled before commit")
+
     # Clear sync checkpoint to force a full resync.
     def reset(self) -> None:
         logger.warning("Resetting metadata sync checkpoint")
-        self.store.clear_checkpoint(CHECKPOINT_TOKEN)
+        self.store.clear_checkpoint(self.checkpoint_key)
@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable
+
+# Stages timed on the sync hot path, in pipeline order
+# fetch: Drive API call including response decoding
+# write: file upserts and tombstones
+# checkpoint: page token update
+# commit: SQLite commit of a page group
+# sweep: tombstoning files a full listing didn't see
+STAGES = ("fetch", "write", "checkpoint", "commit", "sweep")
+# Prefix of every exported Prometheus metric
+PROMETHEUS_PREFIX = "gdrive_sync"
+
+class SyncMetrics:
+    # Stage timers and event counters for one job run
+    # Thread-safe, so shard workers and the prefetch thread can share one instance
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # stage -> [calls, seconds]
+        self.timers: Dict[str, list] = {}
+        self.counters: Dict[str, int] = {}
+
+    # Times the body of a with block under the given stage
+    @contextmanager
+    def timer(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - started)
+
+    def add_time(self, stage: str, seconds: float):
+        with self._lock:
+            timer = self.timers.setdefault(stage, [0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+
+    def count(self, name: str, value: int = 1):
+        if not value:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    # JSON-ready copy: {"timers": {stage: {"calls", "seconds"}}, "counters": {name: value}}
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "timers": {
+                    stage: {"calls": calls, "seconds": round(seconds, 6)}
+                    for stage, (calls, seconds) in self.timers.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+# Exported counter families: job_metric_totals metric -> (name, help, label of its label column)
+PROMETHEUS_FAMILIES = (
+    ("stage_seconds", "stage_seconds_total", "Time spent per sync stage", "stage"),
+    ("stage_calls", "stage_calls_total", "Timed calls per sync stage", "stage"),
+    ("events", "events_total", "Sync event counters (pages, rows, retries)", "event"),
+    ("job_runs", "job_runs_total", "Job runs by final status", "status"),
+    ("job_duration_seconds", "job_duration_seconds_total", "Wall time of job runs", None),
+)
+
+# Renders the cumulative job run totals (store.get_metric_totals rows) as
+# Prometheus text format; the totals are never purged, so the counters only go up
+def to_prometheus(totals: Iterable) -> str:
+    samples: Dict[str, list] = {}
+    for row in totals:
+        samples.setdefault(row["metric"], []).append(row)
+
+    lines = []
+    for metric, name, help_text, label in PROMETHEUS_FAMILIES:
+        lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} counter")
+        for row in samples.get(metric, []):
+            label_text = f'job_type="{row["job_type"]}"'
+            if label:
+                label_text += f',{label}="{row["label"]}"'
+            value = row["value"]
+            lines.append(f"{PROMETHEUS_PREFIX}_{name}{{{label_text}}} {int(value) if value == int(value) else value}")
+    return "\n".join(lines) + "\n"
+
+# Renders job runs as a JSON list, newest first, with metrics decoded
+def to_json(runs: Iterable) -> str:
+    return json.dumps(
+        [{**dict(run), "metrics": json.loads(run["metrics"] or "{}")} for run in runs],
+        indent=2,
+    )
+
+# Writes the store's job metrics to path: the limit most recent runs as JSON for
+# a .json path, the cumulative totals in Prometheus text format otherwise
+# Replaces the file atomically, so a scraper never reads a partial export
+def write_export(path: str, store, limit: int = 1000) -> None:
+    if str(path).endswith(".json"):
+        text = to_json(store.get_job_runs(limit=limit))
+    else:
+        text = to_prometheus(store.get_metric_totals())
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,75 @@
+import logging
+import os
+import select
+import socket
+from typing import Optional
+
+# Local wakeup channel between job producers (cli initiate) and a serving JobRunner
+# A Unix datagram socket next to the database carries empty "new job" pings
+# Platforms without Unix sockets fall back to the runner's data_version polling
+
+logger = logging.getLogger(__name__)
+
+# Path of the wakeup socket for a database
+def socket_path(db_path) -> str:
+    return f"{db_path}.sock"
+
+# Pings a serving runner; returns False if nothing is listening
+def notify(path: str) -> bool:
+    if not hasattr(socket, "AF_UNIX"):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(b"job", path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+class WakeupListener:
+    # Receiving end of the wakeup socket, owned by one serving runner
+
+    def __init__(self, sock: socket.socket, path: str):
+        self.sock = sock
+        self.path = path
+
+    # Binds the socket, or returns None if unsupported or owned by a live runner
+    @classmethod
+    def open(cls, path: str) -> Optional["WakeupListener"]:
+        if not hasattr(socket, "AF_UNIX"):
+            return None
+        if os.path.exists(path):
+            # A socket left by a crashed runner refuses pings and can be replaced
+            if notify(path):
+                logger.warning("Another runner owns %s, relying on polling", path)
+                return None
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.bind(path)
+        except OSError:
+            sock.close()
+            logger.warning("Could not bind wakeup socket %s, relying on polling", path)
+            return None
+        sock.setblocking(False)
+        return cls(sock, path)
+
+    # Waits up to timeout seconds for pings; returns True if any arrived
+    def wait(self, timeout: float) -> bool:
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            return False
+        # Several pings collapse into one wakeup
+        while True:
+            try:
+                self.sock.recv(64)
+            except BlockingIOError:
+                return True
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,41 @@
+import logging
+
+# Largest pageSize accepted by files.list and changes.list
+MAX_PAGE_SIZE = 1000
+logger = logging.getLogger(__name__)
+
+class AdaptivePageSize:
+    # Picks the page size for each request from how recent pages went
+    # Doubles toward the API maximum while pages come back fast,
+    # halves on throttling/server errors or slow pages
+
+    def __init__(
+        self,
+        initial: int = 100,
+        minimum: int = 10,
+        maximum: int = MAX_PAGE_SIZE,
+        fast_seconds: float = 1.0,
+        slow_seconds: float = 5.0,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.fast_seconds = fast_seconds
+        self.slow_seconds = slow_seconds
+        self.size = max(minimum, min(initial, maximum))
+
+    # Records a successful page that took elapsed seconds
+    def record_success(self, elapsed: float):
+        if elapsed < self.fast_seconds:
+            self._resize(self.size * 2, "fast page (%.2fs)" % elapsed)
+        elif elapsed > self.slow_seconds:
+            self._resize(self.size // 2, "slow page (%.2fs)" % elapsed)
+
+    # Records a rate limit or server error
+    def record_error(self):
+        self._resize(self.size // 2, "API error")
+
+    def _resize(self, size: int, reason: str):
+        size = max(self.minimum, min(size, self.maximum))
+        if size != self.size:
+            logger.info("Page size %d -> %d after %s", self.size, size, reason)
+            self.size = size
@@ -1,105 +1,405 @@
 import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
 import time
+import uuid
+from typing import Optional
 from persistence.store import SQLiteStore
 from sync_engine.metadata_sync import MetadataSyncEngine
+from sync_engine.metrics import SyncMetrics, write_export
+from sync_engine.notify import WakeupListener, socket_path
+from sync_engine.sharded_sync import ShardedSyncEngine
 from api_client.gdrive_client import GDriveClient
 
+# sync_state key holding when finished jobs were last compacted (Unix time)
+COMPACTED_AT_KEY = "jobs_compacted_at"
 logger = logging.getLogger(__name__)
 
 class JobRunner:
     # Polls job queue, executes job requests, retries, and updates
+    # Several workers (and several runner processes) can share one queue:
+    # jobs are claimed atomically and held through a renewable lease
+    # Jobs for different sync targets run side by side; target_concurrency caps
+    # the jobs running per target, so two syncs never share a target's checkpoints
 
     # Initializes JobRunner
-    def __init__(self, store: SQLiteStore, poll_interval: int = 2):
+    def __init__(
+        self,
+        store: SQLiteStore,
+        poll_interval: int = 2,
+        workers: int = 1,
+        lease_seconds: int = 60,
+        client_factory=GDriveClient,
+        min_idle: float = 0.05,
+        metrics_export: Optional[str] = None,
+        compact_interval: Optional[float] = 3600,
+        target_concurrency: Optional[int] = 1,
+        retry_base_seconds: float = 30,
+        retry_max_seconds: float = 3600,
+    ):
         self.store = store
+        # In serve mode idle waits double from min_idle up to poll_interval
         self.poll_interval = poll_interval
+        self.min_idle = min_idle
+        self.workers = max(1, workers)
+        self.lease_seconds = lease_seconds
+        # Builds the Drive client, replaced in tests
+        # Jobs naming a token_file get their own client (another account), built
+        # with client_factory(token_file=...) and kept for later jobs
+        self.client_factory = client_factory
+        self._account_clients = {}
+        self._account_lock = threading.Lock()
+        # Most jobs running at once per target, across all runners; None is unlimited
+        self.target_concurrency = target_concurrency
+        # Identifies this runner in job leases
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # Optional file rewritten with job run metrics after every job
+        # (Prometheus text format, or JSON for a .json path)
+        self.metrics_export = metrics_export
+        # Seconds between automatic compactions of finished jobs, None disables
+        # The last run time is shared through the store, so runners take turns
+        self.compact_interval = compact_interval
+        # Failed jobs with attempts left are retried after an exponential
+        # backoff: retry_base_seconds, doubling per attempt up to retry_max_seconds
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        # Serve mode: bumped on every wakeup so idle workers notice new work
+        self._wakeup = threading.Condition()
+        self._wakeups = 0
 
-    # Recovers stuck jobs by marking RUNNING jobs as FAILED so they can be retried
-    # Used in the case of crashes
+    # Recovers stuck jobs whose lease expired so they can be retried
+    # Used in the case of crashes; jobs leased by live runners are untouched
     def recover_stuck_jobs(self):
-        with self.store._conn() as conn:
-            updated = conn.execute(
-                """
-                UPDATE jobs
-                SET status = 'FAILED',
-                    attempts = attempts + 1
-                WHERE status = 'RUNNING'
-                AND attempts < max_attempts
-                """
-            ).rowcount
+        updated = self.store.reclaim_expired_jobs()
         if updated > 0:
             logger.info("Recovered %d stuck jobs.", updated)
         return updated
-    
+
+    # Compacts finished jobs if compact_interval has passed since the last compaction
+    # Returns compact_jobs' counts, or None if it wasn't due
+    def compact_if_due(self):
+        if self.compact_interval is None:
+            return None
+        last = self.store.get_checkpoint(COMPACTED_AT_KEY)
+        if last is not None and time.time() - float(last) < self.compact_interval:
+            return None
+        self.store.set_checkpoint(COMPACTED_AT_KEY, str(time.time()))
+        # Housekeeping never stops the runner
+        try:
+            result = self.store.compact_jobs()
+        except Exception:
+            logger.warning("Job compaction failed", exc_info=True)
+            return None
+        if result["archived"] or result["purged"]:
+            logger.info(
+                "Compacted jobs (archived=%d, purged=%d, vacuumed_pages=%d)",
+                result["archived"], result["purged"], result["vacuumed_pages"],
+            )
+        return result
+
+    # Seconds before a job that failed its attempts-th attempt is retried
+    # Equal jitter: half the backoff plus a random share of the other half, so a
+    # retry never comes sooner than half the backoff, while jobs that failed
+    # together (an outage) still don't retry together
+    def retry_delay(self, attempts: int) -> float:
+        ceiling = min(self.retry_base_seconds * 2 ** max(0, attempts - 1), self.retry_max_seconds)
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    # Queues a job for every due schedule; wakes the workers if any were queued
+    def enqueue_schedules(self) -> int:
+        try:
+            queued = self.store.enqueue_due_schedules()
+        except Exception:
+            logger.warning("Queueing scheduled jobs failed", exc_info=True)
+            return 0
+        if queued:
+            logger.info("Queued scheduled job(s) %s", ", ".join(map(str, queued)))
+            self._wake_workers()
+        return len(queued)
+
     # Retrieves job by ID
     def get_job(self, job_id: int):
-        with self._conn() as conn:
-            cur = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
-            row = cur.fetchone()
-            return row
+        return self.store.get_job(job_id)
 
-        
-    # Loops to fetch and execute all pending jobs
+    # Claims and executes pending jobs until the queue is empty
     # Handles status updates, retries, and failure logs
     def run(self):
         # Recover jobs from previous crashes
         self.recover_stuck_jobs()
+        self.compact_if_due()
+
+        # Initializes a client shared by all workers
+        client = self.client_factory()
+
+        if self.workers == 1:
+            self._work(client, f"{self.owner}/0")
+            return
+
+        # Worker threads are daemons: on Ctrl+C their leases simply expire
+        # and the jobs are reclaimed by the next runner
+        threads = [
+            threading.Thread(
+                target=self._work,
+                args=(client, f"{self.owner}/{index}"),
+                name=f"job-worker-{index}",
+                daemon=True,
+            )
+            for index in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # Long-running mode: keeps one warm client and store and waits for new jobs
+    # Also queues recurring jobs from the schedules table as they come due
+    # Wakes immediately on a ping through the wakeup socket or any commit seen
+    # through data_version; otherwise idle waits back off up to poll_interval
+    # Runs until stop is set (or Ctrl+C)
+    def serve(self, stop: Optional[threading.Event] = None):
+        stop = stop or threading.Event()
+        self.recover_stuck_jobs()
+        client = self.client_factory()
+        listener = WakeupListener.open(socket_path(self.store.db_path))
+
+        threads = [
+            threading.Thread(
+                target=self._serve_worker,
+                args=(client, f"{self.owner}/{index}", stop),
+                name=f"job-worker-{index}",
+                daemon=True,
+            )
+            for index in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        logger.info("Serving jobs with %d worker(s)", self.workers)
+
+        try:
+            idle = self.min_idle
+            last_version = self.store.data_version()
+            last_reclaim = time.monotonic()
+            while not stop.is_set():
+                # Recurring jobs are queued by whichever runner polls first
+                if self.enqueue_schedules():
+                    idle = self.min_idle
+
+                # Socket waits are capped so a stop request is noticed within a second
+                if listener is not None:
+                    pinged = listener.wait(min(idle, 1.0))
+                else:
+                    pinged = stop.wait(idle)
+
+                version = self.store.data_version()
+                if pinged or version != last_version:
+                    last_version = version
+                    idle = self.min_idle
+                    self._wake_workers()
+                else:
+                    idle = min(idle * 2, self.poll_interval)
+
+                # Picks up jobs left behind by runners that died
+                # and keeps the queue table small
+                if time.monotonic() - last_reclaim >= self.lease_seconds:
+                    last_reclaim = time.monotonic()
+                    if self.recover_stuck_jobs():
+                        self._wake_workers()
+                    self.compact_if_due()
+        except KeyboardInterrupt:
+            # Running jobs keep their lease until it expires, then get reclaimed
+            logger.warning("Serve interrupted by user (Ctrl+C)")
+            stop.set()
+            raise
+        else:
+            self._wake_workers()
+            for thread in threads:
+                thread.join()
+        finally:
+            stop.set()
+            if listener is not None:
+                listener.close()
+
+    # Wakes every idle serve worker
+    def _wake_workers(self):
+        with self._wakeup:
+            self._wakeups += 1
+            self._wakeup.notify_all()
 
-        # Initializes a client and runs metadata sync
-        client = GDriveClient()
+    # Serve worker loop: claim and run jobs, back off while the queue is empty
+    def _serve_worker(self, client, owner: str, stop: threading.Event):
+        idle = self.min_idle
+        while not stop.is_set():
+            seen = self._wakeups
+            job = self.store.claim_job(owner, self.lease_seconds, self.target_concurrency)
+            if job is not None:
+                self._run_job(client, job, owner)
+                idle = self.min_idle
+                continue
 
+            # Sleeps until woken or the backoff runs out; wakeups since the claim count
+            with self._wakeup:
+                woken = self._wakeup.wait_for(
+                    lambda: self._wakeups != seen or stop.is_set(), timeout=idle
+                )
+            idle = self.min_idle if woken else min(idle * 2, self.poll_interval)
+
+    # Worker loop: claim a job, run it, repeat until nothing is pending
+    # Jobs held back by their target's concurrency limit are waited for
+    def _work(self, client, owner: str):
+        idle = self.min_idle
         while True:
-            # Fetch up to 5 jobs
-            jobs = self.store.fetch_pending_jobs(limit=5)
+            job = self.store.claim_job(owner, self.lease_seconds, self.target_concurrency)
+
+            if job is None:
+                # No pending jobs left for this worker
+                if not self.store.fetch_pending_jobs(limit=1):
+                    logger.info("No pending jobs. Sleeping now.")
+                    return
+                # Pending jobs wait for their target's running jobs to finish
+                time.sleep(idle)
+                idle = min(idle * 2, self.poll_interval)
+                continue
+
+            idle = self.min_idle
+            self._run_job(client, job, owner)
+
+    # Executes one claimed job while a heartbeat keeps its lease alive
+    def _run_job(self, client, job, owner: str):
+        job_id = job["id"]
+        attempts = job["attempts"]
+        max_attempts = job["max_attempts"]
+
+        stop_heartbeat = threading.Event()
+        # Set by the heartbeat once the lease can't be kept; the sync stops
+        # before its next commit, so it never races a runner that reclaimed the job
+        lease_lost = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat,
+            args=(job_id, owner, stop_heartbeat, lease_lost),
+            name=f"job-heartbeat-{job_id}",
+            daemon=True,
+        )
+        heartbeat.start()
+
+        metrics = SyncMetrics()
+        quota = getattr(client, "quota", None)
+        quota_before = quota.snapshot() if quota is not None else {}
+        started = time.perf_counter()
+        status = "FAILED"
+
+        try:
+            self.execute(self._client_for(client, job), job, metrics, cancel=lease_lost)
+
+            # Marks job as done if successfully done
+            status = "DONE"
+            self.store.finish_job(job_id, owner, status)
+            logger.info("Completed Job: %s", job_id)
+
+        except KeyboardInterrupt:
+            logger.warning("Job %s interrupted by user (Ctrl+C)", job_id)
+            self.store.finish_job(job_id, owner, status, "Interrupted by user")
+            raise
+
+        except Exception as e:
+            # Handles errors during job execution
+            logger.error("Failed job: %s", job_id, exc_info=True)
+
+            # Mark job as dead if max attempts are reached
+            if attempts >= max_attempts:
+                status = "DEAD"
+                self.store.finish_job(job_id, owner, status, str(e))
+                logger.error("Job %s is now DEAD", job_id)
+            # Puts the job back in the queue, due after the retry backoff
+            else:
+                delay = self.retry_delay(attempts)
+                self.store.finish_job(job_id, owner, status, str(e), retry_after_seconds=delay)
+                logger.warning("Job %s FAILED, will retry in %.0fs", job_id, delay)
+
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+            if quota is not None:
+                self._count_api_events(metrics, quota_before, quota.snapshot())
+            self._record_run(job, owner, status, time.perf_counter() - started, metrics)
+
+    # Adds the client's retries and throttles during the job to its metrics
+    # With several workers sharing a client, concurrent jobs' requests are included too
+    @staticmethod
+    def _count_api_events(metrics: SyncMetrics, before, after):
+        for endpoint, counts in after.items():
+            for name in ("requests", "retries", "throttled", "server_errors"):
+                metrics.count(f"api_{name}", counts.get(name, 0) - before.get(endpoint, {}).get(name, 0))
+
+    # Persists the run's metrics and refreshes the export file
+    # Never fails the job: metrics are best effort
+    def _record_run(self, job, owner: str, status: str, seconds: float, metrics: SyncMetrics):
+        try:
+            self.store.record_job_run(job["id"], job["type"], owner, status, seconds, metrics.snapshot())
+            if self.metrics_export:
+                write_export(self.metrics_export, self.store)
+        except Exception:
+            logger.warning("Could not record metrics for job %s", job["id"], exc_info=True)
+
+    # Returns the client for a job: the runner's own, or one for the account
+    # whose token_file the job names
+    def _client_for(self, client, job):
+        token_file = self.store.job_payload(job).get("token_file")
+        if not token_file:
+            return client
+        with self._account_lock:
+            if token_file not in self._account_clients:
+                self._account_clients[token_file] = self.client_factory(token_file=token_file)
+            return self._account_clients[token_file]
 
-            # No pending jobs, begin sleep for poll_interval
-            if not jobs:
-                logger.info("No pending jobs. Sleeping now.")
+    # Renews the job's lease every third of its length until stopped
+    # A busy database (locked by a bulk load or vacuum) is retried often (every
+    # second at most) until the lease would run out; then, or when another runner has taken the
+    # job, lost is set and the job aborts before its next commit
+    def _heartbeat(self, job_id: int, owner: str, stop: threading.Event, lost: threading.Event):
+        expires = time.monotonic() + self.lease_seconds
+        interval = self.lease_seconds / 3
+        while not stop.wait(interval):
+            renewing = time.monotonic()
+            try:
+                renewed = self.store.renew_lease(job_id, owner, self.lease_seconds)
+            except sqlite3.OperationalError:
+                logger.warning("Could not renew lease on job %s, retrying", job_id, exc_info=True)
+                if time.monotonic() >= expires:
+                    logger.error("Lease on job %s ran out, aborting the job", job_id)
+                    lost.set()
+                    return
+                interval = min(1.0, self.lease_seconds / 10, max(0.0, expires - time.monotonic()))
+                continue
+            if not renewed:
+                logger.error("Lost lease on job %s, aborting the job", job_id)
+                lost.set()
                 return
+            expires = renewing + self.lease_seconds
+            interval = self.lease_seconds / 3
 
-            # Goes through each pending job
-            for job in jobs:
-                job_id = job["id"]
-                attempts = job["attempts"]
-                max_attempts = job["max_attempts"]
-
-                try:
-                    # Marks job as RUNNING
-                    # Increases attempts
-                    new_attempts = attempts + 1
-                    self.store.update_job(job_id, "RUNNING", new_attempts)
-                    # Executes job type
-                    # Not integrated client yet
-                    if job["type"] == "metadata_sync":
-                        sync = MetadataSyncEngine(client, self.store)
-                        sync.sync()
-                    else:
-                        # Flags error if job type isn't known
-                        raise ValueError(f"Error: Unknown job type {job['type']}")
-
-                    # Marks job as done if successfully done
-                    self.store.update_job(job_id, "DONE", new_attempts)
-                    logger.info("Completed Job: %s", job_id)
-                    
-                except KeyboardInterrupt:
-                    logger.warning("Job %s interrupted by user (Ctrl+C)", job_id)
-                    self.store.update_job(
-                        job_id,
-                        "FAILED",
-                        new_attempts,
-                        "Interrupted by user"
-                    )
-                    raise
-
-                except Exception as e:
-                    # Handles errors during job execution
-                    logger.error("Failed job: %s", job_id, exc_info=True)
-
-                    # Mark job as dead if max attempts are reached
-                    if attempts + 1 >= max_attempts:
-                        self.store.update_job(job_id, "DEAD", attempts + 1, str(e))
-                        logger.error("Job %s is now DEAD", job_id)
-                    # Marks job as failed and to be retried later
-                    else:
-                        self.store.update_job(job_id, "FAILED", attempts + 1, str(e))
-                        logger.warning("Job %s FAILED, will retry", job_id)
+    # Executes job type
+    # metrics collects stage timers and counters for the run
+    # cancel, when set, stops the sync before its next commit (SyncCancelled)
+    # The job's target scopes its rows and checkpoints; a drive_id in the
+    # payload lists that shared drive
+    def execute(self, client, job, metrics: Optional[SyncMetrics] = None, cancel: Optional[threading.Event] = None):
+        payload = self.store.job_payload(job)
+        scope = {"target": job["target"], "drive_id": payload.get("drive_id"), "metrics": metrics, "cancel": cancel}
+        if job["type"] == "metadata_sync":
+            sync = MetadataSyncEngine(client, self.store, adaptive_page_size=True, **scope)
+            sync.sync()
+        elif job["type"] == "incremental_sync":
+            sync = MetadataSyncEngine(client, self.store, adaptive_page_size=True, **scope)
+            sync.sync_incremental()
+        elif job["type"] == "sharded_sync":
+            sync = ShardedSyncEngine(client, self.store, adaptive_page_size=True, **scope)
+            sync.sync()
+        elif job["type"] == "refresh_files":
+            sync = MetadataSyncEngine(client, self.store, **scope)
+            sync.refresh(payload.get("file_ids", []))
+        else:
+            # Flags error if job type isn't known
+            raise ValueError(f"Error: Unknown job type {job['type']}")
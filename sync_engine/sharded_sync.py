@@ -0,0 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional
+from api_client.gdrive_client import GDriveClient
+from persistence.store import DEFAULT_TARGET, SQLiteStore
+from sync_engine.metadata_sync import CHECKPOINT_TOKEN, MetadataSyncEngine, SyncCancelled, scoped_key
+import logging
+
+# Marker stored for a shard that finished in the current pass
+SHARD_DONE = "done"
+logger = logging.getLogger(__name__)
+
+# One independent partition of the listing, expressed as a Drive query (q=)
+class Shard(NamedTuple):
+    name: str
+    query: str
+
+# Splits the listing into modifiedTime ranges
+# Boundaries are RFC 3339 timestamps in ascending order, ranges are half-open
+def modified_time_shards(boundaries: List[str]) -> List[Shard]:
+    shards = []
+    lower = None
+    for upper in boundaries + [None]:
+        clauses = []
+        if lower:
+            clauses.append(f"modifiedTime >= '{lower}'")
+        if upper:
+            clauses.append(f"modifiedTime < '{upper}'")
+        name = f"modified:{lower or 'min'}..{upper or 'max'}"
+        shards.append(Shard(name, " and ".join(clauses)))
+        lower = upper
+    return shards
+
+# Splits the listing into MIME type groups plus one shard for everything else
+def mime_type_shards(groups: Dict[str, List[str]]) -> List[Shard]:
+    shards = []
+    grouped = []
+    for name, mime_types in groups.items():
+        query = " or ".join(f"mimeType = '{mime_type}'" for mime_type in mime_types)
+        shards.append(Shard(f"mime:{name}", f"({query})"))
+        grouped.extend(mime_types)
+    other = " and ".join(f"mimeType != '{mime_type}'" for mime_type in grouped)
+    shards.append(Shard("mime:other", other))
+    return shards
+
+# Default partition: one shard per modification year since 2014
+def default_shards() -> List[Shard]:
+    this_year = datetime.now(timezone.utc).year
+    boundaries = [f"{year}-01-01T00:00:00" for year in range(2014, this_year + 1)]
+    return modified_time_shards(boundaries)
+
+class ShardedSyncEngine:
+    # Lists one drive as several independent shards, each on its own worker
+    # Each shard checkpoints under its own key, so a crash only repeats unfinished shards
+
+    def __init__(
+        self,
+        client: GDriveClient,
+        store: SQLiteStore,
+        shards: Optional[List[Shard]] = None,
+        workers: int = 4,
+        target: str = DEFAULT_TARGET,
+        drive_id: Optional[str] = None,
+        **engine_options,
+    ):
+        self.client = client
+        self.store = store
+        self.shards = shards if shards is not None else default_shards()
+        self.workers = max(1, workers)
+        # Sync target and shared drive, as for MetadataSyncEngine
+        self.target = target
+        self.drive_id = drive_id
+        # Passed through to each shard's MetadataSyncEngine (page_size, commit_pages, ...)
+        self.engine_options = engine_options
+
+    # Checkpoint key holding a shard's page token in a target
+    @staticmethod
+    def shard_key(shard: Shard, target: str = DEFAULT_TARGET) -> str:
+        return scoped_key(f"{CHECKPOINT_TOKEN}:shard:{shard.name}", target)
+
+    # Key marking a shard as finished in the current pass
+    @classmethod
+    def done_key(cls, shard: Shard, target: str = DEFAULT_TARGET) -> str:
+        return f"{cls.shard_key(shard, target)}:done"
+
+    # Key recording the generation of the current sharded pass
+    @staticmethod
+    def generation_key(target: str = DEFAULT_TARGET) -> str:
+        return scoped_key(f"{CHECKPOINT_TOKEN}:sharded:generation", target)
+
+    # Runs every unfinished shard concurrently; completes when all shards have
+    # Re-raises the first shard error after the other shards have stopped
+    def sync(self) -> None:
+        pending = [
+            shard for shard in self.shards
+            if self.store.get_checkpoint(self.done_key(shard, self.target)) != SHARD_DONE
+        ]
+        # The pass is resumed if any shard finished or checkpointed before
+        resume = len(pending) < len(self.shards) or any(
+            self.store.get_checkpoint(self.shard_key(shard, self.target)) for shard in pending
+        )
+        generation = self.store.begin_generation(self.generation_key(self.target), resume=resume)
+        logger.info(
+            "Sharded sync: %d of %d shard(s) to run on %d worker(s)",
+            len(pending),
+            len(self.shards),
+            self.workers,
+        )
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="shard") as pool:
+            futures = [(shard, pool.submit(self._sync_shard, shard, generation)) for shard in pending]
+            for shard, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error("Shard %s failed", shard.name, exc_info=True)
+                    errors.append(e)
+
+        if errors:
+            raise errors[0]
+
+        # A cancelled job (lost lease) must not sweep a pass another runner owns
+        cancel = self.engine_options.get("cancel")
+        if cancel is not None and cancel.is_set():
+            raise SyncCancelled("Sharded sync cancelled before the sweep")
+
+        # Every shard finished: rows no shard saw are gone from Drive
+        # A resumed pass with no recorded generation can't tell them apart
+        deleted = 0
+        if generation is not None:
+            deleted = self.store.sweep_generation(generation, self.target)
+        else:
+            logger.warning("Resumed sharded pass has no recorded generation, skipping the sweep")
+
+        # The next sync starts a fresh pass
+        with self.store.transaction():
+            for shard in self.shards:
+                self.store.clear_checkpoint(self.done_key(shard, self.target))
+            self.store.clear_checkpoint(self.generation_key(self.target))
+        logger.info("Sharded sync complete (shards=%d, deleted=%d)", len(self.shards), deleted)
+
+    # Syncs one shard and marks it finished
+    def _sync_shard(self, shard: Shard, generation: Optional[int]) -> None:
+        engine = MetadataSyncEngine(
+            self.client,
+            self.store,
+            checkpoint_key=self.shard_key(shard, self.target),
+            query=shard.query,
+            target=self.target,
+            drive_id=self.drive_id,
+            pass_generation=generation,
+            **self.engine_options,
+        )
+        engine.sync()
+        self.store.set_checkpoint(self.done_key(shard, self.target), SHARD_DONE)
+        logger.info("Shard %s complete", shard.name)
@@ -0,0 +1,136 @@
+import gzip
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Tuple
+from persistence.store import DEFAULT_TARGET, GENERATION_KEY, SCHEMA_VERSION, SQLiteStore
+from sync_engine.metadata_sync import CHANGES_TOKEN
+
+# Snapshots of the file mirror, for bootstrapping a new node without a full listing
+# A snapshot is gzipped NDJSON: a header line (format, columns, checkpoints),
+# one JSON array per files row, and a trailer with the row count and the
+# SHA-256 of every line before it. Rows and checkpoints are read in one
+# transaction, so the changes tokens match the rows exactly and an incremental
+# sync on the new node picks up from there
+
+SNAPSHOT_FORMAT = "gdrive-sync-snapshot"
+SNAPSHOT_VERSION = 1
+# Fast gzip level, as for exports: snapshots are written and read at disk speed
+GZIP_LEVEL = 1
+_encode_json = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+# json.loads on bytes sniffs the encoding of every line; lines are always UTF-8
+_decode_json = json.JSONDecoder().decode
+
+# Raised for a truncated, corrupted or unsupported snapshot file
+class SnapshotError(Exception):
+    pass
+
+# Checkpoints that carry over: each target's changes token and the generation
+# counter. Page tokens of an unfinished listing don't, the new node would
+# only resume a listing it never started
+def _carried_state(state: Dict[str, str]) -> Dict[str, str]:
+    return {
+        key: value for key, value in state.items()
+        if key == GENERATION_KEY or key == CHANGES_TOKEN or key.endswith(f":{CHANGES_TOKEN}")
+    }
+
+# Targets with a changes token in state, so an incremental sync can resume them
+def snapshot_targets(state: Dict[str, str]) -> List[str]:
+    targets = []
+    for key in state:
+        if key == CHANGES_TOKEN:
+            targets.append(DEFAULT_TARGET)
+        elif key.endswith(f":{CHANGES_TOKEN}"):
+            # Scoped keys read "target:<name>:<key>"
+            targets.append(key[len("target:"):-len(f":{CHANGES_TOKEN}")])
+    return sorted(targets)
+
+# Writes a snapshot of store to path (written to a temporary name, then moved into place)
+# Returns the header plus the row count
+def write_snapshot(store: SQLiteStore, path: str) -> Dict:
+    path = str(path)
+    tmp_path = f"{path}.tmp"
+    digest = hashlib.sha256()
+    count = 0
+    try:
+        with store.snapshot() as (state, rows), gzip.open(tmp_path, "wb", compresslevel=GZIP_LEVEL) as out:
+            header = {
+                "format": SNAPSHOT_FORMAT,
+                "version": SNAPSHOT_VERSION,
+                "schema_version": SCHEMA_VERSION,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "columns": [column[0] for column in rows.description],
+                "state": _carried_state(state),
+            }
+            line = (_encode_json(header) + "\n").encode()
+            digest.update(line)
+            out.write(line)
+            while True:
+                batch = rows.fetchmany(5000)
+                if not batch:
+                    break
+                data = "".join(_encode_json(row) + "\n" for row in batch).encode()
+                digest.update(data)
+                out.write(data)
+                count += len(batch)
+            out.write((_encode_json({"rows": count, "sha256": digest.hexdigest()}) + "\n").encode())
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return {**header, "rows": count}
+
+# Opens a snapshot and checks its header
+# Yields (header, rows): rows yields each row as a list and verifies the
+# checksum and row count after the last one, so a loader that inserts rows as
+# they come must only commit once rows is exhausted
+@contextmanager
+def _open_snapshot(path: str) -> Iterator[Tuple[Dict, Iterator[List]]]:
+    with gzip.open(path, "rb") as f:
+        try:
+            first = f.readline()
+            header = json.loads(first)
+        except (ValueError, EOFError, OSError) as e:
+            raise SnapshotError(f"Error: {path} is not a snapshot file") from e
+        if not isinstance(header, dict) or header.get("format") != SNAPSHOT_FORMAT or header.get("version") != SNAPSHOT_VERSION:
+            raise SnapshotError(f"Error: Unsupported snapshot format in {path}")
+        yield header, _read_rows(f, path, first)
+
+# Reads the rows after the header line first, hashing each line as it goes
+def _read_rows(f, path: str, first: bytes) -> Iterator[List]:
+    digest = hashlib.sha256(first)
+    count = 0
+    trailer = None
+    try:
+        for line in f:
+            if trailer is not None:
+                raise SnapshotError(f"Error: Data after the trailer of snapshot {path}")
+            # Rows are arrays, the trailer is the only object after the header
+            if line.startswith(b"{"):
+                trailer = json.loads(line)
+                continue
+            digest.update(line)
+            count += 1
+            yield _decode_json(line.decode())
+    except (ValueError, EOFError, OSError) as e:
+        raise SnapshotError(f"Error: Snapshot {path} is corrupted") from e
+    if trailer is None:
+        raise SnapshotError(f"Error: Snapshot {path} is truncated")
+    if trailer.get("rows") != count or trailer.get("sha256") != digest.hexdigest():
+        raise SnapshotError(f"Error: Snapshot {path} failed its checksum")
+
+# Loads a snapshot into a store with an empty mirror, rows and checkpoints in
+# one transaction: the next incremental sync of each target continues from the
+# snapshot's changes token. Nothing is kept unless the whole file verifies
+# Returns the header plus the row count
+def load_snapshot(store: SQLiteStore, path: str) -> Dict:
+    with _open_snapshot(str(path)) as (header, rows):
+        state = dict(header.get("state") or {})
+        # Generations only ever grow, whichever side is further along
+        generation = max(int(state.get(GENERATION_KEY) or 0), int(store.get_checkpoint(GENERATION_KEY) or 0))
+        state[GENERATION_KEY] = str(generation)
+        count = store.load_files(header["columns"], rows, state)
+    return {**header, "rows": count}
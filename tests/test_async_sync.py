@@ -0,0 +1,171 @@
+import asyncio
+import json
+import pytest
+from api_client.async_client import AsyncGDriveClient, DriveHTTPError
+from api_client.gdrive_client import listing_query
+from api_client.rate_limit import RetryPolicy
+from persistence.store import SQLiteStore
+from sync_engine.async_sync import AsyncMetadataSyncEngine
+from sync_engine.metadata_sync import MetadataSyncEngine
+from sync_engine.sharded_sync import Shard, ShardedSyncEngine
+
+# A local fake of the Drive REST API used as an AsyncGDriveClient transport
+# Serves a page chain per search expression (q) and tracks how many requests are in flight
+class FakeTransport:
+    def __init__(self, pages_by_query, known_ids=(), throttle_first=0, fail_page=None):
+        self.pages_by_query = pages_by_query
+        self.known_ids = set(known_ids)
+        self.throttle_first = throttle_first
+        # Listing page index answered with a non-retryable error
+        self.fail_page = fail_page
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def __call__(self, method, url, params):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if self.throttle_first:
+                self.throttle_first -= 1
+                return 429, {"retry-after": "0"}, b""
+            if url.endswith("/files"):
+                pages = self.pages_by_query[params.get("q")]
+                index = int(params.get("pageToken", 0))
+                if index == self.fail_page:
+                    return 400, {}, b""
+                body = {"files": pages[index]}
+                if index + 1 < len(pages):
+                    body["nextPageToken"] = str(index + 1)
+                return 200, {}, json.dumps(body).encode()
+            file_id = url.rsplit("/", 1)[1]
+            if file_id not in self.known_ids:
+                return 404, {}, b""
+            return 200, {}, json.dumps(
+                {"id": file_id, "name": "N", "mimeType": "text/plain", "modifiedTime": "t2"}
+            ).encode()
+        finally:
+            self.in_flight -= 1
+
+# Builds pages of single files with IDs unique to the shard
+def shard_pages(prefix, count):
+    return [
+        [{"id": f"{prefix}{i}", "name": "A", "mimeType": "text/plain", "modifiedTime": "t1"}]
+        for i in range(count)
+    ]
+
+# Tests that shards make progress concurrently under the client's concurrency bound
+def test_async_shards_run_concurrently(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    shards = [Shard(str(i), f"q{i}") for i in range(8)]
+    transport = FakeTransport({listing_query(f"q{i}"): shard_pages(f"s{i}-", 3) for i in range(8)})
+    client = AsyncGDriveClient(transport, max_concurrency=4)
+    engine = AsyncMetadataSyncEngine(client, store)
+
+    asyncio.run(engine.sync_shards(shards))
+    engine.close()
+
+    assert store.get_file_count() == 24
+    assert 1 < transport.peak_in_flight <= 4
+    assert all(store.get_checkpoint(ShardedSyncEngine.done_key(s)) is None for s in shards)
+
+# Tests that throttled requests are retried by the async client
+def test_async_sync_retries_throttling(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    transport = FakeTransport({listing_query(): shard_pages("f", 2)}, throttle_first=2)
+    client = AsyncGDriveClient(transport, retry_policy=RetryPolicy(base_delay=0.001))
+    engine = AsyncMetadataSyncEngine(client, store)
+
+    asyncio.run(engine.sync())
+    engine.close()
+
+    assert store.get_file_count() == 2
+    assert client.quota.snapshot()["files.list"]["retries"] == 2
+
+# Tests that async refresh upserts found IDs and removes missing ones
+def test_async_refresh(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    store.insert_update_files(shard_pages("f", 3)[0] + shard_pages("f", 3)[1])
+    transport = FakeTransport({}, known_ids={"f0", "new"})
+    engine = AsyncMetadataSyncEngine(AsyncGDriveClient(transport), store)
+
+    asyncio.run(engine.refresh(["f0", "f1", "new"], chunk_size=2))
+    engine.close()
+
+    with store._conn() as conn:
+        rows = {r["id"]: r["name"] for r in conn.execute("SELECT id, name FROM files WHERE deleted_at IS NULL")}
+    assert rows == {"f0": "N", "new": "N"}
+
+# A threaded client serving the same page chain as FakeTransport, crashing on fail_page
+class FakeClient:
+    def __init__(self, pages, fail_page=None):
+        self.pages = pages
+        self.fail_page = fail_page
+
+    def list_files(self, page_size=100, page_token=None):
+        index = int(page_token or 0)
+        if index == self.fail_page:
+            raise RuntimeError("Simulated crash")
+        next_token = str(index + 1) if index + 1 < len(self.pages) else None
+        return self.pages[index], next_token
+
+def live_ids(store):
+    with store._conn() as conn:
+        return {r["id"] for r in conn.execute("SELECT id FROM files WHERE deleted_at IS NULL")}
+
+# Tests that the async engine resumes a threaded full listing in the same generation,
+# so its sweep removes only the file gone from Drive
+def test_async_sync_resumes_threaded_pass(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    pages = shard_pages("f", 3)
+    MetadataSyncEngine(FakeClient(pages + shard_pages("gone", 1)), store).sync()
+
+    with pytest.raises(RuntimeError):
+        MetadataSyncEngine(FakeClient(pages, fail_page=1), store).sync()
+    engine = AsyncMetadataSyncEngine(AsyncGDriveClient(FakeTransport({listing_query(): pages})), store)
+    asyncio.run(engine.sync())
+    engine.close()
+
+    assert live_ids(store) == {"f0", "f1", "f2"}
+
+# Tests that the threaded engine resumes an async full listing in the same generation
+def test_threaded_sync_resumes_async_pass(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    pages = shard_pages("f", 3)
+    transport = FakeTransport({listing_query(): pages + shard_pages("gone", 1)})
+    engine = AsyncMetadataSyncEngine(AsyncGDriveClient(transport), store)
+    asyncio.run(engine.sync())
+
+    transport.pages_by_query[listing_query()] = pages
+    transport.fail_page = 1
+    with pytest.raises(DriveHTTPError):
+        asyncio.run(engine.sync())
+    engine.close()
+    MetadataSyncEngine(FakeClient(pages), store).sync()
+
+    assert live_ids(store) == {"f0", "f1", "f2"}
+
+# Tests that an async sharded pass resumed by ShardedSyncEngine sweeps only the vanished file
+def test_sharded_sync_resumes_async_shards(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    shards = [Shard("a", "qa"), Shard("b", "qb")]
+    transport = FakeTransport({
+        listing_query("qa"): shard_pages("a", 2),
+        listing_query("qb"): shard_pages("b", 2) + shard_pages("gone", 1),
+    })
+    engine = AsyncMetadataSyncEngine(AsyncGDriveClient(transport), store)
+    asyncio.run(engine.sync_shards(shards))
+
+    transport.pages_by_query[listing_query("qb")] = shard_pages("b", 2)
+    transport.fail_page = 1
+    with pytest.raises(DriveHTTPError):
+        asyncio.run(engine.sync_shards(shards))
+    engine.close()
+
+    # Threaded shards key their pages by query
+    class ShardClient:
+        def list_files(self, page_size=100, page_token=None, query=None):
+            return FakeClient(transport.pages_by_query[listing_query(query)]).list_files(page_size, page_token)
+
+    ShardedSyncEngine(ShardClient(), store, shards).sync()
+    assert live_ids(store) == {"a0", "a1", "b0", "b1"}
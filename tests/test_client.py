@@ -1,6 +1,180 @@
-from api_client.gdrive_client import GDriveClient
+import datetime
+import json
+import httplib2
+import pytest
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+from api_client.gdrive_client import AuthorizationRequired, GDriveClient, RetryableAPIError
+from api_client.rate_limit import RetryPolicy, TokenBucket, parse_retry_after
 
 def test_list_files():
     client = GDriveClient()
     files, token = client.list_files(page_size=5)
     assert isinstance(files, list)
+
+# Builds an HttpError the way googleapiclient raises it
+def make_http_error(status, retry_after=None, content=b"{}"):
+    headers = {"status": status}
+    if retry_after is not None:
+        headers["retry-after"] = retry_after
+    return HttpError(httplib2.Response(headers), content)
+
+# A fake Drive service whose files().list() raises queued errors before succeeding
+class ErroringService:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.executions = 0
+
+    def files(self):
+        return self
+
+    def list(self, **kwargs):
+        return self
+
+    def execute(self):
+        self.executions += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"files": [{"id": "1"}], "nextPageToken": None}
+
+# Tests that throttled requests are retried in the client, honoring Retry-After
+def test_list_files_retries_with_backoff():
+    sleeps = []
+    policy = RetryPolicy(sleep=sleeps.append, jitter=lambda: 1.0)
+    service = ErroringService([make_http_error(429, retry_after="7"), make_http_error(503)])
+    client = GDriveClient(service=service, retry_policy=policy)
+
+    files, token = client.list_files()
+
+    assert files == [{"id": "1"}]
+    # Retry-After wins over the first 1s backoff, then 2s backoff
+    assert sleeps == [7.0, 2.0]
+    stats = client.quota.snapshot()["files.list"]
+    assert stats == {"requests": 3, "throttled": 1, "server_errors": 1, "retries": 2}
+
+# Tests that retries stop after max_retries and non-retryable errors pass through
+def test_list_files_gives_up_and_passes_fatal_errors():
+    policy = RetryPolicy(max_retries=2, sleep=lambda s: None)
+    client = GDriveClient(service=ErroringService([make_http_error(500)] * 3), retry_policy=policy)
+    with pytest.raises(RetryableAPIError):
+        client.list_files()
+
+    client = GDriveClient(service=ErroringService([make_http_error(403)]), retry_policy=policy)
+    with pytest.raises(HttpError):
+        client.list_files()
+
+# Tests that the token bucket allows a burst, then spaces requests at its rate
+def test_token_bucket_limits_rate():
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    bucket = TokenBucket(rate=2.0, capacity=2.0, clock=lambda: now[0], sleep=sleep)
+    for _ in range(4):
+        bucket.acquire()
+    assert sleeps == [0.5, 0.5]
+
+# Tests Retry-After parsing for seconds and garbage values
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+
+# A fake Drive service supporting batched files().get calls
+# Files listed in throttle_once answer 429 the first time they're requested,
+# files listed in forbidden always answer 403
+class BatchService:
+    def __init__(self, known, throttle_once=(), forbidden=()):
+        self.known = known
+        self.throttle_once = set(throttle_once)
+        self.forbidden = set(forbidden)
+        self.batch_sizes = []
+
+    def files(self):
+        return self
+
+    def get(self, fileId, fields):
+        return fileId
+
+    def new_batch_http_request(self, callback):
+        service = self
+
+        class Batch:
+            def __init__(self):
+                self.calls = []
+
+            def add(self, request, request_id):
+                self.calls.append(request_id)
+
+            def execute(self):
+                service.batch_sizes.append(len(self.calls))
+                for file_id in self.calls:
+                    if file_id in service.throttle_once:
+                        service.throttle_once.discard(file_id)
+                        callback(file_id, None, make_http_error(429))
+                    elif file_id in service.forbidden:
+                        callback(file_id, None, make_http_error(403))
+                    elif file_id in service.known:
+                        callback(file_id, {"id": file_id, "name": file_id}, None)
+                    else:
+                        callback(file_id, None, make_http_error(404))
+
+        return Batch()
+
+# Tests that IDs are packed into batches and throttled calls are retried
+def test_get_files_batch():
+    service = BatchService(known={f"f{i}" for i in range(150)}, throttle_once={"f3"})
+    policy = RetryPolicy(sleep=lambda s: None)
+    client = GDriveClient(service=service, retry_policy=policy)
+
+    files, missing = client.get_files_batch([f"f{i}" for i in range(150)] + ["gone"])
+
+    assert sorted(f["id"] for f in files) == sorted(f"f{i}" for i in range(150))
+    assert missing == ["gone"]
+    # Two full batches plus one retry batch for the throttled call
+    assert service.batch_sizes == [100, 1, 51]
+
+# Tests that a file refused with 403 is reported missing rather than failing the whole batch
+def test_get_files_batch_treats_forbidden_as_missing():
+    service = BatchService(known={"a", "b"}, forbidden={"locked"})
+    client = GDriveClient(service=service, retry_policy=RetryPolicy(sleep=lambda s: None))
+
+    files, missing = client.get_files_batch(["a", "locked", "b"])
+
+    assert sorted(f["id"] for f in files) == ["a", "b"]
+    assert missing == ["locked"]
+    assert service.batch_sizes == [3]
+
+# Writes an authorized-user token file expiring at expiry
+def write_token(path, expiry):
+    path.write_text(json.dumps({
+        "token": "access", "refresh_token": "refresh", "client_id": "id", "client_secret": "secret",
+        "expiry": expiry.strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }))
+
+# Tests that a saved token is used as-is, and an expired one is refreshed and saved back,
+# without the consent flow (the credentials file doesn't exist)
+def test_authenticate_uses_saved_token(tmp_path, monkeypatch):
+    token_file = tmp_path / "token.json"
+    now = datetime.datetime.utcnow()
+    write_token(token_file, now + datetime.timedelta(hours=1))
+    client = GDriveClient(credentials_file=str(tmp_path / "missing.json"), token_file=str(token_file))
+    assert client.creds.token == "access"
+
+    def refresh(creds, request):
+        creds.token = "renewed"
+        creds.expiry = now + datetime.timedelta(hours=1)
+
+    monkeypatch.setattr(Credentials, "refresh", refresh)
+    write_token(token_file, now - datetime.timedelta(hours=1))
+    client = GDriveClient(credentials_file=str(tmp_path / "missing.json"), token_file=str(token_file))
+    assert client.creds.token == "renewed"
+    assert json.loads(token_file.read_text())["token"] == "renewed"
+
+# Tests that a non-interactive client (serve) refuses to prompt for a missing token
+def test_authenticate_without_token_is_not_interactive(tmp_path):
+    with pytest.raises(AuthorizationRequired):
+        GDriveClient(token_file=str(tmp_path / "token.json"), interactive=False)
@@ -0,0 +1,39 @@
+import csv
+import gzip
+import json
+from persistence.store import SQLiteStore
+from sync_engine.export import EXPORT_COLUMNS, export_files
+
+def make_store(tmp_path, count):
+    store = SQLiteStore(tmp_path / "test.db")
+    store.insert_update_files([
+        {"id": f"f{i:04d}", "name": f"Näme, {i}", "mimeType": "text/plain", "modifiedTime": f"t{i:04d}", "size": str(i)}
+        for i in range(count)
+    ])
+    return store
+
+# Tests NDJSON and gzipped CSV exports, and continuing an export from its cursor
+def test_export_formats_and_cursor(tmp_path):
+    store = make_store(tmp_path, 2500)
+
+    count, cursor = export_files(store, tmp_path / "files.ndjson", batch_size=700)
+    assert count == 2500
+    with open(tmp_path / "files.ndjson", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    assert [row["id"] for row in rows] == [f"f{i:04d}" for i in range(2500)]
+    assert rows[1] == {"target": "", "id": "f0001", "name": "Näme, 1", "mime_type": "text/plain",
+                       "modified_time": "t0001", "parent_id": None, "size": 1, "path": "/Näme, 1"}
+
+    count, _ = export_files(store, tmp_path / "files.csv.gz", format="csv", modified_since="t2000")
+    with gzip.open(tmp_path / "files.csv.gz", "rt", encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    assert tuple(rows[0]) == EXPORT_COLUMNS
+    assert count == len(rows) - 1 == 500
+    assert rows[1][2] == "Näme, 2000"
+
+    # Only rows written after the first export's last row
+    store.insert_update_files([{"id": "f9999", "name": "new", "mimeType": "text/plain", "modifiedTime": "t9999"}])
+    count, next_cursor = export_files(store, tmp_path / "more.ndjson", cursor=cursor)
+    assert count == 1
+    assert export_files(store, tmp_path / "none.ndjson", cursor=next_cursor) == (0, None)
+    assert not (tmp_path / "none.ndjson.tmp").exists()
@@ -0,0 +1,61 @@
+import asyncio
+from api_client.async_client import AsyncGDriveClient
+from api_client.gdrive_client import GDriveClient
+from api_client.rate_limit import RetryPolicy
+from benchmarks.fake_drive import FakeDriveService
+from persistence.store import SQLiteStore
+from sync_engine.async_sync import AsyncMetadataSyncEngine
+from sync_engine.metadata_sync import MetadataSyncEngine
+
+# Retries without waiting
+def fast_retries():
+    return RetryPolicy(max_retries=20, sleep=lambda seconds: None)
+
+def stored_ids(store):
+    with store._conn() as conn:
+        return sorted(row["id"] for row in conn.execute("SELECT id FROM files WHERE deleted_at IS NULL"))
+
+# Full then incremental sync through the real client, with injected 429/503s
+# The store should match the fake drive after each pass
+def test_sync_against_fake_drive_with_faults(tmp_path):
+    service = FakeDriveService(file_count=2500, error_rate=0.2, seed=1)
+    client = GDriveClient(service=service, retry_policy=fast_retries())
+    store = SQLiteStore(db_path=tmp_path / "test.db")
+    engine = MetadataSyncEngine(client, store, page_size=100)
+
+    engine.sync_incremental()
+    assert stored_ids(store) == service.live_ids()
+    assert service.injected_errors > 0
+    # Every injected error was retried
+    retries = sum(counts.get("retries", 0) for counts in client.quota.snapshot().values())
+    assert retries == service.injected_errors
+
+    service.mutate(modify=50, delete=30, add=20)
+    engine.sync_incremental()
+    assert stored_ids(store) == service.live_ids()
+
+    # Renamed files carry their new names
+    with store._conn() as conn:
+        renamed = conn.execute("SELECT COUNT(*) FROM files WHERE name LIKE '%-v%'").fetchone()[0]
+    assert renamed == 50
+
+# Batched gets report deleted files as missing
+def test_fake_drive_batch_gets(tmp_path):
+    service = FakeDriveService(file_count=10)
+    client = GDriveClient(service=service)
+    service.mutate(delete=2)
+    files, missing = client.get_files_batch([service.file_id(i) for i in range(10)])
+    assert len(files) == 8
+    assert len(missing) == 2
+
+# The async transport serves the same dataset
+def test_fake_drive_async_transport(tmp_path):
+    service = FakeDriveService(file_count=450, error_rate=0.1, seed=2)
+    client = AsyncGDriveClient(service.as_transport(), retry_policy=RetryPolicy(max_retries=20, base_delay=0))
+    store = SQLiteStore(db_path=tmp_path / "test.db")
+    engine = AsyncMetadataSyncEngine(client, store, page_size=100)
+    try:
+        asyncio.run(engine.sync())
+    finally:
+        engine.close()
+    assert stored_ids(store) == service.live_ids()
@@ -0,0 +1,87 @@
+from persistence.file_cache import BloomFilter, FileCache
+from persistence.store import SQLiteStore
+
+def make_file(file_id, modified="t1", **extra):
+    return {"id": file_id, "name": f"File {file_id}", "mimeType": "text/plain", "modifiedTime": modified, **extra}
+
+# Tests per-ID lookups of live files within a target
+def test_get_file_and_get_files(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    store.insert_update_files([make_file("a", size="3"), make_file("b"), make_file("c")])
+    store.insert_update_files([make_file("a", modified="t9")], target="team")
+    store.delete_files(["c"])
+
+    assert dict(store.get_file("a")) == {
+        "target": "", "id": "a", "name": "File a", "mime_type": "text/plain",
+        "modified_time": "t1", "parent_id": None, "size": 3,
+    }
+    assert store.get_file("a", target="team")["modified_time"] == "t9"
+    assert store.get_file("c") is None
+    assert sorted(store.get_files(["a", "b", "c", "zzz"])) == ["a", "b"]
+    assert store.get_files([]) == {}
+
+# Tests that the filter never misses an added item and stays near its false positive rate
+def test_bloom_filter_rates():
+    bloom = BloomFilter(10000, 0.01)
+    for i in range(10000):
+        bloom.add(("", f"file-{i}"))
+    assert all(("", f"file-{i}") in bloom for i in range(10000))
+    false_positives = sum(("", f"other-{i}") in bloom for i in range(10000))
+    assert false_positives < 300
+
+# Tests cache hits, filter negatives and invalidation by upserts and deletes
+def test_file_cache_follows_writes(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    store.insert_update_files([make_file(f"f{i}") for i in range(100)])
+    cache = FileCache(store, capacity=10)
+
+    assert cache.get_file("f1")["modified_time"] == "t1"
+    assert cache.get_file("f1")["modified_time"] == "t1"
+    assert cache.get_file("unknown") is None
+    assert sorted(cache.get_files(["f1", "f2", "unknown"])) == ["f1", "f2"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["bloom_negatives"]) == (2, 2, 2)
+
+    # Writes through the store are seen by the next lookup
+    store.insert_update_files([make_file("f1", modified="t2"), make_file("new")])
+    store.delete_files(["f2"])
+    assert cache.get_file("f1")["modified_time"] == "t2"
+    assert cache.get_file("new")["name"] == "File new"
+    assert cache.get_file("f2") is None
+    assert cache.stats()["invalidations"] == 2
+
+    # The LRU stays within capacity
+    cache.get_files([f"f{i}" for i in range(50)])
+    assert cache.stats()["entries"] == 10
+
+# Tests that writes from another connection (another process) are picked up through data_version
+def test_file_cache_sees_other_connections(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    store.insert_update_files([make_file("a")])
+    cache = FileCache(store, max_staleness=0)
+    assert cache.get_file("a")["modified_time"] == "t1"
+    assert cache.get_file("b") is None
+
+    commits = store.commits
+    other = SQLiteStore(tmp_path / "test.db")
+    other.insert_update_files([make_file("a", modified="t2"), make_file("b")])
+    assert store.commits == commits
+    assert cache.get_file("a")["modified_time"] == "t2"
+    assert cache.get_file("b") is not None
+
+# Tests that only inserted files are added to the filter, so updates never force a rebuild
+def test_file_cache_filter_counts_inserts_only(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    store.insert_update_files([make_file(f"f{i}") for i in range(100)])
+    cache = FileCache(store)
+    assert cache._bloom.items == 100
+    bloom = cache._bloom
+
+    for version in range(5):
+        store.insert_update_files([make_file(f"f{i}", modified=f"v{version}") for i in range(100)])
+        assert cache.get_file("f1")["modified_time"] == f"v{version}"
+    store.insert_update_files([make_file("new")])
+    assert cache.get_file("new") is not None
+
+    assert cache._bloom is bloom
+    assert bloom.items == 101
@@ -1,6 +1,7 @@
 import tempfile
 from persistence.store import SQLiteStore
-from sync_engine.metadata_sync import MetadataSyncEngine
+from api_client.gdrive_client import PageTokenExpired, listing_query
+from sync_engine.metadata_sync import MetadataSyncEngine, CHECKPOINT_TOKEN, CHANGES_TOKEN
 
 # A fake Google Drive client used for testing
 class FakeGDriveClient:
@@ -88,4 +89,300 @@ def test_metadata_sync_resumes_after_failure(tmp_path):
     # Tries fetching from page 1
     engine.sync()
     assert store.get_file_count() == 2
-    
\ No newline at end of file
+    
+# Builds pages of one file each for group commit tests
+def make_pages(count):
+    return [
+        [{"id": str(i), "name": f"F{i}", "mimeType": "text/plain", "modifiedTime": "t1"}]
+        for i in range(count)
+    ]
+
+# Tests that group commit writes several pages per transaction
+def test_group_commit_coalesces_pages(tmp_path):
+    # Counts commits for one sync of 10 pages on a fresh store
+    def commits_for(name, commit_pages):
+        store = SQLiteStore(db_path=tmp_path / name)
+        engine = MetadataSyncEngine(FakeGDriveClient(make_pages(10)), store, commit_pages=commit_pages)
+        commits_before = store.commits
+        engine.sync()
+        assert store.get_file_count() == 10
+        assert store.get_checkpoint(CHECKPOINT_TOKEN) is None
+        return store.commits - commits_before
+
+    # 10 pages one at a time vs in groups of 4 (3 commits): 7 fewer commits
+    assert commits_for("single.db", 1) - commits_for("grouped.db", 4) == 7
+
+# Tests that a crash mid-group leaves the checkpoint at the last committed page
+def test_group_commit_checkpoint_only_covers_committed_pages(tmp_path):
+    store = SQLiteStore(db_path=tmp_path / "test.db")
+    client = FakeGDriveClient(make_pages(6), fail_after_pages=5)
+    engine = MetadataSyncEngine(client, store, commit_pages=3)
+
+    try:
+        engine.sync()
+    except RuntimeError:
+        pass
+
+    # First group of 3 committed, pages 4-5 rolled back with their checkpoint
+    assert store.get_file_count() == 3
+    assert store.get_checkpoint(CHECKPOINT_TOKEN) == "3"
+
+    client.fail_after_pages = None
+    engine.sync()
+    assert store.get_file_count() == 6
+
+# A fake changes feed on top of the fake listing
+# Change tokens are positions in the change log, "expired" tokens are rejected
+class FakeChangesClient(FakeGDriveClient):
+    def __init__(self, pages, change_page_size=2):
+        super().__init__(pages)
+        self.change_log = []
+        self.change_page_size = change_page_size
+        self.expired = set()
+
+    def get_start_page_token(self):
+        return f"c{len(self.change_log)}"
+
+    def list_changes(self, page_token, page_size=100):
+        if page_token in self.expired:
+            raise PageTokenExpired("expired")
+        start = int(page_token[1:])
+        end = min(start + self.change_page_size, len(self.change_log))
+        changes = self.change_log[start:end]
+        if end < len(self.change_log):
+            return changes, f"c{end}", None
+        return changes, None, f"c{end}"
+
+# Tests that incremental sync lists once, then applies adds, edits and removals
+def test_incremental_sync_applies_changes(tmp_path):
+    store = SQLiteStore(db_path=tmp_path / "test.db")
+    client = FakeChangesClient(make_pages(3))
+    engine = MetadataSyncEngine(client, store)
+
+    # First run has no token, so it does a full listing
+    engine.sync_incremental()
+    assert store.get_file_count() == 3
+    assert store.get_checkpoint(CHANGES_TOKEN) == "c0"
+
+    client.change_log += [
+        {"fileId": "9", "file": {"id": "9", "name": "New", "mimeType": "text/plain", "modifiedTime": "t2"}},
+        {"fileId": "0", "file": {"id": "0", "name": "Renamed", "mimeType": "text/plain", "modifiedTime": "t2"}},
+        {"fileId": "1", "removed": True},
+        {"fileId": "2", "file": {"id": "2", "name": "F2", "mimeType": "text/plain", "modifiedTime": "t2", "trashed": True}},
+    ]
+    client.calls = 0
+    engine.sync_incremental()
+
+    # No re-listing happened, only the changes feed was read
+    assert client.calls == 0
+    assert store.get_checkpoint(CHANGES_TOKEN) == "c4"
+    with store._conn() as conn:
+        rows = {r["id"]: r["name"] for r in conn.execute("SELECT id, name FROM files WHERE deleted_at IS NULL")}
+    assert rows == {"0": "Renamed", "9": "New"}
+
+# Tests that an expired changes token falls back to a full listing
+def test_incremental_sync_falls_back_when_token_expires(tmp_path):
+    store = SQLiteStore(db_path=tmp_path / "test.db")
+    client = FakeChangesClient(make_pages(2))
+    engine = MetadataSyncEngine(client, store)
+    store.set_checkpoint(CHANGES_TOKEN, "c0")
+    client.change_log.append({"fileId": "5", "removed": True})
+    client.expired.add("c0")
+
+    engine.sync_incremental()
+
+    assert store.get_file_count() == 2
+    assert store.get_checkpoint(CHANGES_TOKEN) == "c1"
+
+# Tests that a fallback full listing does not revive a file the changes feed trashed
+def test_fallback_full_sync_skips_trashed_files(tmp_path):
+    store = SQLiteStore(db_path=tmp_path / "test.db")
+    client = FakeChangesClient(make_pages(3))
+    engine = MetadataSyncEngine(client, store)
+    engine.sync_incremental()
+
+    client.change_log.append(
+        {"fileId": "1", "file": {"id": "1", "name": "F1", "mimeType": "text/plain", "modifiedTime": "t2", "trashed": True}}
+    )
+    engine.sync_incremental()
+    assert store.get_file_count() == 2
+
+    # The listing still returns the trashed file, as a client without the trashed filter would
+    client.pages[1][0]["trashed"] = True
+    client.expired.add(store.get_checkpoint(CHANGES_TOKEN))
+    engine.sync_incremental()
+
+    assert store.get_file_count() == 2
+    assert store.get_file("1") is None
+    assert listing_query() == "trashed = false"
+    assert listing_query("mimeType = 'x'") == "(mimeType = 'x') and trashed = false"
+
+# Tests that pipelined sync writes every page and resumes after a fetch failure
+def test_prefetch_sync_resumes_after_failure(tmp_path):
+    store = SQLiteStore(db_path=tmp_path / "test.db")
+    client = FakeGDriveClient(make_pages(8), fail_after_pages=5)
+    engine = MetadataSyncEngine(client, store, prefetch=3)
+
+    try:
+        engine.sync()
+    except RuntimeError:
+        pass
+
+    # Pages fetched before the failure are written, the checkpoint follows them
+    assert store.get_file_count() == 5
+    assert store.get_checkpoint(CHECKPOINT_TOKEN) == "5"
+
+    client.fail_after_pages = None
+    engine.sync()
+    assert store.get_file_count() == 8
+    assert store.get_checkpoint(CHECKPOINT_TOKEN) is None
+
+# Tests that the fetcher never runs further ahead than the prefetch bound
+def test_prefetch_applies_backpressure(tmp_path):
+    store = SQLiteStore(db_path=tmp_path / "test.db")
+    client = FakeGDriveClient(make_pages(20))
+    engine = MetadataSyncEngine(client, store, prefetch=2)
+
+    written = []
+    lead = []
+    original_insert = store.insert_update_files
+
+    # Slow writer: records how far the fetcher got before each page is written
+    def slow_insert(files, *args):
+        import time
+        time.sleep(0.005)
+        lead.append(client.calls - len(written))
+        written.append(files)
+        return original_insert(files, *args)
+
+    store.insert_update_files = slow_insert
+    engine.sync()
+
+    assert store.get_file_count() == 20
+    # One page being written, two queued, one held by a blocked fetcher
+    assert max(lead) <= 4
+
+# Tests that refresh upserts found files and removes missing or trashed ones
+def test_refresh_by_file_id(tmp_path):
+    store = SQLiteStore(db_path=tmp_path / "test.db")
+    store.insert_update_files(make_pages(3)[0] + make_pages(3)[1] + make_pages(3)[2])
+
+    class BatchClient:
+        def get_files_batch(self, file_ids):
+            files = [
+                {"id": "0", "name": "Fresh", "mimeType": "text/plain", "modifiedTime": "t9"},
+                {"id": "1", "name": "F1", "mimeType": "text/plain", "modifiedTime": "t9", "trashed": True},
+            ]
+            return files, ["2"]
+
+    MetadataSyncEngine(BatchClient(), store).refresh(["0", "1", "2"])
+
+    with store._conn() as conn:
+        rows = {r["id"]: r["name"] for r in conn.execute("SELECT id, name FROM files WHERE deleted_at IS NULL")}
+    assert rows == {"0": "Fresh"}
+
+# Tests that a full sync tombstones rows Drive no longer lists
+def test_full_sync_tombstones_files_missing_from_drive(tmp_path):
+    store = SQLiteStore(db_path=tmp_path / "test.db")
+    pages = make_pages(4)
+    MetadataSyncEngine(FakeGDriveClient(pages), store).sync()
+    assert store.get_file_count() == 4
+
+    # File "2" disappears from Drive
+    MetadataSyncEngine(FakeGDriveClient([pages[0], pages[1], pages[3]]), store).sync()
+    assert store.get_file_count() == 3
+    with store._conn() as conn:
+        row = conn.execute("SELECT deleted_at FROM files WHERE id = '2'").fetchone()
+    assert row["deleted_at"] is not None
+    assert store.get_changes(since=4)[0]["op"] == "delete"
+
+    # It comes back on a later sync
+    MetadataSyncEngine(FakeGDriveClient(pages), store).sync()
+    assert store.get_file_count() == 4
+
+# Tests that a full re-sync of unchanged files rewrites no rows, yet still sweeps
+# the file Drive no longer lists, and leaves no seen IDs behind
+def test_full_resync_skips_unchanged_rows(tmp_path):
+    store = SQLiteStore(db_path=tmp_path / "test.db")
+    pages = make_pages(4)
+    MetadataSyncEngine(FakeGDriveClient(pages), store).sync()
+    changes = store.get_change_seq()
+
+    engine = MetadataSyncEngine(FakeGDriveClient(pages[:3]), store)
+    engine.sync()
+
+    counters = engine.metrics.snapshot()["counters"]
+    assert "rows_written" not in counters and counters["rows_unchanged"] == 3
+    assert store.get_file_count() == 3
+    assert [change["op"] for change in store.get_changes(since=changes)] == ["delete"]
+    with store._conn() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM files_seen").fetchone()[0] == 0
+
+# Tests that rows stamped before a crash aren't swept when the pass resumes
+def test_resumed_full_sync_keeps_generation(tmp_path):
+    store = SQLiteStore(db_path=tmp_path / "test.db")
+    MetadataSyncEngine(FakeGDriveClient(make_pages(4)), store).sync()
+
+    client = FakeGDriveClient(make_pages(4), fail_after_pages=2)
+    engine = MetadataSyncEngine(client, store)
+    try:
+        engine.sync()
+    except RuntimeError:
+        pass
+
+    # Resume lists pages 3-4 only; pages 1-2 were stamped in the same pass
+    client.fail_after_pages = None
+    engine.sync()
+    assert store.get_file_count() == 4
+
+# Tests that a pass resumed without a recorded generation (older version) doesn't sweep
+def test_resumed_full_sync_without_generation_skips_sweep(tmp_path):
+    store = SQLiteStore(db_path=tmp_path / "test.db")
+    MetadataSyncEngine(FakeGDriveClient(make_pages(4)), store).sync()
+    store.set_checkpoint(CHECKPOINT_TOKEN, "2")
+
+    assert store.begin_generation("pass", resume=True) is None
+    MetadataSyncEngine(FakeGDriveClient(make_pages(4)), store).sync()
+    assert store.get_file_count() == 4
+
+# Tests that sweeping works in batches and ignores already deleted rows
+def test_sweep_generation_in_batches(tmp_path):
+    store = SQLiteStore(db_path=tmp_path / "test.db")
+    store.insert_update_files([page[0] for page in make_pages(25)])
+    generation = store.begin_generation("pass", resume=False)
+
+    assert store.sweep_generation(generation, batch_size=10) == 25
+    assert store.sweep_generation(generation, batch_size=10) == 0
+    assert store.get_file_count() == 0
+
+# Tests that two targets with the same file IDs sync side by side:
+# separate rows, separate checkpoints, and a full sync only sweeps its own target
+def test_targets_are_isolated(tmp_path):
+    store = SQLiteStore(db_path=tmp_path / "test.db")
+    page = [{"id": str(i), "name": f"F{i}", "mimeType": "text/plain", "modifiedTime": "t1"} for i in range(3)]
+
+    class DriveClient:
+        def __init__(self, files):
+            self.files = files
+            self.drive_ids = []
+
+        def list_files(self, page_size=100, page_token=None, drive_id=None):
+            self.drive_ids.append(drive_id)
+            return self.files, None
+
+    shared = DriveClient(page)
+    MetadataSyncEngine(shared, store, target="team", drive_id="0AB").sync()
+    MetadataSyncEngine(DriveClient(page[:2]), store).sync()
+    assert shared.drive_ids == ["0AB"]
+    assert store.get_file_count("team") == 3
+    assert store.get_file_count("") == 2
+
+    # The default target loses a file; the shared drive keeps all three
+    MetadataSyncEngine(DriveClient(page[:1]), store).sync()
+    assert store.get_file_count("") == 1
+    assert store.get_file_count("team") == 3
+
+    # A crashed listing in one target resumes without touching the other's checkpoint
+    store.set_checkpoint(f"target:team:{CHECKPOINT_TOKEN}", "5")
+    assert store.get_checkpoint(CHECKPOINT_TOKEN) is None
+    assert MetadataSyncEngine(shared, store, target="team").checkpoint_key == f"target:team:{CHECKPOINT_TOKEN}"
@@ -0,0 +1,45 @@
+from api_client.gdrive_client import RetryableAPIError
+from persistence.store import SQLiteStore
+from sync_engine.metadata_sync import MetadataSyncEngine
+from sync_engine.page_sizing import AdaptivePageSize
+
+# Tests that fast pages grow the size up to the API maximum
+def test_page_size_grows_when_fast():
+    sizer = AdaptivePageSize(initial=100)
+    for _ in range(5):
+        sizer.record_success(0.1)
+    assert sizer.size == 1000
+
+# Tests that errors and slow pages shrink the size, never below the minimum
+def test_page_size_shrinks_on_errors_and_slow_pages():
+    sizer = AdaptivePageSize(initial=400, minimum=50)
+    sizer.record_error()
+    assert sizer.size == 200
+    sizer.record_success(10.0)
+    assert sizer.size == 100
+    sizer.record_error()
+    sizer.record_error()
+    assert sizer.size == 50
+
+# Tests that the engine passes the chosen size and retries throttled pages smaller
+def test_engine_uses_adaptive_page_size(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+
+    class ThrottlingClient:
+        def __init__(self):
+            self.sizes = []
+
+        def list_files(self, page_size=100, page_token=None):
+            self.sizes.append(page_size)
+            # Throttles the first request at any size above 200
+            if len(self.sizes) == 1 and page_size > 200:
+                raise RetryableAPIError("429")
+            index = int(page_token) if page_token else 0
+            files = [{"id": str(index), "name": "A", "mimeType": "text/plain", "modifiedTime": "t1"}]
+            return files, str(index + 1) if index < 2 else None
+
+    client = ThrottlingClient()
+    MetadataSyncEngine(client, store, page_size=400, adaptive_page_size=True).sync()
+
+    assert store.get_file_count() == 3
+    assert client.sizes == [400, 200, 400, 800]
@@ -0,0 +1,77 @@
+from persistence.store import SQLiteStore
+from sync_engine.sharded_sync import (
+    Shard,
+    ShardedSyncEngine,
+    mime_type_shards,
+    modified_time_shards,
+)
+
+# A fake Google Drive client that serves a separate page chain per query
+class ShardedFakeClient:
+    def __init__(self, pages_by_query, fail_queries=()):
+        self.pages_by_query = pages_by_query
+        self.fail_queries = set(fail_queries)
+        self.calls = []
+
+    def list_files(self, page_size=100, page_token=None, query=None):
+        if query in self.fail_queries:
+            raise RuntimeError("Simulated crash")
+        self.calls.append((query, page_token))
+        pages = self.pages_by_query[query]
+        index = int(page_token) if page_token else 0
+        next_token = str(index + 1) if index + 1 < len(pages) else None
+        return pages[index], next_token
+
+# Builds pages of single files with IDs unique to the shard
+def shard_pages(prefix, count):
+    return [
+        [{"id": f"{prefix}{i}", "name": "A", "mimeType": "text/plain", "modifiedTime": "t1"}]
+        for i in range(count)
+    ]
+
+# Tests that modifiedTime shards cover the whole range without gaps
+def test_modified_time_shards_are_contiguous():
+    shards = modified_time_shards(["2020-01-01T00:00:00", "2022-01-01T00:00:00"])
+    assert [s.query for s in shards] == [
+        "modifiedTime < '2020-01-01T00:00:00'",
+        "modifiedTime >= '2020-01-01T00:00:00' and modifiedTime < '2022-01-01T00:00:00'",
+        "modifiedTime >= '2022-01-01T00:00:00'",
+    ]
+
+# Tests that MIME shards include a complement shard for everything else
+def test_mime_type_shards_include_other():
+    shards = mime_type_shards({"images": ["image/png", "image/jpeg"]})
+    assert shards[0].query == "(mimeType = 'image/png' or mimeType = 'image/jpeg')"
+    assert shards[1] == Shard("mime:other", "mimeType != 'image/png' and mimeType != 'image/jpeg'")
+
+# Tests that all shards sync and their checkpoints are cleared at the end
+def test_sharded_sync_runs_every_shard(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    shards = [Shard("a", "qa"), Shard("b", "qb"), Shard("c", "qc")]
+    client = ShardedFakeClient({"qa": shard_pages("a", 3), "qb": shard_pages("b", 2), "qc": shard_pages("c", 1)})
+
+    ShardedSyncEngine(client, store, shards=shards, workers=3).sync()
+
+    assert store.get_file_count() == 6
+    for shard in shards:
+        assert store.get_checkpoint(ShardedSyncEngine.shard_key(shard)) is None
+        assert store.get_checkpoint(ShardedSyncEngine.done_key(shard)) is None
+
+# Tests that a failed shard is the only one repeated on the next run
+def test_sharded_sync_resumes_only_unfinished_shards(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    shards = [Shard("a", "qa"), Shard("b", "qb")]
+    pages = {"qa": shard_pages("a", 2), "qb": shard_pages("b", 2)}
+    client = ShardedFakeClient(pages, fail_queries=["qb"])
+
+    try:
+        ShardedSyncEngine(client, store, shards=shards).sync()
+    except RuntimeError:
+        pass
+    assert store.get_file_count() == 2
+
+    retry_client = ShardedFakeClient(pages)
+    ShardedSyncEngine(retry_client, store, shards=shards).sync()
+
+    assert store.get_file_count() == 4
+    assert {query for query, _ in retry_client.calls} == {"qb"}
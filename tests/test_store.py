@@ -42,3 +42,288 @@ def test_insert_update_file_overwrite(tmp_path):
 def test_get_file_count_empty(tmp_path):
     store = SQLiteStore(tmp_path / "test.db")
     assert store.get_file_count() == 0
+
+# Tests that a thread reuses one tuned WAL connection across calls
+def test_connection_is_reused_and_tuned(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db", synchronous="FULL")
+    first = store._connection()
+    store.set_checkpoint("key", "value")
+    assert store._connection() is first
+    assert first.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert first.execute("PRAGMA synchronous").fetchone()[0] == 2
+    store.close()
+
+# Tests that each thread gets its own connection and sees committed writes
+def test_connection_per_thread(tmp_path):
+    import threading
+
+    store = SQLiteStore(tmp_path / "test.db")
+    store.set_checkpoint("key", "main")
+    seen = {}
+
+    def worker():
+        seen["conn"] = store._connection()
+        seen["value"] = store.get_checkpoint("key")
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert seen["conn"] is not store._connection()
+    assert seen["value"] == "main"
+    store.close()
+
+# Tests that worker threads' connections are closed when they exit, so a
+# long-running runner keeps a bounded number of connections
+def test_connections_of_exited_threads_are_closed(tmp_path):
+    from sync_engine.run_jobs import JobRunner
+
+    store = SQLiteStore(tmp_path / "test.db")
+
+    class Client:
+        def list_files(self, page_size=100, page_token=None):
+            return [], None
+
+    # Every run starts fresh worker threads
+    for _ in range(10):
+        for _ in range(5):
+            store.create_job("metadata_sync")
+        JobRunner(store, workers=4, min_idle=0.01, client_factory=Client).run()
+    assert len(store.get_job_runs(limit=100)) == 50
+    assert len(store._connections) == 1
+    store.close()
+
+# Tests that a failed block rolls back and leaves the connection usable
+def test_conn_rolls_back_on_error(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    try:
+        with store._conn() as conn:
+            conn.execute("INSERT INTO sync_state (key, value) VALUES ('a', 'b')")
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    assert store.get_checkpoint("a") is None
+    store.set_checkpoint("a", "c")
+    assert store.get_checkpoint("a") == "c"
+
+# Tests that unchanged rows are skipped and only real changes are logged
+def test_upsert_skips_unchanged_rows_and_logs_changes(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    files = [
+        {"id": "1", "name": "A", "mimeType": "text/plain", "modifiedTime": "t1"},
+        {"id": "2", "name": "B", "mimeType": "text/plain", "modifiedTime": "t1"},
+    ]
+    assert store.insert_update_files(files) == 2
+    # Identical re-sync writes nothing
+    assert store.insert_update_files(files) == 0
+
+    files[1] = {"id": "2", "name": "B2", "mimeType": "text/plain", "modifiedTime": "t2"}
+    assert store.insert_update_files(files) == 1
+    store.delete_files(["1"])
+
+    changes = store.get_changes()
+    assert [(c["seq"], c["file_id"], c["op"]) for c in changes] == [
+        (1, "1", "insert"),
+        (2, "2", "insert"),
+        (3, "2", "update"),
+        (4, "1", "delete"),
+    ]
+    assert changes[2]["name"] == "B2"
+
+    # Reading from a cursor returns only later changes
+    assert [c["seq"] for c in store.get_changes(since=2, limit=1)] == [3]
+
+# Tests name, type and date search with keyset pagination
+def test_search_files(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    store.insert_update_files([
+        {"id": f"r{i}", "name": f"Quarterly Report {i}", "mimeType": "application/pdf", "modifiedTime": f"2024-01-0{i}"}
+        for i in range(1, 6)
+    ] + [
+        {"id": "n1", "name": "Meeting notes", "mimeType": "text/plain", "modifiedTime": "2024-01-03"},
+    ])
+
+    # Every word matches as a prefix, newest first
+    rows, cursor = store.search_files(name="quart rep", limit=2)
+    assert [row["id"] for row in rows] == ["r5", "r4"]
+    rows, cursor = store.search_files(name="quart rep", limit=2, cursor=cursor)
+    assert [row["id"] for row in rows] == ["r3", "r2"]
+    rows, cursor = store.search_files(name="quart rep", limit=2, cursor=cursor)
+    assert [row["id"] for row in rows] == ["r1"]
+    assert cursor is None
+
+    rows, _ = store.search_files(mime_type="text/plain")
+    assert [row["id"] for row in rows] == ["n1"]
+    rows, _ = store.search_files(modified_after="2024-01-02", modified_before="2024-01-04")
+    assert [row["id"] for row in rows] == ["r3", "n1", "r2"]
+    rows, _ = store.search_files(name="report", mime_type="application/pdf", modified_after="2024-01-05")
+    assert [row["id"] for row in rows] == ["r5"]
+    # FTS syntax in user input is treated as text
+    assert store.search_files(name='notes" OR "report')[0] == []
+
+    # Renames move the file in the index, tombstones drop it from results
+    store.insert_update_files([
+        {"id": "r1", "name": "Budget", "mimeType": "application/pdf", "modifiedTime": "2024-01-01"},
+    ])
+    store.delete_files(["r2"])
+    rows, _ = store.search_files(name="report")
+    assert [row["id"] for row in rows] == ["r5", "r4", "r3"]
+    assert [row["id"] for row in store.search_files(name="budg")[0]] == ["r1"]
+
+# Tests that filters are answered from the indexes rather than a table scan
+def test_search_uses_indexes(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    with store._conn() as conn:
+        plan = " ".join(row[3] for row in conn.execute(
+            """
+            EXPLAIN QUERY PLAN
+            SELECT id FROM files WHERE deleted_at IS NULL AND mime_type = ?
+            ORDER BY modified_time DESC, id DESC LIMIT 10
+            """,
+            ("text/plain",),
+        ))
+    assert "idx_files_live_mime_type" in plan
+    assert "TEMP B-TREE" not in plan
+
+def drive_file(file_id, name, parent=None, folder=False, size=None):
+    file = {
+        "id": file_id,
+        "name": name,
+        "mimeType": "application/vnd.google-apps.folder" if folder else "text/plain",
+        "modifiedTime": "t1",
+    }
+    if parent:
+        file["parents"] = [parent]
+    if size is not None:
+        file["size"] = str(size)
+    return file
+
+def paths(store):
+    with store._conn() as conn:
+        return {row["id"]: row["path"] for row in conn.execute("SELECT id, path FROM files WHERE deleted_at IS NULL")}
+
+# Tests that cached paths follow out-of-order arrival, renames and moves
+def test_paths_follow_hierarchy_changes(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    # Children arrive before their folders
+    store.insert_update_files([drive_file("doc", "plan.txt", "b", size=10)])
+    assert paths(store) == {"doc": "/plan.txt"}
+    store.insert_update_files([drive_file("b", "B", "a", folder=True), drive_file("a", "A", "root", folder=True)])
+    assert paths(store) == {"a": "/A", "b": "/A/B", "doc": "/A/B/plan.txt"}
+
+    # Renaming a folder rewrites its subtree
+    store.insert_update_files([drive_file("a", "Projects", "root", folder=True)])
+    assert paths(store)["doc"] == "/Projects/B/plan.txt"
+
+    # Moving a folder, together with a rename inside it
+    store.insert_update_files([
+        drive_file("c", "C", "root", folder=True),
+        drive_file("doc", "final.txt", "b", size=10),
+        drive_file("b", "B", "c", folder=True),
+    ])
+    assert paths(store) == {"a": "/Projects", "b": "/C/B", "c": "/C", "doc": "/C/B/final.txt"}
+
+# Tests path resolution, subtree listing and folder sizes
+def test_resolve_path_subtree_and_folder_size(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    store.insert_update_files([
+        drive_file("a", "A", "root", folder=True),
+        drive_file("b", "B", "a", folder=True),
+        drive_file("f1", "one", "a", size=5),
+        drive_file("f2", "two", "b", size=7),
+        drive_file("f3", "doc", "b"),
+        # Sibling whose name shares the prefix stays outside the subtree
+        drive_file("ab", "A0", "root", folder=True),
+        drive_file("f4", "other", "ab", size=100),
+    ])
+
+    assert store.resolve_path("/A/B/two") == "f2"
+    assert store.resolve_path("A/B/") == "b"
+    assert store.resolve_path("/A/missing") is None
+
+    rows, cursor = store.list_subtree("a", limit=2)
+    assert [row["id"] for row in rows] == ["b", "f3"]
+    rows, cursor = store.list_subtree("a", limit=2, cursor=cursor)
+    assert [row["id"] for row in rows] == ["f2", "f1"]
+    assert cursor is None
+
+    assert store.folder_size("a") == {"files": 3, "folders": 1, "bytes": 12}
+    store.delete_files(["f2"])
+    assert store.folder_size("a") == {"files": 2, "folders": 1, "bytes": 5}
+    assert store.folder_size("missing") == {"files": 0, "folders": 0, "bytes": 0}
+
+# Tests that the schema is created once and reopening the database runs no DDL
+def test_schema_version_skips_ddl_on_reopen(tmp_path):
+    from persistence.store import SCHEMA_VERSION
+    store = SQLiteStore(tmp_path / "test.db")
+    with store._conn() as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    store.close()
+
+    statements = []
+    reopened = SQLiteStore.__new__(SQLiteStore)
+    original = SQLiteStore._connection
+
+    def traced(self):
+        conn = original(self)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    SQLiteStore._connection = traced
+    try:
+        reopened.__init__(tmp_path / "test.db")
+    finally:
+        SQLiteStore._connection = original
+    assert "PRAGMA user_version" in statements
+    assert not [sql for sql in statements if sql.lstrip().upper().startswith(("CREATE", "ALTER", "DROP"))]
+
+# Tests that importing the CLI doesn't load the Google client libraries
+def test_cli_import_skips_google_client():
+    import subprocess
+    import sys
+    script = "import sys, sync_engine.cli; print([m for m in sys.modules if m.startswith(('googleapiclient', 'google_auth_oauthlib'))])"
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "[]"
+
+# Tests that iter_files pages through every live row in keyset order and resumes from a cursor
+def test_iter_files_keyset_batches(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    files = [
+        {"id": f"f{i:02d}", "name": f"N{i}", "mimeType": "text/plain", "modifiedTime": f"2024-01-{i % 5 + 1:02d}"}
+        for i in range(23)
+    ]
+    store.insert_update_files(files)
+    store.insert_update_files(files[:4], target="team")
+    store.delete_files(["f22"])
+
+    rows = list(store.iter_files(batch_size=5))
+    assert [(row["target"], row["id"]) for row in rows] == sorted(
+        [("", f["id"]) for f in files[:22]] + [("team", f["id"]) for f in files[:4]]
+    )
+
+    by_time = list(store.iter_files(order_by="modified_time", batch_size=4, target=""))
+    assert [row["modified_time"] for row in by_time] == sorted(row["modified_time"] for row in by_time)
+    assert len(by_time) == 22
+
+    # Resuming after the tenth row yields exactly the rest
+    cursor = store.file_cursor(by_time[9], "modified_time")
+    rest = list(store.iter_files(order_by="modified_time", batch_size=4, target="", cursor=cursor))
+    assert [row["id"] for row in rest] == [row["id"] for row in by_time[10:]]
+
+    assert {row["modified_time"] for row in store.iter_files(modified_since="2024-01-05")} == {"2024-01-05"}
+
+# Tests that iter_file_keys batches its reads, so writes made while it is suspended commit
+def test_iter_file_keys_does_not_hold_a_transaction(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    files = [{"id": f"f{i:02d}", "name": "N", "mimeType": "text/plain", "modifiedTime": "t1"} for i in range(23)]
+    store.insert_update_files(files)
+    store.insert_update_files(files[:3], target="team")
+    store.delete_files(["f05"])
+
+    keys = store.iter_file_keys(batch_size=5)
+    first = next(keys)
+    store.set_checkpoint("during_iteration", "1")
+    assert SQLiteStore(tmp_path / "test.db").get_checkpoint("during_iteration") == "1"
+
+    assert [first] + list(keys) == sorted(
+        [("", f["id"]) for f in files if f["id"] != "f05"] + [("team", f["id"]) for f in files[:3]]
+    )
@@ -1,4 +1,8 @@
+import sqlite3
+import threading
+import time
 from persistence.store import SQLiteStore
+from sync_engine.metadata_sync import CHECKPOINT_TOKEN
 from sync_engine.run_jobs import JobRunner
 
 # Tests entire life cycle of job within SQLiteStore from creation to completion
@@ -78,3 +82,447 @@ def test_fetch_pending_jobs_respects_attempts(tmp_path):
     # Only job2 should be returned
     assert len(pending_jobs) == 1
     assert pending_jobs[0]["id"] == second_id
+
+# Tests that concurrent claimers never receive the same job
+def test_claim_job_is_atomic(tmp_path):
+    import threading
+
+    store = SQLiteStore(tmp_path / "test.db")
+    job_ids = {store.create_job("metadata_sync") for _ in range(30)}
+    claimed = []
+    lock = threading.Lock()
+
+    def claimer(owner):
+        while True:
+            job = store.claim_job(owner, lease_seconds=60)
+            if job is None:
+                return
+            with lock:
+                claimed.append(job["id"])
+
+    threads = [threading.Thread(target=claimer, args=(f"w{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == sorted(job_ids)
+
+# Tests that only expired leases are reclaimed and old owners can't finish them
+def test_reclaim_only_expired_leases(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    live_id = store.create_job("metadata_sync")
+    expired_id = store.create_job("metadata_sync")
+    store.claim_job("live", lease_seconds=60)
+    store.claim_job("crashed", lease_seconds=60)
+
+    # Simulate the crashed runner's lease running out
+    with store._conn() as conn:
+        conn.execute(
+            "UPDATE jobs SET lease_expires_at = datetime('now', '-1 seconds') WHERE id = ?",
+            (expired_id,),
+        )
+
+    assert store.reclaim_expired_jobs() == 1
+    assert store.get_job(live_id)["status"] == "RUNNING"
+    assert store.get_job(expired_id)["status"] == "PENDING"
+    assert store.finish_job(expired_id, "crashed", "DONE") is False
+    assert store.finish_job(live_id, "live", "DONE") is True
+
+# Tests that a multi-worker runner drains the whole queue
+def test_runner_workers_drain_queue(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    for _ in range(6):
+        store.create_job("metadata_sync")
+
+    class Client:
+        def list_files(self, page_size=100, page_token=None):
+            return [{"id": "1", "name": "A", "mimeType": "text/plain", "modifiedTime": "t1"}], None
+
+    JobRunner(store, workers=3, client_factory=Client).run()
+
+    with store._conn() as conn:
+        statuses = [row["status"] for row in conn.execute("SELECT status FROM jobs")]
+    assert statuses == ["DONE"] * 6
+    assert store.get_file_count() == 1
+
+# Tests that serve mode starts a queued job right after a wakeup ping
+def test_serve_runs_job_after_wakeup(tmp_path):
+    import threading
+    import time
+    from sync_engine.notify import notify, socket_path
+
+    store = SQLiteStore(tmp_path / "test.db")
+
+    class Client:
+        def list_files(self, page_size=100, page_token=None):
+            return [{"id": "1", "name": "A", "mimeType": "text/plain", "modifiedTime": "t1"}], None
+
+    # Long poll interval: only the wakeup can explain a fast start
+    runner = JobRunner(store, poll_interval=30, client_factory=Client)
+    stop = threading.Event()
+    server = threading.Thread(target=runner.serve, args=(stop,))
+    server.start()
+    try:
+        # Let the server go idle first
+        time.sleep(0.3)
+        job_id = store.create_job("metadata_sync")
+        assert notify(socket_path(store.db_path))
+
+        deadline = time.monotonic() + 5
+        while store.get_job(job_id)["status"] != "DONE" and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert store.get_job(job_id)["status"] == "DONE"
+    finally:
+        stop.set()
+        server.join(timeout=5)
+    assert not server.is_alive()
+    # Nothing is listening once the server stopped
+    assert notify(socket_path(store.db_path)) is False
+
+# Tests that job payloads round-trip as JSON
+def test_job_payload_round_trip(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    job_id = store.create_job("refresh_files", payload={"file_ids": ["a", "b"]})
+    plain_id = store.create_job("metadata_sync")
+
+    assert store.job_payload(store.get_job(job_id)) == {"file_ids": ["a", "b"]}
+    assert store.job_payload(store.get_job(plain_id)) == {}
+
+# Tests that each job run is recorded with stage timers, row counts and an export file
+def test_runner_records_job_run_metrics(tmp_path):
+    import json
+
+    store = SQLiteStore(tmp_path / "test.db")
+    job_id = store.create_job("metadata_sync")
+    files = [{"id": str(i), "name": "A", "mimeType": "text/plain", "modifiedTime": "t1"} for i in range(3)]
+
+    class Client:
+        def list_files(self, page_size=100, page_token=None):
+            return files, None
+
+        def get_files_batch(self, file_ids):
+            return files, []
+
+    export = tmp_path / "metrics.prom"
+    JobRunner(store, client_factory=Client, metrics_export=str(export)).run()
+    # Same files again: every row is skipped
+    store.create_job("refresh_files", payload={"file_ids": ["0", "1", "2"]})
+    JobRunner(store, client_factory=Client, metrics_export=str(export)).run()
+
+    runs = store.get_job_runs()
+    assert [run["status"] for run in runs] == ["DONE", "DONE"]
+    assert runs[1]["job_id"] == job_id
+    first = json.loads(runs[1]["metrics"])
+    second = json.loads(runs[0]["metrics"])
+    assert set(first["timers"]) >= {"fetch", "write", "checkpoint", "commit"}
+    assert first["counters"]["rows_written"] == 3
+    assert second["counters"]["rows_unchanged"] == 3
+    assert "rows_written" not in second["counters"]
+
+    text = export.read_text()
+    assert 'gdrive_sync_job_runs_total{job_type="metadata_sync",status="DONE"} 1' in text
+    assert 'gdrive_sync_events_total{job_type="metadata_sync",event="rows_written"} 3' in text
+
+    # Counters keep counting after the runs they came from are purged
+    with store._conn() as conn:
+        conn.execute("DELETE FROM job_runs")
+    store.create_job("metadata_sync", payload={"again": True})
+    JobRunner(store, client_factory=Client, metrics_export=str(export)).run()
+    text = export.read_text()
+    assert "# TYPE gdrive_sync_job_runs_total counter" in text
+    assert 'gdrive_sync_job_runs_total{job_type="metadata_sync",status="DONE"} 2' in text
+    assert 'gdrive_sync_events_total{job_type="refresh_files",event="rows_unchanged"} 3' in text
+
+# Tests that the version 5 migration starts the metric totals from the recorded runs
+def test_metric_totals_migration_counts_existing_runs(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    metrics = {"timers": {"fetch": {"calls": 2, "seconds": 0.5}}, "counters": {"pages": 2}}
+    store.record_job_run(1, "metadata_sync", "w1", "DONE", 1.5, metrics)
+    store.record_job_run(2, "metadata_sync", "w1", "FAILED", 0.5, metrics)
+    with store._conn() as conn:
+        conn.execute("DROP TABLE job_metric_totals")
+        conn.execute("PRAGMA user_version = 4")
+    store.close()
+
+    totals = {
+        (row["metric"], row["label"]): row["value"]
+        for row in SQLiteStore(tmp_path / "test.db").get_metric_totals()
+    }
+    assert totals == {
+        ("events", "pages"): 4, ("job_duration_seconds", ""): 2.0, ("job_runs", "DONE"): 1,
+        ("job_runs", "FAILED"): 1, ("stage_calls", "fetch"): 4, ("stage_seconds", "fetch"): 1.0,
+    }
+
+# Tests that compaction archives old and excess finished jobs and leaves the queue alone
+def test_compact_jobs_retention(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    ids = [store.create_job("metadata_sync", payload={"pad": "x" * 2000}) for _ in range(8)]
+    with store._conn() as conn:
+        conn.execute("UPDATE jobs SET status = 'DONE' WHERE id IN (?, ?, ?, ?)", ids[:4])
+        conn.execute("UPDATE jobs SET status = 'DEAD' WHERE id = ?", (ids[4],))
+        conn.execute("UPDATE jobs SET status = 'FAILED' WHERE id = ?", (ids[5],))
+        # Two finished jobs are past the age limit
+        conn.execute(
+            "UPDATE jobs SET updated_at = datetime('now', '-10 days') WHERE id IN (?, ?)",
+            (ids[0], ids[1]),
+        )
+
+    # Age archives two, the row limit one more (the oldest remaining finished job)
+    result = store.compact_jobs(keep_days=7, keep_rows=2)
+    assert result["archived"] == 3
+    assert result["vacuumed_pages"] > 0
+    with store._conn() as conn:
+        remaining = [row["id"] for row in conn.execute("SELECT id FROM jobs ORDER BY id")]
+        history = {row["id"]: row["status"] for row in conn.execute("SELECT id, status FROM job_history")}
+    assert remaining == [ids[3], ids[4], ids[5], ids[6], ids[7]]
+    assert history == {ids[0]: "DONE", ids[1]: "DONE", ids[2]: "DONE"}
+
+    # Old history is purged
+    with store._conn() as conn:
+        conn.execute("UPDATE job_history SET finished_at = datetime('now', '-100 days') WHERE id = ?", (ids[0],))
+    assert store.compact_jobs(history_days=90)["purged"] == 1
+
+# Tests that the runner compacts at most once per interval
+def test_runner_compacts_when_due(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    runner = JobRunner(store, compact_interval=3600)
+    assert runner.compact_if_due() is not None
+    assert runner.compact_if_due() is None
+    assert JobRunner(store, compact_interval=None).compact_if_due() is None
+
+# Tests that claims respect the per-target limit while other targets run
+def test_claim_job_limits_running_jobs_per_target(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    first = store.create_job("metadata_sync", target="a")
+    second = store.create_job("metadata_sync", target="a")
+    other = store.create_job("metadata_sync", target="b")
+
+    assert store.claim_job("w1", lease_seconds=60, target_limit=1)["id"] == first
+    # Target a is busy, so the next claim skips ahead to target b
+    assert store.claim_job("w2", lease_seconds=60, target_limit=1)["id"] == other
+    assert store.claim_job("w3", lease_seconds=60, target_limit=1) is None
+
+    store.finish_job(first, "w1", "DONE")
+    assert store.claim_job("w3", lease_seconds=60, target_limit=1)["id"] == second
+
+# Tests that a runner works on different targets at the same time, one job per target
+def test_runner_runs_targets_concurrently(tmp_path):
+    import threading
+    import time
+
+    store = SQLiteStore(tmp_path / "test.db")
+    for target in ("a", "a", "b", "c"):
+        store.create_job("metadata_sync", target=target, payload={"drive_id": f"drive-{target}"})
+
+    lock = threading.Lock()
+    running = {}
+    peak = {"total": 0, "per_drive": 0}
+
+    class Client:
+        def list_files(self, page_size=100, page_token=None, drive_id=None):
+            with lock:
+                running[drive_id] = running.get(drive_id, 0) + 1
+                peak["total"] = max(peak["total"], sum(running.values()))
+                peak["per_drive"] = max(peak["per_drive"], running[drive_id])
+            time.sleep(0.1)
+            with lock:
+                running[drive_id] -= 1
+            return [{"id": "1", "name": drive_id, "mimeType": "text/plain", "modifiedTime": "t1"}], None
+
+    JobRunner(store, workers=3, min_idle=0.01, client_factory=Client).run()
+
+    with store._conn() as conn:
+        assert [row["status"] for row in conn.execute("SELECT status FROM jobs")] == ["DONE"] * 4
+    assert peak["total"] > 1
+    assert peak["per_drive"] == 1
+    assert store.get_file_count("a") == store.get_file_count("b") == 1
+
+# Tests that enqueueing with the key of a pending job returns that job
+def test_create_job_dedupes_pending_jobs(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    key = store.job_dedupe_key("metadata_sync", {"drive_id": "d"}, "d")
+    assert key == store.job_dedupe_key("metadata_sync", {"drive_id": "d"}, "d")
+
+    first = store.create_job("metadata_sync", payload={"drive_id": "d"}, target="d", dedupe_key=key)
+    assert store.create_job("metadata_sync", payload={"drive_id": "d"}, target="d", dedupe_key=key) == first
+    assert store.create_job("metadata_sync", dedupe_key=store.job_dedupe_key("metadata_sync")) != first
+    assert len(store.fetch_pending_jobs()) == 2
+
+    # Once the job runs, changes may land after its listing started, so one more can queue
+    assert store.claim_job("w1", lease_seconds=60)["id"] == first
+    second = store.create_job("metadata_sync", payload={"drive_id": "d"}, target="d", dedupe_key=key)
+    assert second != first
+    assert store.create_job("metadata_sync", payload={"drive_id": "d"}, target="d", dedupe_key=key) == second
+
+# Tests that claiming a job settles pending duplicates, including ones queued before the upgrade
+def test_claim_job_coalesces_pending_duplicates(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    ids = [store.create_job("metadata_sync", payload={"drive_id": "d"}, target="d") for _ in range(5)]
+    other = store.create_job("metadata_sync", target="e")
+
+    # Reopens the queue as a version 2 database, which had no dedupe keys
+    with store._conn() as conn:
+        conn.execute("DROP INDEX idx_jobs_pending_dedupe")
+        conn.execute("ALTER TABLE jobs DROP COLUMN dedupe_key")
+        conn.execute("ALTER TABLE jobs DROP COLUMN coalesced_into")
+        conn.execute("PRAGMA user_version = 2")
+    store = SQLiteStore(tmp_path / "test.db")
+    assert store.create_job(
+        "metadata_sync", payload={"drive_id": "d"}, target="d",
+        dedupe_key=store.job_dedupe_key("metadata_sync", {"drive_id": "d"}, "d"),
+    ) == ids[0]
+
+    runs = []
+
+    class Client:
+        def list_files(self, page_size=100, page_token=None, drive_id=None):
+            runs.append(drive_id)
+            return [], None
+
+    JobRunner(store, min_idle=0.01, client_factory=Client).run()
+
+    # One sync per distinct job; the duplicates point at the run that covered them
+    assert sorted(runs, key=str) == [None, "d"]
+    statuses = {job_id: (store.get_job(job_id)["status"], store.get_job(job_id)["coalesced_into"]) for job_id in ids + [other]}
+    assert statuses[ids[0]] == ("DONE", None)
+    assert statuses[other] == ("DONE", None)
+    assert all(statuses[job_id] == ("COALESCED", ids[0]) for job_id in ids[1:])
+    assert store.compact_jobs(keep_days=0, keep_rows=0)["archived"] == 6
+
+# Tests that due jobs are claimed by priority and delayed jobs wait, using the due index
+def test_claim_job_orders_by_priority_and_run_after(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    normal = store.create_job("metadata_sync")
+    delayed = store.create_job("metadata_sync", priority=10, delay_seconds=3600)
+    urgent = store.create_job("refresh_files", priority=5, payload={"file_ids": ["a"]})
+
+    assert [job["id"] for job in store.fetch_pending_jobs()] == [urgent, normal]
+    with store._conn() as conn:
+        plan = " ".join(row["detail"] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM jobs WHERE status = 'PENDING' AND run_after <= datetime('now') "
+            "AND attempts < max_attempts ORDER BY priority DESC, run_after, id"
+        ))
+    assert "idx_jobs_due" in plan
+    with store._conn() as conn:
+        reclaim_plan = " ".join(row["detail"] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM jobs WHERE status = 'RUNNING'"
+        ))
+        assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_jobs_queue'").fetchone() is None
+    assert "idx_jobs_due" in reclaim_plan
+
+    assert store.claim_job("w1", lease_seconds=60)["id"] == urgent
+    assert store.claim_job("w1", lease_seconds=60)["id"] == normal
+    assert store.claim_job("w1", lease_seconds=60) is None
+
+    # A duplicate request without delay makes the delayed job due now
+    key = store.job_dedupe_key("metadata_sync")
+    with store._conn() as conn:
+        conn.execute("UPDATE jobs SET dedupe_key = ? WHERE id = ?", (key, delayed))
+    assert store.create_job("metadata_sync", dedupe_key=key) == delayed
+    assert store.claim_job("w1", lease_seconds=60)["id"] == delayed
+
+# Tests that a failed job goes back to the queue after a backoff instead of retrying at once
+def test_failed_job_retries_after_backoff(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    job_id = store.create_job("metadata_sync")
+    calls = []
+
+    class FailingClient:
+        def list_files(self, page_size=100, page_token=None):
+            calls.append(page_token)
+            raise RuntimeError("Drive is down")
+
+    runner = JobRunner(store, min_idle=0.01, client_factory=FailingClient, retry_base_seconds=60)
+    assert all(30 <= runner.retry_delay(1) <= 60 for _ in range(100))
+    assert runner.retry_max_seconds / 2 <= runner.retry_delay(20) <= runner.retry_max_seconds
+    runner.run()
+
+    # One attempt, then the runner stops: the retry isn't due yet
+    assert len(calls) == 1
+    job = store.get_job(job_id)
+    assert (job["status"], job["attempts"], job["last_error"]) == ("PENDING", 1, "Drive is down")
+    assert store.fetch_pending_jobs() == []
+    assert store.get_job_runs(job_id=job_id)[0]["status"] == "FAILED"
+
+    with store._conn() as conn:
+        conn.execute("UPDATE jobs SET run_after = datetime('now') WHERE id = ?", (job_id,))
+    assert store.claim_job("w1", lease_seconds=60)["id"] == job_id
+
+    # A sub-second delay still holds the job back rather than rounding to none
+    with store._conn() as conn:
+        before = conn.execute("SELECT datetime('now')").fetchone()[0]
+    assert store.finish_job(job_id, "w1", "FAILED", "Drive is down", retry_after_seconds=0.5)
+    assert store.get_job(job_id)["run_after"] > before
+
+# Tests that due schedules queue one job each and skip ahead past missed runs
+def test_schedules_queue_due_jobs(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    store.set_schedule("inc", "incremental_sync", 300, payload={"drive_id": "d"}, target="d", priority=2,
+                       first_run_at="2000-01-01 00:00:00")
+    store.set_schedule("nightly", "metadata_sync", 86400, first_run_at="2999-01-01 02:00:00")
+
+    job_ids = store.enqueue_due_schedules()
+    assert len(job_ids) == 1
+    job = store.get_job(job_ids[0])
+    assert (job["type"], job["target"], job["priority"]) == ("incremental_sync", "d", 2)
+    assert store.job_payload(job) == {"drive_id": "d"}
+    assert store.enqueue_due_schedules() == []
+
+    with store._conn() as conn:
+        next_run, in_future, aligned = conn.execute(
+            """
+            SELECT next_run_at, next_run_at > datetime('now'),
+                (strftime('%s', next_run_at) - strftime('%s', '2000-01-01 00:00:00')) % 300 = 0
+            FROM schedules WHERE name = 'inc'
+            """
+        ).fetchone()
+        assert in_future and aligned
+        # The next slot passes while the last run is still queued: no second job
+        conn.execute("UPDATE schedules SET next_run_at = datetime('now', '-1 seconds') WHERE name = 'inc'")
+    assert store.enqueue_due_schedules() == job_ids
+    assert [schedule["name"] for schedule in store.get_schedules()] == ["inc", "nightly"]
+    assert store.delete_schedule("inc") and not store.delete_schedule("inc")
+
+# Tests that a job whose lease is taken over stops before committing another page
+def test_lost_lease_aborts_job_before_commit(tmp_path):
+    store = SQLiteStore(tmp_path / "test.db")
+    job_id = store.create_job("metadata_sync")
+
+    class StolenLeaseClient:
+        def list_files(self, page_size=100, page_token=None):
+            # Another runner reclaims the job while this page is fetched
+            with SQLiteStore(tmp_path / "test.db")._conn() as conn:
+                conn.execute("UPDATE jobs SET lease_owner = 'other' WHERE id = ?", (job_id,))
+            time.sleep(0.5)
+            return [{"id": "a", "name": "A", "mimeType": "text/plain", "modifiedTime": "t1"}], None
+
+    JobRunner(store, lease_seconds=0.3, min_idle=0.01, client_factory=StolenLeaseClient).run()
+
+    assert store.get_checkpoint(CHECKPOINT_TOKEN) is None
+    assert store.get_file_count() == 0
+    assert store.get_job(job_id)["lease_owner"] == "other"
+    assert store.get_job_runs(job_id=job_id)[0]["status"] == "FAILED"
+
+# Tests that lease renewal rides out a locked database, and gives up once the lease runs out
+def test_heartbeat_retries_until_lease_runs_out(tmp_path):
+    runner = JobRunner(SQLiteStore(tmp_path / "test.db"), lease_seconds=0.6)
+    calls = []
+
+    def renew_lease(job_id, owner, lease_seconds):
+        calls.append(job_id)
+        if len(calls) <= 2 or job_id == 2:
+            raise sqlite3.OperationalError("database is locked")
+        return True
+
+    runner.store.renew_lease = renew_lease
+    stop, lost = threading.Event(), threading.Event()
+    heartbeat = threading.Thread(target=runner._heartbeat, args=(1, "w1", stop, lost))
+    heartbeat.start()
+    time.sleep(1)
+    stop.set()
+    heartbeat.join()
+    assert len(calls) > 3 and not lost.is_set()
+
+    runner._heartbeat(2, "w1", threading.Event(), lost)
+    assert lost.is_set()